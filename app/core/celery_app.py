@@ -1,6 +1,19 @@
+import logging
+
 from celery import Celery
+from celery.signals import celeryd_after_setup, worker_ready, worker_shutdown
 
 from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.services.media_cache import MediaCache
+from app.services.node_registry import NodeRegistry
+from app.services.peer_cache import serve_cache
+from app.services.render_scheduler import (
+    start_slot_heartbeat,
+    unregister_heavy_worker,
+)
+
+logger = logging.getLogger(__name__)
 
 celery_app = Celery(
     "video_worker",
@@ -19,4 +32,49 @@ celery_app.conf.update(
     enable_utc=True,
     worker_prefetch_multiplier=1,
     result_expires=3600,
+    broker_transport_options={
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+    },
 )
+
+
+@celeryd_after_setup.connect
+def on_worker_setup(sender, instance, **kwargs):
+    # Workers also consume the tasks routed to this node: renders because it
+    # holds their inputs, uploads, previews and cleanups because they read
+    # or remove its local files
+    if not settings.MULTI_NODE:
+        return
+    queues = instance.app.amqp.queues
+    for kind in ("heavy", "light", "preview"):
+        if kind in queues.consume_from:
+            queues.select_add(NodeRegistry.queue(settings.NODE_ID, kind))
+
+
+@worker_ready.connect
+def on_worker_ready(sender, **kwargs):
+    heavy = "heavy" in sender.app.amqp.queues.consume_from
+    if heavy:
+        # Render windows are sized from the heavy slots that are actually live
+        start_slot_heartbeat(
+            get_redis(), sender.hostname, sender.controller.concurrency
+        )
+    if not settings.MULTI_NODE:
+        return
+    # Every node serves what it downloaded or synthesized, whether or not it
+    # renders. Only heavy workers announce slots and take renders
+    registry = NodeRegistry(get_redis())
+    registry.sync([path.name for path in MediaCache().entries()])
+    try:
+        serve_cache()
+    except OSError as e:
+        # Another worker of this node may already be serving the cache
+        logger.info("Cache server of %s not started: %s", settings.NODE_ID, e)
+    registry.start_heartbeat(sender.controller.concurrency if heavy else None)
+
+
+@worker_shutdown.connect
+def on_worker_shutdown(sender, **kwargs):
+    unregister_heavy_worker(get_redis(), sender.hostname)
@@ -1,26 +1,85 @@
 import json
+import socket
 from pathlib import Path
+from typing import Literal
 
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
     ELEVENLABS_API_KEY: str
+    ELEVENLABS_BASE_URL: str | None = None
 
     TEMP_DIR: Path = Path("/tmp")
+    DOWNLOAD_BACKEND: Literal["threads", "async"] = "threads"
     MAX_DOWNLOAD_WORKERS: int = 10
+    MAX_DOWNLOAD_CONNECTIONS: int = 50
+    MAX_CONNECTIONS_PER_HOST: int = 6
+    MAX_DOWNLOAD_BUFFER_SIZE: int = 1024 * 1024
+    RANGED_DOWNLOAD_MIN_SIZE: int = 32 * 1024 * 1024
+    RANGED_DOWNLOAD_SEGMENTS: int = 4
     MAX_WORKERS_FOR_TTS: int = 2
+    TTS_MODEL_ID: str = "eleven_multilingual_v2"
+    TTS_OUTPUT_FORMAT: str = "mp3_44100_128"
+    TTS_RATE_LIMIT: float = 2.0
+    TTS_BURST: int = 2
+    TTS_MAX_RETRIES: int = 5
+    TTS_VOICE_MAP_TTL: int = 3600
+    TTS_VOICE_MAP_REFRESH_AHEAD: int = 300
+    TTS_VOICE_MAP_MIN_AGE: int = 60
+    TTS_VOICE_MAP_LOCK_TIMEOUT: int = 30
     CHUNK_SIZE: int = 16384
 
+    MEDIA_CACHE_DIR: Path | None = None
+    MEDIA_CACHE_MAX_BYTES: int = 20 * 1024**3
+    DISK_FREE_WATERMARK: int = 5 * 1024**3
+    DISK_RETRY_DELAY: int = 30
+    DISK_ADMISSION_RETRIES: int = 120
+    OUTPUT_SIZE_ESTIMATE: int = 64 * 1024**2
+
     VIDEO_WIDTH: int = 1080
     VIDEO_HEIGHT: int = 1920
-    MAX_COMBINATIONS: int = 100
+    MAX_COMBINATIONS: int = 10000
+    MAX_RENDITIONS: int = 4
+    PREVIEW_WIDTH: int = 360
+    PREVIEW_HEIGHT: int = 640
+    PREVIEW_PRIORITY_OFFSET: int = 3
+    RENDER_BATCH_SIZE: int = 4
+    AUDIO_MIX_STEP: float = 5.0
+    RENDER_COST_DEFAULT_RATE: float = 0.1
+    RENDER_COST_ALPHA: float = 0.2
+    HEAVY_WORKER_SLOTS: int = 2
+    HEAVY_WORKER_TTL: int = 30
+    MAX_RENDERS_PER_TASK: int = 4
+    RENDER_LOOKAHEAD: int = 32
+    REQUEST_DEDUP_TTL: int = 6 * 3600
+    TASK_MAX_RETRIES: int = 5
+    TASK_RETRY_BACKOFF_MAX: int = 600
 
     GCS_BUCKET_NAME: str
     GCS_SERVICE_ACCOUNT_JSON: str
+    GCS_EMULATOR_HOST: str | None = None
+    GCS_UPLOAD_CHUNK_SIZE: int = 8 * 1024 * 1024
+    GCS_UPLOAD_WORKERS: int = 8
+    GCS_COMPOSITE_THRESHOLD: int = 64 * 1024 * 1024
+    GCS_COMPOSITE_PARTS: int = 8
+    STREAM_UPLOADS: bool = False
+    RESULT_CACHE_PREFIX: str = "result_cache"
+    RESULT_CACHE_TTL_DAYS: int = 30
 
     REDIS_URL: str = "redis://redis:6379/0"
 
+    MULTI_NODE: bool = False
+    NODE_ID: str = socket.gethostname()
+    NODE_URL: str | None = None
+    NODE_PORT: int = 8001
+    NODE_TTL: int = 30
+
+    @property
+    def media_cache_dir(self) -> Path:
+        return self.MEDIA_CACHE_DIR or self.TEMP_DIR.joinpath("media_cache")
+
     @property
     def gcs_credentials(self):
         try:
@@ -28,6 +87,18 @@ class Settings(BaseSettings):
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid GCS credentials: {e}")
 
+    @model_validator(mode="after")
+    def check_download_backend(self):
+        # Only the threads backend splits downloads into ranges, ranged
+        # settings given to the async backend would be silently ignored
+        ranged = {"RANGED_DOWNLOAD_MIN_SIZE", "RANGED_DOWNLOAD_SEGMENTS"}
+        if self.DOWNLOAD_BACKEND == "async" and ranged & self.model_fields_set:
+            raise ValueError(
+                "RANGED_DOWNLOAD_* settings need DOWNLOAD_BACKEND=threads, "
+                "the async backend has no ranged downloads"
+            )
+        return self
+
     model_config = SettingsConfigDict(env_file=".env")
 
 
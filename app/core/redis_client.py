@@ -0,0 +1,12 @@
+import redis
+
+from app.core.config import settings
+
+_client = None
+
+
+def get_redis() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
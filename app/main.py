@@ -1,10 +1,17 @@
-from fastapi import FastAPI
+import uuid
+
+from fastapi import FastAPI, HTTPException
 from celery.signals import setup_logging as celery_setup_logging
 from starlette import status
 
 from app.core.logging_config import setup_logging
 from app.core.celery_app import celery_app
-from app.schemas import MediaRequest
+from app.core.redis_client import get_redis
+from app.schemas import MediaRequest, RejectRequest
+from app.services.node_registry import NodeRegistry
+from app.services.render_scheduler import RenderScheduler
+from app.services.request_registry import RequestRegistry
+from app.services.result_cache import ResultCache
 from app.tasks import orchestrator
 
 setup_logging()
@@ -19,6 +26,70 @@ def on_celery_setup_logging(**kwargs):
 
 @app.post("/process_media", status_code=status.HTTP_202_ACCEPTED)
 def process_media(data: MediaRequest):
-    task = orchestrator.delay(data.model_dump(mode="json"))
+    payload = data.model_dump(mode="json")
+    registry = RequestRegistry(get_redis())
+    task_id = str(uuid.uuid4())
+
+    # A retried submission of a request that is still running gets the
+    # running task's id instead of a second orchestration
+    key = RequestRegistry.make_key(payload)
+    existing = registry.register(key, task_id)
+    if existing != task_id:
+        return {"task_id": existing, "status": "accepted"}
+
+    # A request that never reached the broker must not block its retries
+    try:
+        orchestrator.apply_async(args=(payload,), task_id=task_id)
+    except Exception:
+        registry.release(key, task_id)
+        raise
+    return {"task_id": task_id, "status": "accepted"}
+
+
+@app.post("/tasks/{task_id}/reject")
+def reject_combinations(task_id: str, data: RejectRequest):
+    scheduler = RenderScheduler(get_redis(), task_id)
+    if not scheduler.meta:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Task is not rendering")
+
+    # Final renders of rejected combinations are dropped when dispatched or,
+    # if already queued, when a worker picks them up
+    scheduler.reject(data.indexes)
+    return {"task_id": task_id, "rejected": data.indexes}
+
+
+@app.post("/tasks/{task_id}/resume", status_code=status.HTTP_202_ACCEPTED)
+def resume_task(task_id: str):
+    scheduler = RenderScheduler(get_redis(), task_id)
+    data = scheduler.checkpoint_data
+    if data is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Task has nothing to resume")
+    if scheduler.meta or not scheduler.claim_resume():
+        raise HTTPException(status.HTTP_409_CONFLICT, "Task is already running")
+
+    # The same task id picks up its completion records, so only the missing
+    # combinations are rendered, from inputs still in the media cache
+    registry = RequestRegistry(get_redis())
+    key = RequestRegistry.make_key(data)
+    existing = registry.register(key, task_id)
+    if existing != task_id:
+        scheduler.release_resume()
+        return {"task_id": existing, "status": "accepted"}
+
+    try:
+        orchestrator.apply_async(args=(data,), task_id=task_id)
+    except Exception:
+        registry.release(key, task_id)
+        scheduler.release_resume()
+        raise
+    return {"task_id": task_id, "status": "accepted", "missing": scheduler.missing}
+
+
+@app.get("/stats/result_cache")
+def result_cache_stats():
+    return ResultCache(get_redis()).stats()
+
 
-    return {"task_id": task.id, "status": "accepted"}
+@app.get("/stats/nodes")
+def node_stats():
+    return NodeRegistry(get_redis()).stats()
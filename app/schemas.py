@@ -8,11 +8,23 @@ class SpeechText(BaseModel):
     voice: str
 
 
+class Rendition(BaseModel):
+    name: str = Field(..., pattern=r"^[a-zA-Z0-9_-]+$")
+    width: int = Field(..., ge=16, le=4096, multiple_of=2)
+    height: int = Field(..., ge=16, le=4096, multiple_of=2)
+
+
 class MediaRequest(BaseModel):
     task_name: str = Field(..., pattern=r"^[a-zA-Z0-9_-]+$")
     video_blocks: dict[str, list[HttpUrl]] = Field(..., min_length=1)
     audio_blocks: dict[str, list[HttpUrl]] = Field(..., min_length=1)
     text_to_speech: list[SpeechText] = Field(..., min_length=1)
+    target_count: int | None = Field(None, ge=1, le=settings.MAX_COMBINATIONS)
+    seed: int = 0
+    renditions: list[Rendition] = Field(
+        default_factory=list, max_length=settings.MAX_RENDITIONS
+    )
+    preview: bool = False
 
     @model_validator(mode="after")
     def validate_blocks(self):
@@ -23,7 +35,9 @@ class MediaRequest(BaseModel):
 
             combinations *= len(urls)
 
-        if combinations > settings.MAX_COMBINATIONS:
+        # With a target count only the sampled subset is rendered, so the full
+        # product may be as large as it likes
+        if not self.target_count and combinations > settings.MAX_COMBINATIONS:
             raise ValueError(
                 f"Too many combinations of videos: {combinations}. Max is {settings.MAX_COMBINATIONS}"
             )
@@ -32,4 +46,12 @@ class MediaRequest(BaseModel):
             if not urls:
                 raise ValueError(f"Audio block {block_name} is empty")
 
+        names = [rendition.name for rendition in self.renditions]
+        if len(set(names)) != len(names):
+            raise ValueError("Rendition names must be unique")
+
         return self
+
+
+class RejectRequest(BaseModel):
+    indexes: list[int] = Field(..., min_length=1)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import mimetypes
+import time
+from pathlib import Path
+from typing import Callable
+
+import httpx
+
+from app.core.config import settings
+from app.services.media_cache import MediaCache
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDownloader:
+
+    def __init__(self, cache: MediaCache):
+        self.cache = cache
+        self._global_limit = asyncio.Semaphore(settings.MAX_DOWNLOAD_CONNECTIONS)
+        self._host_limits = {}
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = httpx.URL(url).host
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(
+                settings.MAX_CONNECTIONS_PER_HOST
+            )
+        return self._host_limits[host]
+
+    @staticmethod
+    def make_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=settings.MAX_DOWNLOAD_CONNECTIONS,
+                max_keepalive_connections=settings.MAX_DOWNLOAD_CONNECTIONS,
+            ),
+        )
+
+    async def _get_validators(
+        self, url: str, client: httpx.AsyncClient
+    ) -> tuple[str, str]:
+        try:
+            response = await client.head(url, follow_redirects=True)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning("HEAD %s failed, caching by URL only: %s", url, e)
+            return "", ""
+
+        return (
+            response.headers.get("ETag", ""),
+            response.headers.get("Last-Modified", ""),
+        )
+
+    async def _fetch(
+        self, url: str, key: str, expected_mime: str, client: httpx.AsyncClient
+    ) -> Path:
+        partial_path = self.cache.partial_path(key)
+        buffer = bytearray()
+        # Small files are written in small blocks, long transfers grow the
+        # buffer so the disk sees fewer and larger writes
+        flush_size = settings.CHUNK_SIZE
+
+        try:
+            async with client.stream("GET", url, follow_redirects=True) as response:
+                response.raise_for_status()
+
+                content_type = response.headers.get("Content-Type", "").lower()
+                if expected_mime not in content_type:
+                    raise ValueError(
+                        f"Expected mime type "
+                        f"'{expected_mime}' but got "
+                        f"'{content_type}'"
+                    )
+
+                with open(partial_path, "wb") as f:
+                    async for chunk in response.aiter_bytes():
+                        buffer.extend(chunk)
+                        if len(buffer) >= flush_size:
+                            # Awaiting the write also stops reading from the socket
+                            # until the disk has caught up
+                            await asyncio.to_thread(f.write, bytes(buffer))
+                            buffer.clear()
+                            flush_size = min(
+                                flush_size * 2, settings.MAX_DOWNLOAD_BUFFER_SIZE
+                            )
+
+                    if buffer:
+                        await asyncio.to_thread(f.write, bytes(buffer))
+        except Exception:
+            if partial_path.exists():
+                partial_path.unlink()
+            raise
+
+        return partial_path
+
+    async def download_file(
+        self,
+        url: str,
+        folder: Path,
+        expected_mime: str,
+        client: httpx.AsyncClient,
+        headers: httpx.Headers | None = None,
+    ) -> tuple[str, Path, int]:
+
+        start_time = time.perf_counter()
+
+        ext = mimetypes.guess_extension(expected_mime)
+        if not ext:
+            logger.error("Unsupported file extension: %s", expected_mime)
+            raise ValueError(f"No {expected_mime} file extension found")
+
+        async with self._global_limit, self._host_limit(url):
+            if headers is None:
+                validators = await self._get_validators(url, client)
+            else:
+                validators = headers.get("ETag", ""), headers.get("Last-Modified", "")
+            key = MediaCache.make_key(url, *validators)
+            local_path = folder.joinpath(key + ext)
+
+            if local_path.exists():
+                logger.info("%s already cached", local_path.name)
+                return url, local_path, local_path.stat().st_size
+
+            try:
+                # Cache lookups and the flock block, they run off the event loop
+                lock_file = await asyncio.to_thread(self.cache.acquire_lock, key)
+                try:
+                    entry = await asyncio.to_thread(self.cache.get, key, ext)
+                    if entry:
+                        logger.info("%s found in media cache", entry.name)
+                    else:
+                        await self._fetch(url, key, expected_mime, client)
+                        entry = await asyncio.to_thread(self.cache.commit, key, ext)
+
+                        logger.info(
+                            "Downloaded %s (%.2f MB) in %.2fs",
+                            entry.name,
+                            entry.stat().st_size / (1024 * 1024),
+                            time.perf_counter() - start_time,
+                        )
+
+                    await asyncio.to_thread(self.cache.link, entry, local_path)
+                finally:
+                    await asyncio.to_thread(self.cache.release_lock, lock_file)
+
+                return url, local_path, local_path.stat().st_size
+
+            except Exception as e:
+                logger.error("Failed to download %s: %s", url, str(e))
+                raise
+
+    async def download_many(
+        self,
+        jobs: list[tuple[str, Path, str]],
+        client: httpx.AsyncClient | None = None,
+        on_ready: Callable[[str, Path], None] | None = None,
+        headers: dict[str, httpx.Headers] | None = None,
+    ) -> list[tuple[str, Path, int]]:
+        if client is None:
+            async with self.make_client() as client:
+                return await self.download_many(jobs, client, on_ready, headers)
+
+        async def download(url: str, folder: Path, expected_mime: str):
+            result = await self.download_file(
+                url, folder, expected_mime, client, (headers or {}).get(url)
+            )
+            if on_ready:
+                await asyncio.to_thread(on_ready, url, result[1])
+            return result
+
+        return await asyncio.gather(
+            *[
+                download(url, folder, expected_mime)
+                for url, folder, expected_mime in jobs
+            ]
+        )
@@ -0,0 +1,59 @@
+import logging
+import shutil
+from pathlib import Path
+
+import redis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DiskGuard:
+    KEY = "disk:reserved"
+
+    def __init__(self, client: redis.Redis, path: Path | None = None):
+        self.client = client
+        self.path = path or settings.TEMP_DIR
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def footprint(download_bytes: int, outputs: int) -> int:
+        # Downloads plus their normalized copies, which come out at about the
+        # same size, and the rendered videos waiting for upload at once
+        return 2 * download_bytes + outputs * settings.OUTPUT_SIZE_ESTIMATE
+
+    def free_bytes(self) -> int:
+        return shutil.disk_usage(self.path).free
+
+    def has_room(self) -> bool:
+        return self.free_bytes() >= settings.DISK_FREE_WATERMARK
+
+    def admit(self, task_id: str, footprint: int) -> bool:
+        # Space promised to requests that are still downloading is already
+        # spoken for, even though it isn't used yet
+        def reserve(pipe):
+            reserved = sum(
+                int(size)
+                for other, size in pipe.hgetall(self.KEY).items()
+                if other != task_id
+            )
+            available = self.free_bytes() - reserved - footprint
+            if available < settings.DISK_FREE_WATERMARK:
+                return False
+            pipe.multi()
+            pipe.hset(self.KEY, task_id, footprint)
+            return True
+
+        admitted = self.client.transaction(reserve, self.KEY, value_from_callable=True)
+        if not admitted:
+            logger.info(
+                "Not enough space in %s for %s (%.2f MB needed)",
+                self.path,
+                task_id,
+                footprint / (1024 * 1024),
+            )
+        return admitted
+
+    def release(self, task_id: str):
+        self.client.hdel(self.KEY, task_id)
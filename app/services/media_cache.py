@@ -0,0 +1,146 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.services.node_registry import NodeRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    PARTIAL_SUFFIX = ".part"
+    METADATA_SUFFIX = ".json"
+
+    def __init__(self, cache_dir: Path | None = None, max_bytes: int | None = None):
+        self.cache_dir = cache_dir or settings.media_cache_dir
+        self.max_bytes = (
+            settings.MEDIA_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        )
+        self.lock_dir = self.cache_dir.joinpath("locks")
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def entry_path(self, key: str, ext: str) -> Path:
+        return self.cache_dir.joinpath(key + ext)
+
+    def partial_path(self, key: str) -> Path:
+        return self.cache_dir.joinpath(key + self.PARTIAL_SUFFIX)
+
+    def metadata_path(self, key: str) -> Path:
+        return self.cache_dir.joinpath(key + self.METADATA_SUFFIX)
+
+    def read_metadata(self, key: str) -> dict | None:
+        try:
+            return json.loads(self.metadata_path(key).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def write_metadata(self, key: str, record: dict):
+        path = self.metadata_path(key)
+        partial_path = path.with_name(path.name + self.PARTIAL_SUFFIX)
+        partial_path.write_text(json.dumps(record))
+        os.replace(partial_path, path)
+
+    def get(self, key: str, ext: str) -> Path | None:
+        path = self.entry_path(key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def acquire_lock(self, key: str, blocking: bool = True):
+        lock_file = open(self.lock_dir.joinpath(f"{key}.lock"), "a")
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except OSError:
+            lock_file.close()
+            raise
+        return lock_file
+
+    @staticmethod
+    def release_lock(lock_file):
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    @contextmanager
+    def lock(self, key: str, blocking: bool = True):
+        lock_file = self.acquire_lock(key, blocking)
+        try:
+            yield
+        finally:
+            self.release_lock(lock_file)
+
+    def commit(self, key: str, ext: str) -> Path:
+        path = self.entry_path(key, ext)
+        os.replace(self.partial_path(key), path)
+        if settings.MULTI_NODE:
+            # Other nodes route renders here and fetch the entry from us
+            NodeRegistry(get_redis()).advertise(path.name)
+        self.evict(keep=path)
+        return path
+
+    def link(self, entry: Path, dest: Path) -> Path:
+        if dest.exists():
+            return dest
+        try:
+            os.link(entry, dest)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Hard links can't cross filesystems, fall back to a copy
+            shutil.copy2(entry, dest)
+        return dest
+
+    def entries(self) -> list[Path]:
+        return [
+            path
+            for path in self.cache_dir.iterdir()
+            if path.is_file()
+            and path.suffix != self.METADATA_SUFFIX
+            and self.PARTIAL_SUFFIX not in path.suffixes
+        ]
+
+    def evict(self, keep: Path | None = None):
+        entries = []
+        for path in self.entries():
+            try:
+                entries.append((path, path.stat()))
+            except FileNotFoundError:
+                continue
+
+        total = sum(stat.st_size for _, stat in entries)
+        if total <= self.max_bytes:
+            return
+
+        for path, stat in sorted(entries, key=lambda item: item[1].st_mtime):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                with self.lock(path.stem, blocking=False):
+                    path.unlink(missing_ok=True)
+                    self.metadata_path(path.stem).unlink(missing_ok=True)
+            except BlockingIOError:
+                continue
+            if settings.MULTI_NODE:
+                NodeRegistry(get_redis()).withdraw(path.name)
+
+            total -= stat.st_size
+            logger.info(
+                "Evicted %s (%.2f MB) from media cache",
+                path.name,
+                stat.st_size / (1024 * 1024),
+            )
@@ -1,14 +1,19 @@
+import asyncio
+import json
 import logging
 import mimetypes
 import re
+import threading
 import time
-import hashlib
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Callable
 
 import httpx
 
 from app.core.config import settings
+from app.services.async_downloader import AsyncDownloader
+from app.services.media_cache import MediaCache
 
 logger = logging.getLogger(__name__)
 
@@ -21,91 +26,299 @@ class MediaManager:
         self.base_dir = settings.TEMP_DIR.joinpath(f"task_{task_id}")
         self.video_dir = self.base_dir.joinpath("videos")
         self.audio_dir = self.base_dir.joinpath("audio")
+        self.cache = MediaCache()
+        # HEAD responses from admission, downloads reuse them instead of
+        # asking the origin again
+        self.headers: dict[str, httpx.Headers] = {}
 
         self.video_dir.mkdir(parents=True, exist_ok=True)
         self.audio_dir.mkdir(parents=True, exist_ok=True)
 
+    def _head(self, url: str, client: httpx.Client) -> httpx.Headers:
+        try:
+            response = client.head(url, follow_redirects=True)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning("HEAD %s failed, caching by URL only: %s", url, e)
+            return httpx.Headers()
+
+        return response.headers
+
+    @staticmethod
+    def _check_mime(headers, expected_mime: str):
+        content_type = headers.get("Content-Type", "").lower()
+        if expected_mime not in content_type:
+            raise ValueError(
+                f"Expected mime type " f"'{expected_mime}' but got " f"'{content_type}'"
+            )
+
+    @staticmethod
+    def _supports_ranges(headers) -> bool:
+        return (
+            headers.get("Accept-Ranges", "").lower() == "bytes"
+            and int(headers.get("Content-Length") or 0)
+            >= settings.RANGED_DOWNLOAD_MIN_SIZE
+        )
+
+    def _fetch(
+        self, url: str, key: str, expected_mime: str, client: httpx.Client
+    ) -> Path:
+        partial_path = self.cache.partial_path(key)
+
+        try:
+            with client.stream("GET", url, follow_redirects=True) as response:
+                response.raise_for_status()
+                self._check_mime(response.headers, expected_mime)
+
+                with open(partial_path, "wb") as f:
+                    for chunk in response.iter_bytes(chunk_size=settings.CHUNK_SIZE):
+                        f.write(chunk)
+        except Exception:
+            if partial_path.exists():
+                partial_path.unlink()
+            raise
+
+        return partial_path
+
+    @staticmethod
+    def _load_progress(progress_path: Path, partial_path: Path, size: int):
+        if not progress_path.exists() or not partial_path.exists():
+            return None
+        try:
+            progress = json.loads(progress_path.read_text())
+        except json.JSONDecodeError:
+            return None
+        return progress if progress.get("size") == size else None
+
+    def _fetch_ranged(
+        self,
+        url: str,
+        key: str,
+        expected_mime: str,
+        headers: httpx.Headers,
+        client: httpx.Client,
+    ) -> Path:
+        self._check_mime(headers, expected_mime)
+
+        size = int(headers["Content-Length"])
+        partial_path = self.cache.partial_path(key)
+        progress_path = partial_path.with_name(partial_path.name + ".json")
+        progress_lock = threading.Lock()
+
+        # Without a validator a replaced file of the same size can't be told
+        # apart from the one partly on disk, so the download starts over
+        validated = headers.get("ETag") or headers.get("Last-Modified")
+        progress = (
+            self._load_progress(progress_path, partial_path, size)
+            if validated
+            else None
+        )
+        if progress:
+            done = sum(segment[2] for segment in progress["segments"])
+            logger.info(
+                "Resuming %s from %.2f/%.2f MB",
+                url,
+                done / (1024 * 1024),
+                size / (1024 * 1024),
+            )
+        else:
+            segment_size = -(-size // settings.RANGED_DOWNLOAD_SEGMENTS)
+            progress = {
+                "size": size,
+                "segments": [
+                    [start, min(start + segment_size, size), 0]
+                    for start in range(0, size, segment_size)
+                ],
+            }
+            with open(partial_path, "wb") as f:
+                f.truncate(size)
+
+        def save_progress():
+            with progress_lock:
+                progress_path.write_text(json.dumps(progress))
+
+        def fetch_segment(segment: list[int]):
+            start, end, _ = segment
+            if start + segment[2] >= end:
+                return
+
+            range_header = {"Range": f"bytes={start + segment[2]}-{end - 1}"}
+            with client.stream(
+                "GET", url, headers=range_header, follow_redirects=True
+            ) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise ValueError(f"Range request for {url} was ignored")
+                self._check_mime(response.headers, expected_mime)
+
+                with open(partial_path, "r+b") as f:
+                    f.seek(start + segment[2])
+                    for chunk in response.iter_bytes(chunk_size=settings.CHUNK_SIZE):
+                        f.write(chunk)
+                        with progress_lock:
+                            segment[2] += len(chunk)
+
+            save_progress()
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(progress["segments"])) as executor:
+                futures = [
+                    executor.submit(fetch_segment, segment)
+                    for segment in progress["segments"]
+                ]
+                for future in futures:
+                    future.result()
+        except Exception:
+            # Keep the partial file and its progress so the next attempt resumes
+            save_progress()
+            raise
+
+        if sum(segment[2] for segment in progress["segments"]) != size:
+            save_progress()
+            raise ValueError(f"Incomplete ranged download of {url}")
+
+        progress_path.unlink(missing_ok=True)
+        return partial_path
+
     def download_file(
         self, url: str, folder: Path, expected_mime: str, client: httpx.Client
     ) -> tuple[str, Path, int]:
 
         start_time = time.perf_counter()
-        file_hash = hashlib.md5(url.encode()).hexdigest()
 
         ext = mimetypes.guess_extension(expected_mime)
         if not ext:
             logger.error("Unsupported file extension: %s", expected_mime)
             raise ValueError(f"No {expected_mime} file extension found")
 
-        local_path = folder.joinpath(file_hash + ext)
+        headers = self.headers.get(url)
+        if headers is None:
+            headers = self._head(url, client)
+        key = MediaCache.make_key(
+            url, headers.get("ETag", ""), headers.get("Last-Modified", "")
+        )
+        local_path = folder.joinpath(key + ext)
 
         if local_path.exists():
             logger.info("%s already cached", local_path.name)
             return url, local_path, local_path.stat().st_size
 
         try:
-            with client.stream("GET", url, follow_redirects=True) as response:
-                response.raise_for_status()
+            with self.cache.lock(key):
+                entry = self.cache.get(key, ext)
+                if entry:
+                    logger.info("%s found in media cache", entry.name)
+                else:
+                    if self._supports_ranges(headers):
+                        self._fetch_ranged(url, key, expected_mime, headers, client)
+                    else:
+                        self._fetch(url, key, expected_mime, client)
+                    entry = self.cache.commit(key, ext)
 
-                content_type = response.headers.get("Content-Type", "").lower()
-                if expected_mime not in content_type:
-                    raise ValueError(
-                        f"Expected mime type "
-                        f"'{expected_mime}' but got "
-                        f"'{content_type}'"
+                    logger.info(
+                        "Downloaded %s (%.2f MB) in %.2fs",
+                        entry.name,
+                        entry.stat().st_size / (1024 * 1024),
+                        time.perf_counter() - start_time,
                     )
 
-                with open(local_path, "wb") as f:
-                    for chunk in response.iter_bytes(chunk_size=settings.CHUNK_SIZE):
-                        f.write(chunk)
-
-            file_size = local_path.stat().st_size
+                self.cache.link(entry, local_path)
 
-            logger.info(
-                "Downloaded %s (%.2f MB) in %.2fs",
-                local_path.name,
-                file_size / (1024 * 1024),
-                time.perf_counter() - start_time,
-            )
-            return url, local_path, file_size
+            return url, local_path, local_path.stat().st_size
 
         except Exception as e:
-            logger.error(f"Failed to download %s: %s", url, str(e))
-            if local_path.exists():
-                local_path.unlink()
+            logger.error("Failed to download %s: %s", url, str(e))
             raise
 
-    def prepare_media(
-        self, video_blocks: dict[str, list[str]], audio_blocks: dict[str, list[str]]
-    ) -> tuple[dict[str, list], list[str]]:
-        start_time = time.perf_counter()
-        unique_videos = {str(url) for block in video_blocks.values() for url in block}
-        unique_audio = {str(url) for block in audio_blocks.values() for url in block}
-
+    def _download_threaded(
+        self,
+        jobs: list[tuple[str, Path, str]],
+        on_ready: Callable[[str, Path], None] | None = None,
+    ) -> list[tuple[str, Path, int]]:
         with ThreadPoolExecutor(max_workers=settings.MAX_DOWNLOAD_WORKERS) as executor:
             with httpx.Client() as client:
-                video_tasks = [
+                futures = [
                     executor.submit(
-                        self.download_file, url, self.video_dir, "video/mp4", client
+                        self.download_file, url, folder, expected_mime, client
                     )
-                    for url in unique_videos
+                    for url, folder, expected_mime in jobs
                 ]
-                audio_tasks = [
-                    executor.submit(
-                        self.download_file, url, self.audio_dir, "audio/mpeg", client
+                for future in as_completed(futures):
+                    url, local_path, _ = future.result()
+                    if on_ready:
+                        on_ready(url, local_path)
+                return [f.result() for f in futures]
+
+    @staticmethod
+    def order_blocks(blocks: dict[str, list]) -> dict[str, list]:
+        return {
+            name: blocks[name]
+            for name in sorted(
+                blocks.keys(), key=lambda x: int(re.search(r"\d+", x).group())
+            )
+        }
+
+    def _jobs(
+        self, video_blocks: dict[str, list[str]], audio_blocks: dict[str, list[str]]
+    ) -> list[tuple[str, Path, str]]:
+        unique_videos = {str(url) for block in video_blocks.values() for url in block}
+        unique_audio = sorted(
+            {str(url) for block in audio_blocks.values() for url in block}
+        )
+        return [(url, self.video_dir, "video/mp4") for url in unique_videos] + [
+            (url, self.audio_dir, "audio/mpeg") for url in unique_audio
+        ]
+
+    def download_size(
+        self, video_blocks: dict[str, list[str]], audio_blocks: dict[str, list[str]]
+    ) -> int:
+        def size(url: str, expected_mime: str, client: httpx.Client) -> int:
+            headers = self.headers[url] = self._head(url, client)
+            key = MediaCache.make_key(
+                url, headers.get("ETag", ""), headers.get("Last-Modified", "")
+            )
+            # Files already in the media cache are only linked, they take
+            # no new space
+            if self.cache.get(key, mimetypes.guess_extension(expected_mime) or ""):
+                return 0
+            return int(headers.get("Content-Length") or 0)
+
+        jobs = self._jobs(video_blocks, audio_blocks)
+        with ThreadPoolExecutor(max_workers=settings.MAX_DOWNLOAD_WORKERS) as executor:
+            with httpx.Client() as client:
+                return sum(
+                    executor.map(
+                        lambda job: size(job[0], job[2], client),
+                        jobs,
                     )
-                    for url in unique_audio
-                ]
-                all_results = [f.result() for f in video_tasks + audio_tasks]
+                )
+
+    def prepare_media(
+        self,
+        video_blocks: dict[str, list[str]],
+        audio_blocks: dict[str, list[str]],
+        on_ready: Callable[[str, Path], None] | None = None,
+    ) -> tuple[dict[str, list], list[str]]:
+        start_time = time.perf_counter()
+        unique_audio = sorted(
+            {str(url) for block in audio_blocks.values() for url in block}
+        )
+        jobs = self._jobs(video_blocks, audio_blocks)
+
+        if settings.DOWNLOAD_BACKEND == "async":
+            downloader = AsyncDownloader(self.cache)
+            all_results = asyncio.run(
+                downloader.download_many(jobs, on_ready=on_ready, headers=self.headers)
+            )
+        else:
+            all_results = self._download_threaded(jobs, on_ready)
 
         total_file_size = sum([res[2] for res in all_results])
         mapping = {res[0]: res[1] for res in all_results}
 
         local_video = {
-            name: [mapping[str(url)] for url in video_blocks[name]]
-            for name in sorted(
-                video_blocks.keys(), key=lambda x: int(re.search(r"\d+", x).group())
-            )
+            name: [mapping[str(url)] for url in urls]
+            for name, urls in self.order_blocks(video_blocks).items()
         }
         local_audio = [mapping[str(url)] for url in unique_audio]
 
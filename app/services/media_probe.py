@@ -0,0 +1,87 @@
+import json
+import logging
+import subprocess
+from fractions import Fraction
+from pathlib import Path
+
+from app.services.media_cache import MediaCache
+
+logger = logging.getLogger(__name__)
+
+
+class MediaProbe:
+
+    def __init__(self):
+        self.cache = MediaCache()
+
+    @staticmethod
+    def _frame_rate(value: str | None) -> float:
+        try:
+            return float(Fraction(value))
+        except (TypeError, ValueError, ZeroDivisionError):
+            return 0.0
+
+    @staticmethod
+    def _parse(output: str) -> dict:
+        info = json.loads(output)
+        streams = info.get("streams", [])
+        video = next((s for s in streams if s.get("codec_type") == "video"), None)
+        audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+        record = {
+            "duration": float(info.get("format", {}).get("duration") or 0),
+            "video": None,
+            "audio": None,
+        }
+        if video:
+            record["video"] = {
+                "codec": video.get("codec_name"),
+                "width": video.get("width"),
+                "height": video.get("height"),
+                "fps": MediaProbe._frame_rate(video.get("avg_frame_rate")),
+                "pix_fmt": video.get("pix_fmt"),
+                "sar": video.get("sample_aspect_ratio", "1:1"),
+            }
+        if audio:
+            record["audio"] = {
+                "codec": audio.get("codec_name"),
+                "sample_rate": int(audio.get("sample_rate") or 0),
+                "channels": audio.get("channels"),
+            }
+        return record
+
+    @staticmethod
+    def _validate(path: Path, record: dict, kind: str):
+        if record["duration"] <= 0:
+            raise ValueError(f"{path.name} has no duration")
+        if not record[kind]:
+            raise ValueError(f"{path.name} has no {kind} stream")
+
+    def probe(self, path: Path, kind: str) -> dict:
+        record = self.cache.read_metadata(path.stem)
+        if record is None:
+            command = [
+                "ffprobe",
+                "-v",
+                "error",
+                "-print_format",
+                "json",
+                "-show_format",
+                "-show_streams",
+                str(path),
+            ]
+            try:
+                result = subprocess.run(
+                    command, capture_output=True, text=True, check=True
+                )
+                record = self._parse(result.stdout)
+            except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+                logger.error(
+                    "Failed to probe %s: %s", path.name, getattr(e, "stderr", e)
+                )
+                raise ValueError(f"{path.name} is not a valid media file") from e
+
+            self.cache.write_metadata(path.stem, record)
+
+        self._validate(path, record, kind)
+        return record
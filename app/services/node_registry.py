@@ -0,0 +1,162 @@
+import logging
+import threading
+
+import redis
+from celery import current_app
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+NODES_KEY = "nodes"
+
+
+class NodeRegistry:
+    def __init__(self, client: redis.Redis, node_id: str | None = None):
+        self.client = client
+        self.node_id = node_id or settings.NODE_ID
+
+    @staticmethod
+    def queue(node_id: str, kind: str = "heavy") -> str:
+        return f"{kind}.{node_id}"
+
+    @staticmethod
+    def entries_key(node_id: str) -> str:
+        return f"node:{node_id}:cache"
+
+    @staticmethod
+    def stats_key(node_id: str) -> str:
+        return f"node:{node_id}:stats"
+
+    @staticmethod
+    def alive_key(node_id: str) -> str:
+        return f"node:{node_id}:alive"
+
+    @staticmethod
+    def slots_key(node_id: str) -> str:
+        return f"node:{node_id}:slots"
+
+    @property
+    def url(self) -> str:
+        return settings.NODE_URL or f"http://{self.node_id}:{settings.NODE_PORT}"
+
+    def heartbeat(self, slots: int | None = None):
+        pipe = self.client.pipeline()
+        pipe.hset(NODES_KEY, self.node_id, self.url)
+        pipe.set(self.alive_key(self.node_id), 1, ex=settings.NODE_TTL)
+        if slots:
+            # Only nodes running a heavy worker take renders
+            pipe.set(self.slots_key(self.node_id), slots, ex=settings.NODE_TTL)
+        pipe.execute()
+
+    def start_heartbeat(self, slots: int | None = None) -> threading.Event:
+        stopped = threading.Event()
+
+        def beat():
+            while not stopped.wait(settings.NODE_TTL / 3):
+                try:
+                    self.heartbeat(slots)
+                except redis.RedisError as e:
+                    logger.warning("Heartbeat of %s failed: %s", self.node_id, e)
+
+        self.heartbeat(slots)
+        threading.Thread(target=beat, daemon=True).start()
+        return stopped
+
+    def live_nodes(self) -> dict[str, str]:
+        nodes = self.client.hgetall(NODES_KEY)
+        if not nodes:
+            return {}
+        alive = self.client.mget([self.alive_key(node) for node in nodes])
+        return {node: url for (node, url), flag in zip(nodes.items(), alive) if flag}
+
+    def advertise(self, name: str):
+        self.client.sadd(self.entries_key(self.node_id), name)
+
+    def withdraw(self, name: str):
+        self.client.srem(self.entries_key(self.node_id), name)
+
+    def sync(self, names: list[str]):
+        # Entries left from before a restart are advertised again, anything
+        # evicted while the node was down is dropped
+        pipe = self.client.pipeline()
+        pipe.delete(self.entries_key(self.node_id))
+        if names:
+            pipe.sadd(self.entries_key(self.node_id), *names)
+        pipe.execute()
+
+    def holders(self, name: str) -> list[str]:
+        nodes = self.live_nodes()
+        pipe = self.client.pipeline()
+        for node in nodes:
+            pipe.sismember(self.entries_key(node), name)
+        return [url for url, held in zip(nodes.values(), pipe.execute()) if held]
+
+    def render_nodes(self) -> dict[str, int]:
+        nodes = list(self.live_nodes())
+        if not nodes:
+            return {}
+        slots = self.client.mget([self.slots_key(node) for node in nodes])
+        return {node: int(count) for node, count in zip(nodes, slots) if count}
+
+    def backlog(self, node_id: str) -> int:
+        # Renders waiting in the node's queue, the broker keeps a list per
+        # priority step next to the queue itself
+        queue = self.queue(node_id)
+        options = current_app.conf.broker_transport_options
+        sep = options.get("sep", "\x06\x16")
+        pipe = self.client.pipeline()
+        for step in options.get("priority_steps", [0, 3, 6, 9]):
+            pipe.llen(f"{queue}{sep}{step}" if step else queue)
+        return sum(pipe.execute())
+
+    def best_node(self, names: list[str]) -> str | None:
+        # A render goes to the node holding most of its inputs as long as
+        # that node can start it within a round of its slots, otherwise to
+        # the least loaded node. The inputs are fetched there instead
+        slots = self.render_nodes()
+        if not slots:
+            return None
+        nodes = list(slots)
+        held = dict.fromkeys(nodes, 0)
+        if names:
+            pipe = self.client.pipeline()
+            for node in nodes:
+                pipe.smismember(self.entries_key(node), names)
+            held = {node: sum(flags) for node, flags in zip(nodes, pipe.execute())}
+        load = {node: self.backlog(node) / slots[node] for node in nodes}
+
+        def rank(node: str) -> tuple:
+            if load[node] < 1:
+                return 1, held[node], -load[node]
+            return 0, -load[node], held[node]
+
+        return max(nodes, key=rank)
+
+    def count(self, **stats: int):
+        pipe = self.client.pipeline()
+        for field, value in stats.items():
+            pipe.hincrby(self.stats_key(self.node_id), field, value)
+        pipe.execute()
+
+    def stats(self) -> dict[str, dict]:
+        report = {}
+        for node in self.client.hgetall(NODES_KEY):
+            stats = {
+                field: int(value)
+                for field, value in self.client.hgetall(self.stats_key(node)).items()
+            }
+            hits = stats.get("hits", 0)
+            misses = stats.get("misses", 0)
+            report[node] = {
+                "alive": bool(self.client.exists(self.alive_key(node))),
+                "slots": int(self.client.get(self.slots_key(node)) or 0),
+                "backlog": self.backlog(node),
+                "entries": self.client.scard(self.entries_key(node)),
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "peer_bytes": stats.get("peer_bytes", 0),
+                "origin_bytes": stats.get("origin_bytes", 0),
+            }
+        return report
@@ -0,0 +1,117 @@
+import logging
+import re
+import shutil
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+from app.core.config import settings
+from app.services.media_cache import MediaCache
+from app.services.node_registry import NodeRegistry
+
+logger = logging.getLogger(__name__)
+
+ENTRY_NAME = re.compile(r"^[0-9a-f]{64}\.\w+$")
+
+
+class PeerCache:
+    def __init__(self, registry: NodeRegistry, cache: MediaCache | None = None):
+        self.registry = registry
+        self.cache = cache or MediaCache()
+
+    def _fetch(self, url: str, key: str, client: httpx.Client) -> int:
+        size = 0
+        partial_path = self.cache.partial_path(key)
+        try:
+            with client.stream("GET", url) as response:
+                response.raise_for_status()
+                with open(partial_path, "wb") as f:
+                    for chunk in response.iter_bytes(settings.CHUNK_SIZE):
+                        f.write(chunk)
+                        size += len(chunk)
+        except Exception:
+            partial_path.unlink(missing_ok=True)
+            raise
+        return size
+
+    def _fetch_entry(self, name: str, key: str, origin: str | None) -> tuple[str, int]:
+        peers = [url for url in self.registry.holders(name) if url != self.registry.url]
+        with httpx.Client() as client:
+            for peer in peers:
+                try:
+                    size = self._fetch(f"{peer}/cache/{name}", key, client)
+                    return "peer_bytes", size
+                except httpx.HTTPError as e:
+                    logger.warning("Fetching %s from %s failed: %s", name, peer, e)
+            if origin is None:
+                raise FileNotFoundError(f"No live node holds {name}")
+            return "origin_bytes", self._fetch(origin, key, client)
+
+    def ensure(self, local_path: Path, origin: str | None = None) -> Path:
+        # An input downloaded on another node is linked from the local media
+        # cache, fetched from a node that holds it, or downloaded again
+        if local_path.exists():
+            self.registry.count(hits=1)
+            return local_path
+
+        name = local_path.name
+        key, ext = local_path.stem, local_path.suffix
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        start_time = time.perf_counter()
+        with self.cache.lock(key):
+            entry = self.cache.get(key, ext)
+            if entry:
+                self.registry.count(hits=1)
+            else:
+                source, size = self._fetch_entry(name, key, origin)
+                entry = self.cache.commit(key, ext)
+                self.registry.count(misses=1, **{source: size})
+                logger.info(
+                    "Fetched %s (%.2f MB) in %.2fs",
+                    name,
+                    size / (1024 * 1024),
+                    time.perf_counter() - start_time,
+                )
+            self.cache.link(entry, local_path)
+        return local_path
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    def __init__(self, *args, cache_dir: Path, **kwargs):
+        self.cache_dir = cache_dir
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        name = self.path.removeprefix("/cache/")
+        if not ENTRY_NAME.match(name):
+            self.send_error(404)
+            return
+        try:
+            f = open(self.cache_dir.joinpath(name), "rb")
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        with f:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(Path(f.name).stat().st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, settings.CHUNK_SIZE)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def serve_cache(
+    port: int | None = None, cache_dir: Path | None = None
+) -> ThreadingHTTPServer:
+    handler = partial(
+        CacheRequestHandler, cache_dir=cache_dir or settings.media_cache_dir
+    )
+    server = ThreadingHTTPServer(("", port or settings.NODE_PORT), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
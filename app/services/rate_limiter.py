@@ -0,0 +1,53 @@
+import logging
+import time
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+
+    def __init__(self, client: redis.Redis, name: str, rate: float, capacity: int):
+        self.client = client
+        self.key = f"ratelimit:{name}"
+        self.pause_key = f"ratelimit:{name}:paused"
+        self.rate = rate
+        self.capacity = capacity
+
+    def _take(self) -> float:
+        def take(pipe):
+            now = time.time()
+            tokens, updated_at = pipe.hmget(self.key, "tokens", "updated_at")
+            tokens = self.capacity if tokens is None else float(tokens)
+            updated_at = now if updated_at is None else float(updated_at)
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+
+            pipe.multi()
+            pipe.hset(self.key, mapping={"tokens": tokens, "updated_at": now})
+            pipe.expire(self.key, 3600)
+            return wait
+
+        return self.client.transaction(take, self.key, value_from_callable=True)
+
+    def acquire(self):
+        while True:
+            paused_ms = self.client.pttl(self.pause_key)
+            if paused_ms > 0:
+                time.sleep(paused_ms / 1000)
+                continue
+
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        logger.warning("Rate limit %s paused for %.2fs", self.key, seconds)
+        self.client.set(self.pause_key, 1, px=max(1, int(seconds * 1000)))
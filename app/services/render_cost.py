@@ -0,0 +1,72 @@
+import logging
+import math
+
+import redis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RenderCostModel:
+    KEY = "render_cost"
+    MAX_PRIORITY = 9
+
+    def __init__(self, client: redis.Redis):
+        self.client = client
+        self.alpha = settings.RENDER_COST_ALPHA
+
+    @staticmethod
+    def units(
+        clips: list[str], metadata: dict[str, dict], renditions: list[dict] = ()
+    ) -> float:
+        # Megapixel-seconds decoded from the sources plus encoded at the
+        # output sizes, the two things a render spends its time on
+        output_pixels = settings.VIDEO_WIDTH * settings.VIDEO_HEIGHT + sum(
+            rendition["width"] * rendition["height"] for rendition in renditions
+        )
+        units = 0.0
+        for clip in clips:
+            record = metadata[clip]
+            pixels = record["video"]["width"] * record["video"]["height"]
+            units += record["duration"] * (pixels + output_pixels) / 1_000_000
+        return units
+
+    @property
+    def seconds_per_unit(self) -> float:
+        rate = self.client.hget(self.KEY, "seconds_per_unit")
+        return settings.RENDER_COST_DEFAULT_RATE if rate is None else float(rate)
+
+    def estimate(self, units: float) -> float:
+        return units * self.seconds_per_unit
+
+    def priority(self, seconds: float) -> int:
+        # Redis serves lower numbers first, every doubling of the estimated
+        # render time moves a job one step ahead
+        return max(0, self.MAX_PRIORITY - int(math.log2(1 + seconds)))
+
+    def record(self, units: float, seconds: float):
+        if units <= 0:
+            return
+
+        def update(pipe):
+            rate, samples = pipe.hmget(self.KEY, "seconds_per_unit", "samples")
+            observed = seconds / units
+            rate = (
+                observed
+                if rate is None
+                else (1 - self.alpha) * float(rate) + self.alpha * observed
+            )
+            pipe.multi()
+            pipe.hset(
+                self.KEY,
+                mapping={"seconds_per_unit": rate, "samples": int(samples or 0) + 1},
+            )
+
+        self.client.transaction(update, self.KEY)
+        logger.info(
+            "Render of %.1f units took %.2fs (%.4fs/unit observed)",
+            units,
+            seconds,
+            seconds / units,
+        )
@@ -0,0 +1,111 @@
+import math
+import random
+from collections import Counter
+
+
+def audio_pair(
+    audio_list: list[str], voiceover_list: list[str], index: int
+) -> tuple[str, str]:
+    # The smallest set of mixes that still uses every track and every voiceover
+    j = index % max(len(audio_list), len(voiceover_list))
+    return audio_list[j % len(audio_list)], voiceover_list[j % len(voiceover_list)]
+
+
+def job_inputs(job: dict) -> set[str]:
+    return {*job["video_lst"], job["music"], job["voiceover"]}
+
+
+def count_combinations(blocks: list[list[str]]) -> int:
+    return math.prod(len(block) for block in blocks)
+
+
+def combination_at(blocks: list[list[str]], index: int) -> tuple[str, ...]:
+    # Mixed-radix decoding in itertools.product order, the last block
+    # changes fastest
+    comb = []
+    for block in reversed(blocks):
+        index, digit = divmod(index, len(block))
+        comb.append(block[digit])
+    return tuple(reversed(comb))
+
+
+def index_of(sizes: list[int], digits: list[int]) -> int:
+    index = 0
+    for size, digit in zip(sizes, digits):
+        index = index * size + digit
+    return index
+
+
+def sample_combinations(sizes: list[int], count: int, seed: int) -> list[int]:
+    total = math.prod(sizes)
+    if count >= total:
+        return list(range(total))
+
+    rng = random.Random(seed)
+    usage = [[0] * size for size in sizes]
+    chosen = set()
+
+    # Every block hands out its least used clips first, so all clips appear
+    # before any repeats and usage never differs by more than one
+    while len(chosen) < count:
+        for _ in range(2 * len(sizes) + 1):
+            digits = []
+            for block_usage in usage:
+                least = min(block_usage)
+                digits.append(
+                    rng.choice([i for i, n in enumerate(block_usage) if n == least])
+                )
+            index = index_of(sizes, digits)
+            if index not in chosen:
+                break
+        else:
+            while index in chosen:
+                index = rng.randrange(total)
+            digits = list(combination_at([range(size) for size in sizes], index))
+
+        chosen.add(index)
+        for block_usage, digit in zip(usage, digits):
+            block_usage[digit] += 1
+
+    # Product order keeps neighbouring combinations close in a batch
+    return sorted(chosen)
+
+
+def required_inputs(spec: dict) -> set[str]:
+    blocks = spec["blocks"]
+    if spec.get("indices") is None:
+        clips = {clip for block in blocks for clip in block}
+    else:
+        clips = {clip for i in spec["indices"] for clip in combination_at(blocks, i)}
+
+    # Audio pairs repeat with the period of the longer list
+    period = max(len(spec["audio"]), len(spec["voiceovers"]))
+    audio = {
+        name
+        for i in range(min(spec["combinations"], period))
+        for name in audio_pair(spec["audio"], spec["voiceovers"], i)
+    }
+    return clips | audio
+
+
+def job_at(spec: dict, index: int) -> dict:
+    # Every combination is concatenated straight from its normalized clips.
+    # Assembly is a stream copy, a shared prefix built first would only be
+    # copied again by every render using it
+    if spec.get("indices") is not None:
+        index_in_product = spec["indices"][index]
+    else:
+        index_in_product = index
+    music, voiceover = audio_pair(spec["audio"], spec["voiceovers"], index)
+    return {
+        "video_lst": list(combination_at(spec["blocks"], index_in_product)),
+        "music": music,
+        "voiceover": voiceover,
+    }
+
+
+def input_refcounts(spec: dict) -> Counter:
+    refs = Counter()
+    for index in range(spec["combinations"]):
+        refs.update(job_inputs(job_at(spec, index)))
+    return refs
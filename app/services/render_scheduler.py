@@ -0,0 +1,324 @@
+import json
+import logging
+import math
+import threading
+import time
+
+import redis
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_KEY = "render:active"
+SLOTS_KEY = "render:slots"
+
+
+def register_heavy_worker(client: redis.Redis, worker: str, slots: int):
+    expires = time.time() + settings.HEAVY_WORKER_TTL
+    client.hset(SLOTS_KEY, worker, json.dumps({"slots": slots, "expires": expires}))
+
+
+def start_slot_heartbeat(
+    client: redis.Redis, worker: str, slots: int
+) -> threading.Event:
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(settings.HEAVY_WORKER_TTL / 3):
+            try:
+                register_heavy_worker(client, worker, slots)
+            except redis.RedisError as e:
+                logger.warning("Slot heartbeat of %s failed: %s", worker, e)
+
+    register_heavy_worker(client, worker, slots)
+    threading.Thread(target=beat, daemon=True).start()
+    return stopped
+
+
+def unregister_heavy_worker(client: redis.Redis, worker: str):
+    client.hdel(SLOTS_KEY, worker)
+
+
+def heavy_slots(client: redis.Redis) -> int:
+    # Heavy workers report their concurrency with a heartbeat, the setting
+    # only covers the time before the first one has started
+    now = time.time()
+    slots = 0
+    for worker, record in client.hgetall(SLOTS_KEY).items():
+        record = json.loads(record)
+        if record["expires"] < now:
+            client.hdel(SLOTS_KEY, worker)
+        else:
+            slots += record["slots"]
+    return slots or settings.HEAVY_WORKER_SLOTS
+
+
+class RenderScheduler:
+    TTL = 24 * 3600
+
+    def __init__(self, client: redis.Redis, task_id: str):
+        self.client = client
+        self.task_id = task_id
+        self.meta_key = f"render:{task_id}"
+        self.cursor_key = f"render:{task_id}:cursor"
+        self.frontier_key = f"render:{task_id}:frontier"
+        self.paths_key = f"render:{task_id}:paths"
+        self.metadata_key = f"render:{task_id}:metadata"
+        self.inflight_key = f"render:{task_id}:inflight"
+        self.remaining_key = f"render:{task_id}:remaining"
+        self.waits_key = f"render:{task_id}:waits"
+        self.previewed_key = f"render:{task_id}:previewed"
+        self.rejected_key = f"render:{task_id}:rejected"
+        self.refs_key = f"render:{task_id}:refs"
+        self.deferred_key = f"render:{task_id}:deferred"
+        self.nodes_key = f"render:{task_id}:nodes"
+        # Completion records outlive the request so it can be resumed
+        self.done_key = f"render:{task_id}:done"
+        self.checkpoint_key = f"render:{task_id}:checkpoint"
+        self.resume_key = f"render:{task_id}:resume"
+        self.lock_key = f"render:{task_id}:lock"
+
+    @property
+    def keys(self) -> list[str]:
+        return [
+            self.meta_key,
+            self.cursor_key,
+            self.frontier_key,
+            self.paths_key,
+            self.metadata_key,
+            self.inflight_key,
+            self.remaining_key,
+            self.waits_key,
+            self.previewed_key,
+            self.rejected_key,
+            self.refs_key,
+            self.deferred_key,
+            self.nodes_key,
+        ]
+
+    def start(self, total: int, **meta):
+        pipe = self.client.pipeline()
+        pipe.hset(self.meta_key, mapping={key: str(v) for key, v in meta.items()})
+        pipe.hset(self.meta_key, "total", total)
+        pipe.set(self.cursor_key, 0)
+        pipe.set(self.inflight_key, 0)
+        pipe.set(self.remaining_key, total)
+        for key in self.keys:
+            pipe.expire(key, self.TTL)
+        pipe.sadd(ACTIVE_KEY, self.task_id)
+        pipe.delete(self.resume_key)
+        pipe.execute()
+
+    def checkpoint(self, data: dict, combinations: int):
+        pipe = self.client.pipeline()
+        pipe.hset(
+            self.checkpoint_key,
+            mapping={"data": json.dumps(data), "combinations": combinations},
+        )
+        pipe.expire(self.checkpoint_key, self.TTL)
+        pipe.execute()
+
+    @property
+    def checkpoint_data(self) -> dict | None:
+        data = self.client.hget(self.checkpoint_key, "data")
+        return json.loads(data) if data else None
+
+    def claim_resume(self) -> bool:
+        return bool(self.client.set(self.resume_key, 1, nx=True, ex=self.TTL))
+
+    def release_resume(self):
+        self.client.delete(self.resume_key)
+
+    def complete(self, indexes: list[int]):
+        if not indexes:
+            return
+        pipe = self.client.pipeline()
+        pipe.sadd(self.done_key, *indexes)
+        pipe.expire(self.done_key, self.TTL)
+        pipe.execute()
+
+    def completed(self, indexes: list[int]) -> set[int]:
+        if not indexes:
+            return set()
+        flags = self.client.smismember(self.done_key, indexes)
+        return {index for index, flag in zip(indexes, flags) if flag}
+
+    @property
+    def missing(self) -> int:
+        total = int(self.client.hget(self.checkpoint_key, "combinations") or 0)
+        return max(0, total - self.client.scard(self.done_key))
+
+    def join(self, node_id: str):
+        pipe = self.client.pipeline()
+        pipe.sadd(self.nodes_key, node_id)
+        pipe.expire(self.nodes_key, self.TTL)
+        pipe.execute()
+
+    @property
+    def nodes(self) -> set[str]:
+        return self.client.smembers(self.nodes_key)
+
+    @property
+    def meta(self) -> dict[str, str]:
+        return self.client.hgetall(self.meta_key)
+
+    def set_ready(self, name: str, local_path: str, record: dict):
+        pipe = self.client.pipeline()
+        pipe.hset(self.paths_key, name, local_path)
+        pipe.hset(self.metadata_key, local_path, json.dumps(record))
+        pipe.expire(self.paths_key, self.TTL)
+        pipe.expire(self.metadata_key, self.TTL)
+        pipe.execute()
+
+    @property
+    def paths(self) -> dict[str, str]:
+        return self.client.hgetall(self.paths_key)
+
+    @property
+    def metadata(self) -> dict[str, dict]:
+        return {
+            path: json.loads(record)
+            for path, record in self.client.hgetall(self.metadata_key).items()
+        }
+
+    def set_refs(self, refs: dict[str, int]):
+        if not refs:
+            return
+        pipe = self.client.pipeline()
+        pipe.hset(self.refs_key, mapping=refs)
+        pipe.expire(self.refs_key, self.TTL)
+        pipe.execute()
+
+    def release_refs(self, names: list[str]) -> list[str]:
+        if not names:
+            return []
+        pipe = self.client.pipeline()
+        for name in names:
+            pipe.hincrby(self.refs_key, name, -1)
+        # Names that were never counted go negative and are left alone
+        return [name for name, left in zip(names, pipe.execute()) if left == 0]
+
+    def defer(self, seconds: int) -> bool:
+        return bool(self.client.set(self.deferred_key, 1, nx=True, ex=seconds))
+
+    def dispatch_lock(self):
+        return self.client.lock(self.lock_key, timeout=60)
+
+    def frontier(self, size: int) -> list[int]:
+        # Batches are taken from a cursor into a bounded frontier, so only
+        # `size` of them are ever looked at, however many the request has
+        total = int(self.client.hget(self.meta_key, "total") or 0)
+        missing = size - self.client.scard(self.frontier_key)
+        if missing > 0:
+            cursor = int(self.client.get(self.cursor_key) or 0)
+            end = min(total, cursor + missing)
+            if end > cursor:
+                pipe = self.client.pipeline()
+                pipe.sadd(self.frontier_key, *range(cursor, end))
+                pipe.set(self.cursor_key, end)
+                pipe.expire(self.frontier_key, self.TTL)
+                pipe.execute()
+
+        return sorted(int(index) for index in self.client.smembers(self.frontier_key))
+
+    def window(self) -> int:
+        # Heavy slots are shared evenly between the requests with renders in
+        # flight. Requests still downloading or only uploading don't hold a
+        # share, so a request rendering alone may use every slot up to the cap
+        others = [
+            task_id
+            for task_id in self.client.smembers(ACTIVE_KEY)
+            if task_id != self.task_id
+        ]
+        pipe = self.client.pipeline()
+        for task_id in others:
+            pipe.exists(f"render:{task_id}")
+            pipe.get(f"render:{task_id}:inflight")
+        flags = pipe.execute()
+        active = 1
+        for task_id, exists, inflight in zip(others, flags[::2], flags[1::2]):
+            if not exists:
+                # The request died without cleaning up and its keys expired
+                self.client.srem(ACTIVE_KEY, task_id)
+            elif int(inflight or 0) > 0:
+                active += 1
+        share = math.ceil(heavy_slots(self.client) / active)
+        return max(1, min(settings.MAX_RENDERS_PER_TASK, share))
+
+    def claim(self, index: int) -> bool:
+        window = self.window()
+
+        def take(pipe):
+            inflight = int(pipe.get(self.inflight_key) or 0)
+            if inflight >= window or not pipe.sismember(self.frontier_key, index):
+                return
+            pipe.multi()
+            pipe.srem(self.frontier_key, index)
+            pipe.incr(self.inflight_key)
+
+        return bool(self.client.transaction(take, self.inflight_key, self.frontier_key))
+
+    def take(self, index: int) -> bool:
+        # Batches served without rendering leave the frontier without
+        # holding a heavy slot
+        return bool(self.client.srem(self.frontier_key, index))
+
+    def mark_previewed(self, index: int) -> bool:
+        pipe = self.client.pipeline()
+        pipe.sadd(self.previewed_key, index)
+        pipe.expire(self.previewed_key, self.TTL)
+        return bool(pipe.execute()[0])
+
+    def reject(self, indexes: list[int]):
+        pipe = self.client.pipeline()
+        pipe.sadd(self.rejected_key, *indexes)
+        pipe.expire(self.rejected_key, self.TTL)
+        pipe.execute()
+
+    def rejected(self, indexes: list[int]) -> set[int]:
+        if not indexes:
+            return set()
+        flags = self.client.smismember(self.rejected_key, indexes)
+        return {index for index, flag in zip(indexes, flags) if flag}
+
+    def release(self):
+        if self.client.exists(self.meta_key):
+            self.client.decr(self.inflight_key)
+
+    def record_wait(self, queued_at: float) -> float:
+        wait = max(0.0, time.time() - queued_at)
+
+        def update(pipe):
+            longest = float(pipe.hget(self.waits_key, "max") or 0)
+            pipe.multi()
+            pipe.hincrby(self.waits_key, "count", 1)
+            pipe.hincrbyfloat(self.waits_key, "total", wait)
+            pipe.hset(self.waits_key, "max", max(longest, wait))
+            pipe.expire(self.waits_key, self.TTL)
+
+        self.client.transaction(update, self.waits_key)
+        return wait
+
+    def finish(self) -> bool:
+        return self.client.decr(self.remaining_key) <= 0
+
+    def report(self) -> dict:
+        waits = self.client.hgetall(self.waits_key)
+        count = int(waits.get("count", 0))
+        return {
+            "renders": count,
+            "mean_wait": float(waits.get("total", 0)) / count if count else 0.0,
+            "max_wait": float(waits.get("max", 0)),
+        }
+
+    def close(self) -> dict:
+        report = self.report()
+        report["missing"] = self.missing
+        pipe = self.client.pipeline()
+        pipe.delete(*self.keys, self.resume_key)
+        if not report["missing"]:
+            pipe.delete(self.checkpoint_key, self.done_key)
+        pipe.srem(ACTIVE_KEY, self.task_id)
+        pipe.execute()
+        return report
@@ -0,0 +1,38 @@
+import hashlib
+import json
+
+import redis
+
+from app.core.config import settings
+
+
+class RequestRegistry:
+    PREFIX = "request"
+
+    def __init__(self, client: redis.Redis):
+        self.client = client
+
+    @classmethod
+    def make_key(cls, data: dict) -> str:
+        # Validated payloads are dumped in json mode, so equal requests give
+        # equal documents regardless of key order or URL spelling
+        payload = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        return f"{cls.PREFIX}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+    def register(self, key: str, task_id: str) -> str:
+        while True:
+            if self.client.set(key, task_id, nx=True, ex=settings.REQUEST_DEDUP_TTL):
+                return task_id
+            existing = self.client.get(key)
+            # The running request may finish between the two calls
+            if existing:
+                return existing
+
+    def release(self, key: str, task_id: str):
+        def delete(pipe):
+            if pipe.get(key) != task_id:
+                return
+            pipe.multi()
+            pipe.delete(key)
+
+        self.client.transaction(delete, key)
@@ -0,0 +1,69 @@
+import logging
+from pathlib import Path
+
+import redis
+
+from app.core.config import settings
+from app.services.media_cache import MediaCache
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    STATS_KEY = "results:stats"
+
+    def __init__(self, client: redis.Redis):
+        self.client = client
+
+    @staticmethod
+    def make_key(params: dict, profile: str) -> str:
+        # Input files are named by their content keys (URL and validators for
+        # downloads, text, voice and model for voiceovers), so the stems
+        # identify the inputs without hashing them again
+        return MediaCache.make_key(
+            *[Path(clip).stem for clip in params["video_lst"]],
+            Path(params["music"]).stem,
+            Path(params["voiceover"]).stem,
+            f"{params['audio_duration']:.3f}",
+            profile,
+        )
+
+    @staticmethod
+    def object_path(key: str, rendition: str | None = None) -> str:
+        suffix = f"_{rendition}" if rendition else ""
+        return f"{settings.RESULT_CACHE_PREFIX}/{key}{suffix}.mp4"
+
+    @staticmethod
+    def entry_key(key: str) -> str:
+        return f"result:{key}"
+
+    def lookup(self, keys: list[str]) -> list[str | None]:
+        return self.client.mget([self.entry_key(key) for key in keys]) if keys else []
+
+    def store(self, key: str, remote_path: str):
+        # Entries expire a day before the bucket lifecycle rule deletes their
+        # objects, so the index never outgrows what is stored
+        self.client.set(
+            self.entry_key(key),
+            remote_path,
+            ex=settings.RESULT_CACHE_TTL_DAYS * 24 * 3600,
+        )
+
+    def forget(self, key: str):
+        self.client.delete(self.entry_key(key))
+
+    def count(self, hits: int = 0, misses: int = 0):
+        pipe = self.client.pipeline()
+        pipe.hincrby(self.STATS_KEY, "hits", hits)
+        pipe.hincrby(self.STATS_KEY, "misses", misses)
+        pipe.execute()
+
+    def stats(self) -> dict:
+        stats = self.client.hgetall(self.STATS_KEY)
+        hits = int(stats.get("hits", 0))
+        misses = int(stats.get("misses", 0))
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
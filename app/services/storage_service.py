@@ -1,8 +1,17 @@
+import base64
 import logging
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import BinaryIO
 
+import google_crc32c
+from google.api_core.exceptions import NotFound
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
 from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
 
 from app.core.config import settings
 
@@ -10,6 +19,7 @@ logger = logging.getLogger(__name__)
 
 
 class StorageService:
+    MAX_COMPOSE_COMPONENTS = 32
     _client = None
 
     def __init__(self):
@@ -19,31 +29,162 @@ class StorageService:
     def client(self):
         if not StorageService._client:
             try:
-                credentials = service_account.Credentials.from_service_account_info(
-                    settings.gcs_credentials
+                if settings.GCS_EMULATOR_HOST:
+                    credentials = AnonymousCredentials()
+                    options = {"api_endpoint": settings.GCS_EMULATOR_HOST}
+                    project = "emulator"
+                else:
+                    # The client only scopes credentials it builds its own
+                    # session for, ours needs them scoped up front
+                    credentials = service_account.Credentials.from_service_account_info(
+                        settings.gcs_credentials, scopes=storage.Client.SCOPE
+                    )
+                    options = None
+                    project = None
+
+                # One pooled session shared by all upload threads of the worker
+                session = AuthorizedSession(credentials)
+                adapter = HTTPAdapter(
+                    pool_connections=settings.GCS_UPLOAD_WORKERS,
+                    pool_maxsize=settings.GCS_UPLOAD_WORKERS,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+
+                StorageService._client = storage.Client(
+                    project=project,
+                    credentials=credentials,
+                    client_options=options,
+                    _http=session,
                 )
-                StorageService._client = storage.Client(credentials=credentials)
                 logger.info("GCS client initialized. Bucket: %s", self.bucket_name)
             except Exception as e:
                 logger.error("Failed to initialize GCS client: %s", e)
                 raise
         return StorageService._client
 
-    def upload_file(self, local_path: Path, remote_path: str) -> str:
+    @staticmethod
+    def _crc32c(local_path: Path) -> str:
+        checksum = google_crc32c.Checksum()
+        with open(local_path, "rb") as f:
+            for chunk in iter(lambda: f.read(settings.GCS_UPLOAD_CHUNK_SIZE), b""):
+                checksum.update(chunk)
+        return base64.b64encode(checksum.digest()).decode()
+
+    def _is_uploaded(self, bucket, local_path: Path, remote_path: str) -> bool:
+        remote = bucket.get_blob(remote_path)
+        if remote is None or remote.size != local_path.stat().st_size:
+            return False
+        return remote.crc32c == self._crc32c(local_path)
+
+    def _upload_composite(self, bucket, local_path: Path, remote_path: str):
+        size = local_path.stat().st_size
+        part_count = min(settings.GCS_COMPOSITE_PARTS, self.MAX_COMPOSE_COMPONENTS)
+        part_size = -(-size // part_count)
+        parts = [
+            (f"{remote_path}.parts/{i}", offset, min(part_size, size - offset))
+            for i, offset in enumerate(range(0, size, part_size))
+        ]
+
+        def upload_part(part):
+            name, offset, length = part
+            with open(local_path, "rb") as f:
+                f.seek(offset)
+                bucket.blob(name).upload_from_file(f, size=length)
+            return bucket.blob(name)
+
+        with ThreadPoolExecutor(max_workers=settings.GCS_UPLOAD_WORKERS) as executor:
+            futures = [executor.submit(upload_part, part) for part in parts]
+            try:
+                part_blobs = [f.result() for f in futures]
+                blob = bucket.blob(remote_path)
+                blob.content_type = "video/mp4"
+                blob.compose(part_blobs)
+            finally:
+                # Parts that made it are deleted even when another one failed
+                wait(futures)
+                uploaded = [f.result() for f in futures if not f.exception()]
+                list(executor.map(lambda part: part.delete(), uploaded))
+
+    def upload_file(
+        self, local_path: Path, remote_path: str, keep_local: bool = False
+    ) -> str:
         try:
             bucket = self.client.bucket(self.bucket_name)
-            blob = bucket.blob(remote_path)
 
-            logger.info("Uploading %s to GCS", local_path.name)
+            if self._is_uploaded(bucket, local_path, remote_path):
+                logger.info(
+                    "%s already stored as %s, skipping upload",
+                    local_path.name,
+                    remote_path,
+                )
+            elif local_path.stat().st_size >= settings.GCS_COMPOSITE_THRESHOLD:
+                logger.info("Uploading %s to GCS in parts", local_path.name)
+                self._upload_composite(bucket, local_path, remote_path)
+            else:
+                blob = bucket.blob(remote_path)
+
+                logger.info("Uploading %s to GCS", local_path.name)
 
-            blob.upload_from_filename(str(local_path))
+                blob.upload_from_filename(str(local_path))
 
             logger.info("Successfully uploaded to %s", remote_path)
 
-            if local_path.exists():
-                local_path.unlink()
+            if not keep_local:
+                local_path.unlink(missing_ok=True)
 
             return remote_path
         except Exception as e:
             logger.error("Failed to upload %s: %s", local_path.name, e)
             raise
+
+    def upload_many(self, files: list[tuple[Path, str]]) -> list[str]:
+        with ThreadPoolExecutor(max_workers=settings.GCS_UPLOAD_WORKERS) as executor:
+            futures = [
+                executor.submit(self.upload_file, local_path, remote_path, True)
+                for local_path, remote_path in files
+            ]
+            remote_paths = [f.result() for f in futures]
+
+        # Only a fully stored batch gives up its local files, a retry after a
+        # partial failure still has every one of them
+        for local_path, _ in files:
+            local_path.unlink(missing_ok=True)
+        return remote_paths
+
+    def upload_stream(self, stream: BinaryIO, remote_path: str) -> str:
+        try:
+            bucket = self.client.bucket(self.bucket_name)
+            blob = bucket.blob(remote_path, chunk_size=settings.GCS_UPLOAD_CHUNK_SIZE)
+
+            logger.info("Streaming upload to %s", remote_path)
+
+            # Resumable upload that sends every chunk as soon as it is filled
+            with blob.open("wb", content_type="video/mp4") as writer:
+                shutil.copyfileobj(stream, writer, settings.CHUNK_SIZE)
+
+            logger.info("Successfully streamed to %s", remote_path)
+            return remote_path
+        except Exception as e:
+            logger.error("Failed to stream upload to %s: %s", remote_path, e)
+            raise
+
+    def exists(self, remote_path: str) -> bool:
+        return self.client.bucket(self.bucket_name).blob(remote_path).exists()
+
+    def copy(self, source_path: str, remote_path: str) -> str:
+        # Server-side copy, the bytes never leave GCS
+        bucket = self.client.bucket(self.bucket_name)
+        bucket.copy_blob(bucket.blob(source_path), bucket, remote_path)
+        return remote_path
+
+    def move(self, source_path: str, remote_path: str) -> str:
+        self.copy(source_path, remote_path)
+        self.client.bucket(self.bucket_name).blob(source_path).delete()
+        return remote_path
+
+    def delete(self, remote_path: str):
+        try:
+            self.client.bucket(self.bucket_name).blob(remote_path).delete()
+        except NotFound:
+            pass
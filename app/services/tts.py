@@ -1,50 +1,162 @@
-import hashlib
 import logging
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Callable
 
 from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.services.media_cache import MediaCache
+from app.services.rate_limiter import TokenBucket
 from elevenlabs import ElevenLabs, save
+from elevenlabs.core.api_error import ApiError
 
 logger = logging.getLogger(__name__)
 
 
+VOICES_KEY = "tts:voices"
+VOICES_VERSION_KEY = "tts:voices:version"
+VOICES_LOCK_KEY = "tts:voices:lock"
+
+
 class TTS:
     voices = {}
+    voices_version = None
     _client = None
 
     def __init__(self, task_id: str):
         self.tts_dir = settings.TEMP_DIR.joinpath(f"task_{task_id}", "tts")
         self.tts_dir.mkdir(parents=True, exist_ok=True)
+        self.cache = MediaCache()
+        self.bucket = TokenBucket(
+            get_redis(), "elevenlabs", settings.TTS_RATE_LIMIT, settings.TTS_BURST
+        )
 
     @property
     def client(self):
         if not TTS._client:
-            TTS._client = ElevenLabs(api_key=settings.ELEVENLABS_API_KEY)
+            TTS._client = ElevenLabs(
+                api_key=settings.ELEVENLABS_API_KEY,
+                base_url=settings.ELEVENLABS_BASE_URL,
+            )
         return TTS._client
 
-    def _refresh_voice_map(self):
-        if TTS.voices:
-            logger.info("Using cached voice map")
+    def _fetch_voice_map(self) -> dict[str, str]:
+        response = self.client.voices.get_all()
+        new_voices = {}
+        for voice in response.voices:
+            short_name = voice.name.split()[0].lower()
+
+            if short_name not in new_voices:
+                new_voices[short_name] = voice.voice_id
+
+            new_voices[voice.name.lower()] = voice.voice_id
+
+        return new_voices
+
+    def _store_voice_map(self, voices: dict[str, str]) -> str:
+        version = str(time.time_ns())
+        ttl = settings.TTS_VOICE_MAP_TTL
+
+        pipe = get_redis().pipeline()
+        pipe.delete(VOICES_KEY)
+        if voices:
+            pipe.hset(VOICES_KEY, mapping=voices)
+            pipe.expire(VOICES_KEY, ttl)
+        pipe.set(VOICES_VERSION_KEY, version, ex=ttl)
+        pipe.execute()
+
+        return version
+
+    def _load_voice_map(self, version: str):
+        TTS.voices = get_redis().hgetall(VOICES_KEY)
+        TTS.voices_version = version
+
+    def _update_voice_map(self, known_version: str | None, blocking: bool = True):
+        redis = get_redis()
+        lock = redis.lock(
+            VOICES_LOCK_KEY,
+            timeout=settings.TTS_VOICE_MAP_LOCK_TIMEOUT,
+            blocking_timeout=settings.TTS_VOICE_MAP_LOCK_TIMEOUT,
+        )
+        if not lock.acquire(blocking=blocking):
+            if blocking:
+                raise TimeoutError("Timed out waiting for the voice map refresh")
             return
+
         try:
-            response = self.client.voices.get_all()
-            new_voices = {}
-            for voice in response.voices:
-                short_name = voice.name.split()[0].lower()
+            # Another worker may have refreshed the map while we waited
+            version = redis.get(VOICES_VERSION_KEY)
+            if version and version != known_version:
+                self._load_voice_map(version)
+                return
+
+            try:
+                voices = self._fetch_voice_map()
+            except Exception as e:
+                logger.error("Failed to refresh voice map: %s", str(e))
+                raise
+
+            TTS.voices = voices
+            TTS.voices_version = self._store_voice_map(voices)
+            logger.info("Voice map refreshed, loaded %s voices", len(voices))
+        finally:
+            lock.release()
+
+    def _refresh_in_background(self, known_version: str):
+        try:
+            self._update_voice_map(known_version, blocking=False)
+        except Exception as e:
+            logger.warning("Background voice map refresh failed: %s", e)
 
-                if short_name not in new_voices:
-                    new_voices[short_name] = voice.voice_id
+    def _refresh_voice_map(self, force: bool = False):
+        redis = get_redis()
+        version = redis.get(VOICES_VERSION_KEY)
 
-                new_voices[voice.name.lower()] = voice.voice_id
+        if not version:
+            self._update_voice_map(None)
+            return
 
-            TTS.voices = new_voices
+        if force:
+            age = time.time() - int(version) / 1e9
+            if age >= settings.TTS_VOICE_MAP_MIN_AGE:
+                self._update_voice_map(version)
+                return
 
-            logger.info("Voice map refreshed, loaded %s voices", len(self.voices))
-        except Exception as e:
-            logger.error("Failed to refresh voice map: %s", str(e))
-            raise
+        if version != TTS.voices_version or not TTS.voices:
+            self._load_voice_map(version)
+        else:
+            logger.info("Using cached voice map")
+
+        if redis.ttl(VOICES_VERSION_KEY) < settings.TTS_VOICE_MAP_REFRESH_AHEAD:
+            threading.Thread(
+                target=self._refresh_in_background, args=(version,), daemon=True
+            ).start()
+
+    def _synthesize(self, text: str, voice_id: str, path: Path):
+        for attempt in range(settings.TTS_MAX_RETRIES + 1):
+            self.bucket.acquire()
+            try:
+                audio = self.client.text_to_speech.convert(
+                    text=text,
+                    voice_id=voice_id,
+                    model_id=settings.TTS_MODEL_ID,
+                    output_format=settings.TTS_OUTPUT_FORMAT,
+                )
+                save(audio, str(path))
+                return
+            except ApiError as e:
+                if e.status_code != 429 or attempt == settings.TTS_MAX_RETRIES:
+                    raise
+
+                headers = {k.lower(): v for k, v in (e.headers or {}).items()}
+                try:
+                    retry_after = float(headers.get("retry-after", ""))
+                except ValueError:
+                    retry_after = 2**attempt
+
+                self.bucket.pause(retry_after)
 
     def generate_voiceover(self, text: str, voice_name: str) -> Path:
         voice_id = TTS.voices.get(voice_name.lower())
@@ -53,42 +165,64 @@ class TTS:
             raise ValueError(f"Voice '{voice_name}' is not available")
 
         start_time = time.perf_counter()
-        voiceover_hash = hashlib.md5(f"{text}|{voice_id}".encode()).hexdigest()
-        local_path = self.tts_dir.joinpath(f"{voiceover_hash}.mp3")
+        key = MediaCache.make_key(
+            "tts", text, voice_id, settings.TTS_MODEL_ID, settings.TTS_OUTPUT_FORMAT
+        )
+        local_path = self.tts_dir.joinpath(f"{key}.mp3")
 
         if local_path.exists():
             logger.info("Using cached voiceover")
             return local_path
 
-        try:
-            audio = self.client.text_to_speech.convert(
-                text=text, voice_id=voice_id, model_id="eleven_multilingual_v2"
-            )
-            save(audio, str(local_path))
-
-            logger.info(
-                "Voiceover for %s generated in %.2fs",
-                voice_name,
-                time.perf_counter() - start_time,
-            )
-            return local_path
-        except Exception as e:
-            logger.error("Failed to generate voiceover: %s", str(e))
-            if local_path.exists():
-                local_path.unlink()
-            raise
-
-    def prepare_voiceovers(self, tts_items: list[dict]):
+        # Concurrent requests for the same line wait on the key lock and then
+        # pick up the stored result instead of synthesizing it again
+        with self.cache.lock(key):
+            entry = self.cache.get(key, ".mp3")
+            if entry:
+                logger.info("Using stored voiceover for %s", voice_name)
+            else:
+                partial_path = self.cache.partial_path(key)
+                try:
+                    self._synthesize(text, voice_id, partial_path)
+                except Exception as e:
+                    logger.error("Failed to generate voiceover: %s", str(e))
+                    partial_path.unlink(missing_ok=True)
+                    raise
+
+                entry = self.cache.commit(key, ".mp3")
+                logger.info(
+                    "Voiceover for %s generated in %.2fs",
+                    voice_name,
+                    time.perf_counter() - start_time,
+                )
+
+            self.cache.link(entry, local_path)
+
+        return local_path
+
+    def prepare_voiceovers(
+        self,
+        tts_items: list[dict],
+        on_ready: Callable[[int, Path], None] | None = None,
+    ):
         start_time = time.perf_counter()
 
         logger.info("Updating voice map...")
         self._refresh_voice_map()
 
+        if any(item["voice"].lower() not in TTS.voices for item in tts_items):
+            logger.info("Unknown voice requested, refreshing voice map")
+            self._refresh_voice_map(force=True)
+
         with ThreadPoolExecutor(max_workers=settings.MAX_WORKERS_FOR_TTS) as executor:
             futures = [
                 executor.submit(self.generate_voiceover, item["text"], item["voice"])
                 for item in tts_items
             ]
+            for future in as_completed(futures):
+                local_path = future.result()
+                if on_ready:
+                    on_ready(futures.index(future), local_path)
             local_tts = [f.result() for f in futures]
 
         logger.info(
@@ -1,56 +1,270 @@
 import logging
+import os
 import time
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import BinaryIO, Callable
 
 from app.core.config import settings
+from app.services.media_cache import MediaCache
 
 logger = logging.getLogger(__name__)
 
 
 class VideoProcessor:
+    FPS = 30
+    GOP_SIZE = 60
+    TIMESCALE = 15360
+
     def __init__(self, task_id: str):
         self.output_dir = settings.TEMP_DIR.joinpath(f"task_{task_id}", "results")
+        self.normalized_dir = settings.TEMP_DIR.joinpath(
+            f"task_{task_id}", "normalized"
+        )
+        self.mix_dir = settings.TEMP_DIR.joinpath(f"task_{task_id}", "mixes")
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.normalized_dir.mkdir(parents=True, exist_ok=True)
+        self.mix_dir.mkdir(parents=True, exist_ok=True)
         self.video_width = settings.VIDEO_WIDTH
         self.video_height = settings.VIDEO_HEIGHT
+        self.cache = MediaCache()
+
+    @property
+    def video_encoder_args(self) -> list[str]:
+        return [
+            "-c:v",
+            "libx264",
+            "-crf",
+            "28",
+            "-preset",
+            "veryfast",
+            "-profile:v",
+            "high",
+            "-g",
+            str(self.GOP_SIZE),
+            "-keyint_min",
+            str(self.GOP_SIZE),
+            "-sc_threshold",
+            "0",
+        ]
+
+    @property
+    def preview_encoder_args(self) -> list[str]:
+        return ["-c:v", "libx264", "-crf", "35", "-preset", "ultrafast"]
+
+    @property
+    def audio_mix_args(self) -> list[str]:
+        return ["-c:a", "aac", "-b:a", "192k", "-ar", "44100"]
+
+    @property
+    def normalize_profile(self) -> str:
+        return "|".join(
+            [
+                f"{self.video_width}x{self.video_height}",
+                f"fps={self.FPS}",
+                f"timescale={self.TIMESCALE}",
+                *self.video_encoder_args,
+            ]
+        )
+
+    @property
+    def output_profile(self) -> str:
+        return "|".join(
+            [self.normalize_profile, *self.audio_mix_args, "-c", "copy", "-shortest"]
+        )
+
+    def rendition_profile(self, renditions: list[dict]) -> str:
+        return "|".join(
+            [
+                self.output_profile,
+                *[
+                    f"{rendition['name']}={rendition['width']}x{rendition['height']}"
+                    for rendition in renditions
+                ],
+                *(self.video_encoder_args if renditions else []),
+            ]
+        )
+
+    @staticmethod
+    def fit_filters(width: int, height: int) -> list[str]:
+        return [
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease",
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2",
+        ]
+
+    def normalize_filter_args(self, video: Path) -> list[str]:
+        metadata = (self.cache.read_metadata(video.stem) or {}).get("video") or {}
+
+        # Probed inputs only get the filters they actually need, unknown
+        # inputs get the full chain
+        filters = []
+        if (metadata.get("width"), metadata.get("height")) != (
+            self.video_width,
+            self.video_height,
+        ):
+            filters.extend(self.fit_filters(self.video_width, self.video_height))
+        if metadata.get("sar") not in ("1:1", "0:1", "N/A") or filters:
+            filters.append("setsar=1")
+        if abs(metadata.get("fps", 0) - self.FPS) > 0.01:
+            filters.append(f"fps={self.FPS}")
+        if metadata.get("pix_fmt") != "yuv420p":
+            filters.append("format=yuv420p")
+
+        return ["-vf", ",".join(filters)] if filters else []
+
+    def normalized_path(self, video: Path) -> Path:
+        key = MediaCache.make_key(video.stem, self.normalize_profile)
+        return self.normalized_dir.joinpath(f"{key}.mp4")
+
+    def normalize(self, video: Path) -> Path:
+        local_path = self.normalized_path(video)
+        key = local_path.stem
+
+        if local_path.exists():
+            return local_path
+
+        with self.cache.lock(key):
+            entry = self.cache.get(key, ".mp4")
+            if not entry:
+                start_time = time.perf_counter()
+                partial_path = self.cache.partial_path(key)
+
+                command = [
+                    "ffmpeg",
+                    "-y",
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-i",
+                    str(video),
+                    "-an",
+                    *self.normalize_filter_args(video),
+                    *self.video_encoder_args,
+                    "-video_track_timescale",
+                    str(self.TIMESCALE),
+                    "-f",
+                    "mp4",
+                    str(partial_path),
+                ]
+
+                try:
+                    subprocess.run(command, capture_output=True, text=True, check=True)
+                except subprocess.CalledProcessError as e:
+                    logger.error("Failed to normalize %s: %s", video.name, e.stderr)
+                    partial_path.unlink(missing_ok=True)
+                    raise
+
+                entry = self.cache.commit(key, ".mp4")
+                logger.info(
+                    "Normalized %s in %.2fs",
+                    video.name,
+                    time.perf_counter() - start_time,
+                )
+
+            self.cache.link(entry, local_path)
+
+        return local_path
+
+    def write_concat_list(self, video_lst: list[Path], name: str) -> Path:
+        concat_path = self.output_dir.joinpath(f"{name}.txt")
+        lines = []
+        for video in video_lst:
+            escaped = str(video.resolve()).replace("'", "'\\''")
+            lines.append(f"file '{escaped}'\n")
+        concat_path.write_text("".join(lines))
+        return concat_path
+
+    def mix_audio(self, music: Path, voiceover: Path, duration: float) -> Path:
+        key = MediaCache.make_key(
+            music.stem, voiceover.stem, f"{duration:.3f}", *self.audio_mix_args
+        )
+        local_path = self.mix_dir.joinpath(f"{key}.m4a")
+
+        if local_path.exists():
+            return local_path
+
+        with self.cache.lock(key):
+            entry = self.cache.get(key, ".m4a")
+            if not entry:
+                start_time = time.perf_counter()
+                partial_path = self.cache.partial_path(key)
+
+                command = [
+                    "ffmpeg",
+                    "-y",
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-stream_loop",
+                    "-1",
+                    "-i",
+                    str(music),
+                    "-i",
+                    str(voiceover),
+                    "-filter_complex",
+                    "[0:a]aresample=44100,volume=0.2[m];"
+                    "[1:a]aresample=44100,volume=1.0[vo];"
+                    "[m][vo]amix=inputs=2:duration=first[a]",
+                    "-map",
+                    "[a]",
+                    "-t",
+                    f"{duration:.3f}",
+                    *self.audio_mix_args,
+                    "-f",
+                    "mp4",
+                    str(partial_path),
+                ]
+
+                try:
+                    subprocess.run(command, capture_output=True, text=True, check=True)
+                except subprocess.CalledProcessError as e:
+                    logger.error(
+                        "Failed to mix %s with %s: %s",
+                        music.name,
+                        voiceover.name,
+                        e.stderr,
+                    )
+                    partial_path.unlink(missing_ok=True)
+                    raise
+
+                entry = self.cache.commit(key, ".m4a")
+                logger.info(
+                    "Mixed %s with %s in %.2fs",
+                    music.name,
+                    voiceover.name,
+                    time.perf_counter() - start_time,
+                )
+
+            self.cache.link(entry, local_path)
+
+        return local_path
 
     def render(
         self,
         video_lst: list[Path],
-        music: Path,
-        voiceover: Path,
+        audio: Path,
         index: int,
         total_videos: int,
     ) -> Path:
-        local_path = self.output_dir.joinpath(f"result_{index + 1}.mp4")
+        item = {"video_lst": video_lst, "audio": audio, "index": index}
+        return self.render_batch([item], total_videos)[0]
+
+    def render_preview(self, video_lst: list[Path], audio: Path, index: int) -> Path:
         start_time = time.perf_counter()
+        local_path = self.output_dir.joinpath(f"preview_{index + 1}.mp4")
 
-        inputs = []
-        for video in video_lst:
-            inputs.extend(["-i", str(video)])
-        inputs.extend(["-stream_loop", "-1", "-i", str(music)])
-        inputs.extend(["-i", str(voiceover)])
-
-        n = len(video_lst)
-        video_filters = ""
-        concat_input = ""
-
-        for i in range(n):
-            video_filters += (
-                f"[{i}:v]scale={self.video_width}:{self.video_height}:force_original_aspect_ratio=decrease,"
-                f"pad={self.video_width}:{self.video_height}:(ow-iw)/2:(oh-ih)/2,"
-                f"setsar=1,fps=30,format=yuv420p[v{i}];"
-            )
-            concat_input += f"[v{i}]"
-
-        filter_str = (
-            f"{video_filters}"
-            f"{concat_input}concat=n={n}:v=1:a=0[v];"
-            f"[{n}:a]aresample=44100,volume=0.2[m];"
-            f"[{n+1}:a]aresample=44100,volume=1.0[vo];"
-            f"[m][vo]amix=inputs=2:duration=first[a]"
+        # Previews read the downloaded clips directly, so they don't wait for
+        # normalization, and are scaled down before anything is encoded
+        fit = ",".join(
+            self.fit_filters(settings.PREVIEW_WIDTH, settings.PREVIEW_HEIGHT)
         )
+        filters = [
+            f"[{k}:v]{fit},setsar=1,fps={self.FPS},format=yuv420p[v{k}]"
+            for k in range(len(video_lst))
+        ]
+        labels = "".join(f"[v{k}]" for k in range(len(video_lst)))
+        filters.append(f"{labels}concat=n={len(video_lst)}:v=1:a=0[v]")
 
         command = [
             "ffmpeg",
@@ -58,34 +272,214 @@ class VideoProcessor:
             "-hide_banner",
             "-loglevel",
             "error",
-            *inputs,
+            *[arg for video in video_lst for arg in ("-i", str(video))],
+            "-i",
+            str(audio),
             "-filter_complex",
-            filter_str,
+            ";".join(filters),
             "-map",
             "[v]",
             "-map",
-            "[a]",
-            "-c:v",
-            "libx264",
-            "-crf",
-            "28",
+            f"{len(video_lst)}:a",
+            *self.preview_encoder_args,
             "-c:a",
-            "aac",
-            "-preset",
-            "veryfast",
+            "copy",
             "-shortest",
+            "-movflags",
+            "+faststart",
             str(local_path),
         ]
 
+        try:
+            subprocess.run(command, capture_output=True, text=True, check=True)
+        except subprocess.CalledProcessError as e:
+            logger.error("Failed to render preview %s: %s", index + 1, e.stderr)
+            raise
+
+        logger.info(
+            "Rendered preview %s in %.2fs", index + 1, time.perf_counter() - start_time
+        )
+        return local_path
+
+    def _batch_command(
+        self,
+        items: list[dict],
+        targets: list[str],
+        output_args: list[str],
+        renditions: list[dict] = (),
+    ) -> tuple[list[str], list[Path]]:
+        inputs = []
+        concat_paths = []
+        for item in items:
+            concat_path = self.write_concat_list(
+                item["video_lst"], f"concat_{item['index'] + 1}"
+            )
+            concat_paths.append(concat_path)
+            inputs.extend(["-f", "concat", "-safe", "0", "-i", str(concat_path)])
+
+        # Premixed tracks are opened once and mapped into every output using them
+        audio_inputs = {}
+        for item in items:
+            if item["audio"] not in audio_inputs:
+                audio_inputs[item["audio"]] = len(items) + len(audio_inputs)
+                inputs.extend(["-i", str(item["audio"])])
+
+        # The full size output is a stream copy of the normalized clips, each
+        # smaller rendition is scaled from one decode of the same concat
+        per_item = 1 + len(renditions)
+        graphs = []
+        outputs = []
+        for k, item in enumerate(items):
+            audio = f"{audio_inputs[item['audio']]}:a"
+            item_targets = targets[k * per_item : (k + 1) * per_item]
+            outputs.extend(
+                [
+                    "-map",
+                    f"{k}:v",
+                    "-map",
+                    audio,
+                    "-c",
+                    "copy",
+                    "-shortest",
+                    *output_args,
+                    item_targets[0],
+                ]
+            )
+            if not renditions:
+                continue
+
+            labels = [f"[s{k}_{j}]" for j in range(len(renditions))]
+            graphs.append(f"[{k}:v]split={len(renditions)}{''.join(labels)}")
+            for j, (rendition, target) in enumerate(zip(renditions, item_targets[1:])):
+                filters = self.fit_filters(rendition["width"], rendition["height"])
+                graphs.append(f"{labels[j]}{','.join(filters)},setsar=1[r{k}_{j}]")
+                outputs.extend(
+                    [
+                        "-map",
+                        f"[r{k}_{j}]",
+                        "-map",
+                        audio,
+                        *self.video_encoder_args,
+                        "-c:a",
+                        "copy",
+                        "-shortest",
+                        *output_args,
+                        target,
+                    ]
+                )
+
+        command = [
+            "ffmpeg",
+            "-y",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            *inputs,
+            *(["-filter_complex", ";".join(graphs)] if graphs else []),
+            *outputs,
+        ]
+        return command, concat_paths
+
+    def output_paths(self, items: list[dict], renditions: list[dict]) -> list[Path]:
+        return [
+            self.output_dir.joinpath(f"result_{item['index'] + 1}{suffix}.mp4")
+            for item in items
+            for suffix in ["", *[f"_{rendition['name']}" for rendition in renditions]]
+        ]
+
+    def render_batch(
+        self, items: list[dict], total_videos: int, renditions: list[dict] = ()
+    ) -> list[Path]:
+        start_time = time.perf_counter()
+
+        local_paths = self.output_paths(items, renditions)
+        command, concat_paths = self._batch_command(
+            items, [str(path) for path in local_paths], [], renditions
+        )
+
+        indexes = [item["index"] + 1 for item in items]
         try:
             subprocess.run(command, capture_output=True, text=True, check=True)
             logger.info(
-                "Finished rendering [%s/%s] video in %.2fs",
-                index + 1,
+                "Finished rendering %s/%s video in %.2fs",
+                indexes,
                 total_videos,
                 time.perf_counter() - start_time,
             )
-            return local_path
+            return local_paths
+        except subprocess.CalledProcessError as e:
+            logger.error("Failed to render %s: %s", indexes, e.stderr)
+            raise
+        finally:
+            for concat_path in concat_paths:
+                concat_path.unlink(missing_ok=True)
+
+    def stream_batch(
+        self,
+        items: list[dict],
+        total_videos: int,
+        sink: Callable[[int, BinaryIO], str],
+        renditions: list[dict] = (),
+    ) -> list[str]:
+        start_time = time.perf_counter()
+
+        # Each output gets its own pipe, fragmented MP4 needs no seek back
+        # to write the moov atom
+        pipes = [os.pipe() for _ in range(len(items) * (1 + len(renditions)))]
+        command, concat_paths = self._batch_command(
+            items,
+            [f"pipe:{write_fd}" for _, write_fd in pipes],
+            ["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4"],
+            renditions,
+        )
+
+        def drain(k: int, read_fd: int) -> str:
+            with os.fdopen(read_fd, "rb") as stream:
+                return sink(k, stream)
+
+        indexes = [item["index"] + 1 for item in items]
+        try:
+            try:
+                process = subprocess.Popen(
+                    command,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                    pass_fds=[write_fd for _, write_fd in pipes],
+                    text=True,
+                )
+            except Exception:
+                for read_fd, _ in pipes:
+                    os.close(read_fd)
+                raise
+            finally:
+                for _, write_fd in pipes:
+                    os.close(write_fd)
+
+            # Sinks only start once ffmpeg is running, a process that never
+            # started must not leave empty outputs behind
+            with ThreadPoolExecutor(max_workers=len(pipes)) as executor:
+                futures = [
+                    executor.submit(drain, k, read_fd)
+                    for k, (read_fd, _) in enumerate(pipes)
+                ]
+                _, stderr = process.communicate()
+                results = [future.result() for future in futures]
+
+            if process.returncode:
+                raise subprocess.CalledProcessError(
+                    process.returncode, command, stderr=stderr
+                )
+
+            logger.info(
+                "Finished streaming %s/%s video in %.2fs",
+                indexes,
+                total_videos,
+                time.perf_counter() - start_time,
+            )
+            return results
         except subprocess.CalledProcessError as e:
-            logger.error("Failed to render %s: %s", index, e.stderr)
+            logger.error("Failed to render %s: %s", indexes, e.stderr)
             raise
+        finally:
+            for concat_path in concat_paths:
+                concat_path.unlink(missing_ok=True)
@@ -1,37 +1,309 @@
-import itertools
+import json
 import logging
-import random
+import math
 import shutil
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
 
-from celery import shared_task, chain, chord
+import requests
+from celery import shared_task, chain
+from celery.exceptions import Retry
+from google.api_core.exceptions import ServerError, TooManyRequests
+from google.cloud.exceptions import NotFound
 
 from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.services.disk_guard import DiskGuard
 from app.services.media_manager import MediaManager
+from app.services.media_probe import MediaProbe
+from app.services.node_registry import NodeRegistry
+from app.services.peer_cache import PeerCache
+from app.services.render_cost import RenderCostModel
+from app.services.render_scheduler import RenderScheduler
+from app.services.request_registry import RequestRegistry
+from app.services.result_cache import ResultCache
+from app.services.render_planner import (
+    count_combinations,
+    input_refcounts,
+    job_at,
+    job_inputs,
+    required_inputs,
+    sample_combinations,
+)
 from app.services.storage_service import StorageService
 from app.services.tts import TTS
 from app.services.video_processor import VideoProcessor
 
 logger = logging.getLogger(__name__)
 
+# Network tasks retry transient failures with exponential backoff. Renders
+# don't, ffmpeg fails the same way on the same inputs and the combination is
+# left for a resume instead
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    requests.exceptions.RequestException,
+    ServerError,
+    TooManyRequests,
+)
+RETRY_OPTIONS = {
+    "autoretry_for": TRANSIENT_ERRORS,
+    "retry_backoff": True,
+    "retry_backoff_max": settings.TASK_RETRY_BACKOFF_MAX,
+    "retry_jitter": True,
+    "max_retries": settings.TASK_MAX_RETRIES,
+}
+
+
+def resolve_videos(video_processor: VideoProcessor, params: dict) -> list[Path]:
+    return [video_processor.normalize(Path(video)) for video in params["video_lst"]]
+
 
 @shared_task
-def render_task(params: dict):
-    video_processor = VideoProcessor(params["task_id"])
-    local_path = video_processor.render(
-        video_lst=[Path(video) for video in params["video_lst"]],
-        music=Path(params["music"]),
-        voiceover=Path(params["voiceover"]),
-        index=params["index"],
-        total_videos=params["total_videos"],
+def normalize_task(task_id: str, video: str):
+    if not settings.TEMP_DIR.joinpath(f"task_{task_id}").exists():
+        logger.info("Task %s already finished, skipping normalization", task_id)
+        return None
+    if not Path(video).exists():
+        logger.info("%s is no longer needed, skipping normalization", video)
+        return None
+
+    video_processor = VideoProcessor(task_id)
+    return str(video_processor.normalize(Path(video)))
+
+
+@contextmanager
+def render_slot(batch: list[dict]):
+    task_id = batch[0]["task_id"]
+    scheduler = RenderScheduler(get_redis(), task_id)
+    if "queued_at" in batch[0]:
+        wait = scheduler.record_wait(batch[0]["queued_at"])
+        logger.info("Render of %s waited %.2fs in queue", task_id, wait)
+
+    # Combinations rejected from their preview while queued are skipped
+    rejected = scheduler.rejected([params["index"] for params in batch])
+    if rejected:
+        logger.info("Skipping %s rejected renders of %s", len(rejected), task_id)
+    kept = [params for params in batch if params["index"] not in rejected]
+
+    start_time = time.perf_counter()
+    try:
+        localize_inputs(kept)
+        yield kept
+        RenderCostModel(get_redis()).record(
+            sum(params.get("cost", 0.0) for params in kept),
+            time.perf_counter() - start_time,
+        )
+    finally:
+        release_inputs(task_id, batch)
+        # The heavy slot is handed back as soon as ffmpeg is done, uploads
+        # don't hold up the next render of this request
+        scheduler.release()
+        try:
+            dispatch_renders(task_id)
+        except Exception as e:
+            # The render itself succeeded, a failed dispatch is retried from
+            # a task of its own instead of failing it
+            logger.error("Dispatch after render of %s failed: %s", task_id, e)
+            try:
+                dispatch_task.s(task_id).set(queue="light").apply_async()
+            except Exception as e:
+                logger.error("Could not schedule dispatch of %s: %s", task_id, e)
+
+
+def localize_inputs(batch: list[dict]):
+    # Inputs are on the disk of the node that downloaded them, a render that
+    # landed elsewhere gets them from a peer or the origin first
+    if not settings.MULTI_NODE or not batch:
+        return
+    # The node now has files of the task that its cleanup has to remove
+    RenderScheduler(get_redis(), batch[0]["task_id"]).join(settings.NODE_ID)
+    peer_cache = PeerCache(NodeRegistry(get_redis()))
+    for params in batch:
+        for local_path, origin in params.get("origins", {}).items():
+            peer_cache.ensure(Path(local_path), origin)
+
+
+def render_node(batch: list[dict]) -> str | None:
+    if not settings.MULTI_NODE:
+        return None
+    return NodeRegistry(get_redis()).best_node(
+        sorted({Path(path).name for params in batch for path in params["origins"]})
+    )
+
+
+def node_queue(kind: str, node: str | None) -> str:
+    # Without a node any worker of the kind may take the task
+    return NodeRegistry.queue(node, kind) if node else kind
+
+
+def release_inputs(task_id: str, batch: list[dict]):
+    scheduler = RenderScheduler(get_redis(), task_id)
+    freed = scheduler.release_refs(
+        [name for params in batch for name in params.get("references", [])]
+    )
+    if not freed:
+        return
+
+    # Files no pending combination reads any more are deleted right away
+    # instead of with the task directory
+    paths = scheduler.paths
+    video_processor = VideoProcessor(task_id)
+    for name in freed:
+        if name not in paths:
+            continue
+        local_path = Path(paths[name])
+        for path in (local_path, video_processor.normalized_path(local_path)):
+            path.unlink(missing_ok=True)
+    logger.info("Released %s inputs of %s", len(freed), task_id)
+
+
+def output_names(index: int, renditions: list[dict]) -> list[str]:
+    return [
+        f"video_{index}.mp4",
+        *[f"video_{index}_{rendition['name']}.mp4" for rendition in renditions],
+    ]
+
+
+def resolve_audio(video_processor: VideoProcessor, params: dict) -> Path:
+    return video_processor.mix_audio(
+        Path(params["music"]),
+        Path(params["voiceover"]),
+        params["audio_duration"],
     )
 
+
+@shared_task
+def render_task(params: dict):
+    with render_slot([params]) as kept:
+        if not kept:
+            return None
+        video_processor = VideoProcessor(params["task_id"])
+        local_path = video_processor.render(
+            video_lst=resolve_videos(video_processor, params),
+            audio=resolve_audio(video_processor, params),
+            index=params["index"],
+            total_videos=params["total_videos"],
+        )
+
     return str(local_path)
 
 
 @shared_task
-def upload_task(video_path: str, task_name: str, index: int):
+def render_batch_task(batch: list[dict]):
+    renditions = batch[0].get("renditions", [])
+    with render_slot(batch) as kept:
+        local_paths = []
+        if kept:
+            video_processor = VideoProcessor(batch[0]["task_id"])
+            items = [
+                {
+                    "video_lst": resolve_videos(video_processor, params),
+                    "audio": resolve_audio(video_processor, params),
+                    "index": params["index"],
+                }
+                for params in kept
+            ]
+            local_paths = video_processor.render_batch(
+                items, batch[0]["total_videos"], renditions=renditions
+            )
+
+    # Skipped combinations keep their place as None, so the upload step still
+    # lines the outputs up with its indexes
+    rendered = iter(local_paths)
+    return [
+        str(next(rendered)) if params in kept else None
+        for params in batch
+        for _ in range(1 + len(renditions))
+    ]
+
+
+@shared_task
+def render_stream_task(batch: list[dict], task_name: str):
+    gcs = StorageService()
+    renditions = batch[0].get("renditions", [])
+
+    with render_slot(batch) as kept:
+        if not kept:
+            return []
+        remote_paths = [
+            f"{task_name}/{name}"
+            for params in kept
+            for name in output_names(params["index"], renditions)
+        ]
+        staging_paths = [f"{path}.partial" for path in remote_paths]
+
+        video_processor = VideoProcessor(batch[0]["task_id"])
+        items = [
+            {
+                "video_lst": resolve_videos(video_processor, params),
+                "audio": resolve_audio(video_processor, params),
+                "index": params["index"],
+            }
+            for params in kept
+        ]
+
+        # Outputs are streamed to staging objects and only moved into place
+        # once ffmpeg exits cleanly, so a failed render never replaces a good video
+        try:
+            video_processor.stream_batch(
+                items,
+                batch[0]["total_videos"],
+                lambda k, stream: gcs.upload_stream(stream, staging_paths[k]),
+                renditions=renditions,
+            )
+        except Exception:
+            for staging_path in staging_paths:
+                gcs.delete(staging_path)
+            raise
+
+    remote_paths = [
+        gcs.move(staging_path, remote_path)
+        for staging_path, remote_path in zip(staging_paths, remote_paths)
+    ]
+    cache_results(
+        gcs,
+        remote_paths,
+        [params.get("result_key") for params in kept],
+        renditions,
+    )
+    return remote_paths
+
+
+def cache_results(
+    gcs: StorageService,
+    remote_paths: list[str],
+    result_keys: list,
+    renditions: list[dict] = (),
+):
+    result_cache = ResultCache(get_redis())
+    names = [None, *[rendition["name"] for rendition in renditions]]
+    for k, key in enumerate(result_keys):
+        if not key:
+            continue
+        outputs = remote_paths[k * len(names) : (k + 1) * len(names)]
+        try:
+            # The key is only stored once every rendition is in the cache
+            objects = [
+                gcs.copy(remote_path, ResultCache.object_path(key, name))
+                for remote_path, name in zip(outputs, names)
+            ]
+            result_cache.store(key, objects[0])
+        except Exception as e:
+            # The video itself is delivered, it just won't be reused
+            logger.warning("Failed to cache %s: %s", outputs[0], e)
+
+
+@shared_task(**RETRY_OPTIONS)
+def upload_task(
+    video_path: str, task_name: str, index: int, result_key: str | None = None
+):
+    if video_path is None:
+        return None
+
     gcs = StorageService()
     remote_path = f"{task_name}/video_{index}.mp4"
     local_path = Path(video_path)
@@ -40,18 +312,377 @@ def upload_task(video_path: str, task_name: str, index: int):
         gcs_url = gcs.upload_file(local_path, remote_path)
         if local_path.exists():
             local_path.unlink()
+        cache_results(gcs, [gcs_url], [result_key])
         return gcs_url
     except Exception as e:
         logger.error("Upload failed: %s", e)
         raise
 
 
+@shared_task(**RETRY_OPTIONS)
+def upload_batch_task(
+    video_paths: list[str],
+    task_name: str,
+    indexes: list[int],
+    result_keys: list | None = None,
+    renditions: list[dict] | None = None,
+):
+    gcs = StorageService()
+    renditions = renditions or []
+    result_keys = result_keys or [None] * len(indexes)
+
+    # Renders rejected after dispatch come back as None and are left out
+    per_item = 1 + len(renditions)
+    files = []
+    uploaded_keys = []
+    for k, index in enumerate(indexes):
+        paths = video_paths[k * per_item : (k + 1) * per_item]
+        if paths[0] is None:
+            continue
+        files.extend(
+            (Path(path), f"{task_name}/{name}")
+            for path, name in zip(paths, output_names(index, renditions))
+        )
+        uploaded_keys.append(result_keys[k])
+
+    try:
+        remote_paths = gcs.upload_many(files)
+        cache_results(gcs, remote_paths, uploaded_keys, renditions)
+        return remote_paths
+    except Exception as e:
+        logger.error("Upload failed: %s", e)
+        raise
+
+
+@shared_task(**RETRY_OPTIONS)
+def preview_task(batch: list[dict], task_name: str):
+    task_id = batch[0]["task_id"]
+    # The task directory may not exist on this node yet, the scheduler state
+    # is gone once the task has finished
+    scheduler = RenderScheduler(get_redis(), task_id)
+    if not scheduler.meta:
+        logger.info("Task %s already finished, skipping previews", task_id)
+        return []
+
+    rejected = scheduler.rejected([params["index"] for params in batch])
+    gcs = StorageService()
+    video_processor = VideoProcessor(task_id)
+    remote_paths = []
+    for params in batch:
+        if params["index"] in rejected:
+            continue
+        if settings.MULTI_NODE:
+            if scheduler.completed([params["index"]]):
+                continue
+            localize_inputs([params])
+        clips = params["video_lst"]
+        sources = [*clips, params["music"], params["voiceover"]]
+        if not all(Path(source).exists() for source in sources):
+            # The final render got there first and released the inputs
+            logger.info(
+                "Combination %s already rendered, skipping preview", params["index"]
+            )
+            continue
+        local_path = video_processor.render_preview(
+            [Path(clip) for clip in clips],
+            resolve_audio(video_processor, params),
+            params["index"],
+        )
+        # Each preview is delivered as soon as it exists, reviewers don't
+        # wait for the rest of the batch
+        remote_paths.append(
+            gcs.upload_file(
+                local_path, f"{task_name}/preview/video_{params['index']}.mp4"
+            )
+        )
+        local_path.unlink(missing_ok=True)
+    return remote_paths
+
+
+@shared_task(**RETRY_OPTIONS)
+def copy_results_task(batch: list[dict], task_name: str, objects: list[str]):
+    gcs = StorageService()
+    remote_paths = []
+    renditions = batch[0].get("renditions", [])
+    for params, source in zip(batch, objects):
+        names = output_names(params["index"], renditions)
+        sources = [
+            source,
+            *[
+                ResultCache.object_path(params["result_key"], rendition["name"])
+                for rendition in renditions
+            ],
+        ]
+        try:
+            for name, cached in zip(names, sources):
+                remote_paths.append(gcs.copy(cached, f"{task_name}/{name}"))
+        except NotFound:
+            ResultCache(get_redis()).forget(params["result_key"])
+            raise
+    logger.info("Served %s videos from the result cache", len(remote_paths))
+    return remote_paths
+
+
 @shared_task
-def cleanup_task(results, task_id: str, start_time):
+def remove_task_dir(task_id: str):
     work_dir = settings.TEMP_DIR.joinpath(f"task_{task_id}")
     if work_dir.exists():
         shutil.rmtree(work_dir)
-    logger.info("Task ended in %.2fs", time.time() - start_time)
+
+
+@shared_task
+def cleanup_task(results, task_id: str, start_time):
+    remove_task_dir(task_id)
+    scheduler = RenderScheduler(get_redis(), task_id)
+    # Every other node that downloaded, rendered or previewed for the task
+    # removes its own copy of the task directory
+    for node in scheduler.nodes - {settings.NODE_ID}:
+        remove_task_dir.s(task_id).set(
+            queue=NodeRegistry.queue(node, "light")
+        ).apply_async()
+
+    DiskGuard(get_redis()).release(task_id)
+    request_key = scheduler.meta.get("request_key")
+    report = scheduler.close()
+    if request_key:
+        RequestRegistry(get_redis()).release(request_key, task_id)
+    logger.info(
+        "Task ended in %.2fs, %s renders waited %.2fs on average (max %.2fs)",
+        time.time() - start_time,
+        report["renders"],
+        report["mean_wait"],
+        report["max_wait"],
+    )
+    if report["missing"]:
+        logger.warning(
+            "Task %s is missing %s combinations, POST /tasks/%s/resume to render them",
+            task_id,
+            report["missing"],
+            task_id,
+        )
+
+
+def finish_render(task_id: str):
+    scheduler = RenderScheduler(get_redis(), task_id)
+    meta = scheduler.meta
+    if meta and scheduler.finish():
+        cleanup_task(None, task_id, float(meta["start_time"]))
+
+
+@shared_task
+def render_done(results, task_id: str, indexes: list[int] | None = None):
+    RenderScheduler(get_redis(), task_id).complete(indexes or [])
+    finish_render(task_id)
+    return results
+
+
+@shared_task
+def render_failed(
+    request, exc, traceback, task_id: str, indexes: list[int] | None = None
+):
+    logger.error("Render chain of %s failed for %s: %s", task_id, indexes, exc)
+    finish_render(task_id)
+
+
+def build_batch(task_id: str, spec: dict, batch_index: int) -> list[dict]:
+    batch_size = spec["batch_size"]
+    count = spec["combinations"]
+    start = batch_index * batch_size
+    return [
+        {
+            "task_id": task_id,
+            **job_at(spec, i),
+            "index": i,
+            "total_videos": count,
+            "renditions": spec.get("renditions", []),
+        }
+        for i in range(start, min(count, start + batch_size))
+    ]
+
+
+@shared_task
+def dispatch_task(task_id: str):
+    dispatch_renders(task_id)
+
+
+def dispatch_renders(task_id: str):
+    scheduler = RenderScheduler(get_redis(), task_id)
+    meta = scheduler.meta
+    if not meta:
+        return
+
+    cost_model = RenderCostModel(get_redis())
+    task_name = meta["task_name"]
+    spec = json.loads(meta["spec"])
+
+    with scheduler.dispatch_lock():
+        paths = scheduler.paths
+        metadata = scheduler.metadata
+
+        # Of the batches in the frontier, those whose inputs are all on disk
+        # go out longest first while the request has free slots
+        ready = []
+        for batch_index in scheduler.frontier(settings.RENDER_LOOKAHEAD):
+            jobs = build_batch(task_id, spec, batch_index)
+            if all(job_inputs(job) <= paths.keys() for job in jobs):
+                batch = [
+                    resolve_job(job, paths, metadata, spec["profile"]) for job in jobs
+                ]
+                ready.append((batch_index, batch))
+        ready.sort(key=lambda item: -sum(params["cost"] for params in item[1]))
+
+        result_cache = ResultCache(get_redis())
+        # Renders write outputs, with the disk nearly full they
+        # wait, only cache copies still go out
+        low_disk = not DiskGuard(get_redis()).has_room()
+        deferred = False
+        for batch_index, batch in ready:
+            # Rejected combinations count as settled, and a resumed request
+            # skips everything a previous run already delivered. Their inputs
+            # are released once the batch leaves the frontier
+            indexes = [params["index"] for params in batch]
+            scheduler.complete(list(scheduler.rejected(indexes)))
+            done = scheduler.completed(indexes)
+            skipped = [params for params in batch if params["index"] in done]
+            batch = [params for params in batch if params["index"] not in done]
+            if not batch:
+                if scheduler.take(batch_index):
+                    release_inputs(task_id, skipped)
+                    finish_render(task_id)
+                continue
+
+            # Previews go out as soon as the inputs are on disk, outside the
+            # render window, on a queue of their own
+            if spec.get("preview") and scheduler.mark_previewed(batch_index):
+                preview_task.s(batch, task_name).set(
+                    queue=node_queue("preview", render_node(batch))
+                ).apply_async()
+
+            # A batch rendered before is copied from the result cache on the
+            # light queue and never takes a heavy slot
+            objects = result_cache.lookup([params["result_key"] for params in batch])
+            if all(objects) and results_exist(result_cache, batch):
+                if scheduler.take(batch_index):
+                    release_inputs(task_id, skipped + batch)
+                    result_cache.count(hits=len(batch))
+                    c = chain(
+                        copy_results_task.s(batch, task_name, objects).set(
+                            queue="light"
+                        ),
+                        render_done.s(task_id, indexes).set(queue="light"),
+                    )
+                    c.on_error(render_failed.s(task_id, indexes).set(queue="light"))
+                    c.apply_async()
+                continue
+
+            if low_disk:
+                deferred = True
+                continue
+            if not scheduler.claim(batch_index):
+                continue
+            release_inputs(task_id, skipped)
+            result_cache.count(misses=len(batch))
+
+            for params in batch:
+                params["queued_at"] = time.time()
+
+            priority = cost_model.priority(
+                cost_model.estimate(sum(params["cost"] for params in batch))
+            )
+            if spec.get("preview"):
+                # Final renders yield to other requests' work while their
+                # previews are being reviewed
+                priority = min(
+                    RenderCostModel.MAX_PRIORITY,
+                    priority + settings.PREVIEW_PRIORITY_OFFSET,
+                )
+            # Renders go to the node holding most of their inputs, unless it is
+            # already busy. Their uploads read the outputs from that node's disk
+            node = render_node(batch)
+            heavy = {"queue": node_queue("heavy", node), "priority": priority}
+            light = {"queue": node_queue("light", node)}
+            if settings.STREAM_UPLOADS:
+                steps = [render_stream_task.s(batch, task_name).set(**heavy)]
+            elif len(batch) == 1 and not batch[0]["renditions"]:
+                steps = [
+                    render_task.s(batch[0]).set(**heavy),
+                    upload_task.s(
+                        task_name, batch[0]["index"], batch[0]["result_key"]
+                    ).set(**light),
+                ]
+            else:
+                steps = [
+                    render_batch_task.s(batch).set(**heavy),
+                    upload_batch_task.s(
+                        task_name,
+                        [params["index"] for params in batch],
+                        [params["result_key"] for params in batch],
+                        batch[0]["renditions"],
+                    ).set(**light),
+                ]
+
+            indexes = [params["index"] for params in batch]
+            c = chain(*steps, render_done.s(task_id, indexes).set(queue="light"))
+            c.on_error(render_failed.s(task_id, indexes).set(queue="light"))
+            c.apply_async()
+
+        if deferred and scheduler.defer(settings.DISK_RETRY_DELAY):
+            # Nothing may be left running to trigger the next dispatch
+            logger.warning(
+                "Less than %.2f GB free in %s, delaying renders of %s",
+                settings.DISK_FREE_WATERMARK / 1024**3,
+                settings.TEMP_DIR,
+                task_id,
+            )
+            dispatch_task.s(task_id).set(
+                queue="light", countdown=settings.DISK_RETRY_DELAY
+            ).apply_async()
+
+
+def results_exist(result_cache: ResultCache, batch: list[dict]) -> bool:
+    # An entry whose objects expired or were deleted counts as a miss, it is
+    # forgotten and the batch is rendered again
+    gcs = StorageService()
+    renditions = [None, *[rendition["name"] for rendition in batch[0]["renditions"]]]
+    stale = [
+        params["result_key"]
+        for params in batch
+        if not all(
+            gcs.exists(ResultCache.object_path(params["result_key"], name))
+            for name in renditions
+        )
+    ]
+    for key in stale:
+        logger.warning("Result cache entry %s has no object, rendering again", key)
+        result_cache.forget(key)
+    return not stale
+
+
+def resolve_job(
+    job: dict, paths: dict[str, str], metadata: dict[str, dict], profile: str
+) -> dict:
+    clips = [paths[clip] for clip in job["video_lst"]]
+    duration = sum(metadata[clip]["duration"] for clip in clips)
+    step = settings.AUDIO_MIX_STEP
+
+    params = {
+        **job,
+        "video_lst": clips,
+        "music": paths[job["music"]],
+        "voiceover": paths[job["voiceover"]],
+        # Mixes are cut to the video length rounded up to AUDIO_MIX_STEP, so
+        # combinations of similar length still share one mix
+        "audio_duration": math.ceil(duration / step) * step,
+        "cost": RenderCostModel.units(clips, metadata, job["renditions"]),
+        "references": sorted(job_inputs(job)),
+        # Voiceovers can only come from a node that synthesized them
+        "origins": {
+            paths[name]: None if name.startswith("tts:") else name
+            for name in sorted(job_inputs(job))
+        },
+    }
+    params["result_key"] = ResultCache.make_key(params, profile)
+    return params
 
 
 @shared_task(bind=True)
@@ -61,41 +692,163 @@ def orchestrator(self, data: dict):
 
     logger.info("Starting processing media: %s", task_name)
     start_time = time.time()
+    request_key = RequestRegistry.make_key(data)
 
     try:
+        # Combinations are never materialized: the request is stored as its
+        # URL blocks and every batch is decoded from its index when dispatched
+        video_blocks = MediaManager.order_blocks(
+            {
+                name: [str(url) for url in urls]
+                for name, urls in data["video_blocks"].items()
+            }
+        )
+        audio_urls = sorted(
+            {str(url) for urls in data["audio_blocks"].values() for url in urls}
+        )
+        # Identical lines resolve to one voiceover file, so they share a name
+        # and with it the refcount that decides when the file is deleted
+        first_line = {}
+        voiceovers = [
+            f"tts:{first_line.setdefault((item['text'], item['voice'].lower()), i)}"
+            for i, item in enumerate(data["text_to_speech"])
+        ]
+        renditions = data.get("renditions") or []
+        spec = {
+            "blocks": list(video_blocks.values()),
+            "audio": audio_urls,
+            "voiceovers": voiceovers,
+            "batch_size": settings.RENDER_BATCH_SIZE,
+            "combinations": count_combinations(list(video_blocks.values())),
+            "renditions": renditions,
+            "preview": bool(data.get("preview")),
+            "profile": VideoProcessor(task_id).rendition_profile(renditions),
+        }
+        target_count = data.get("target_count") or spec["combinations"]
+        if target_count < spec["combinations"]:
+            # Only a sample covering every clip is rendered, and only the
+            # assets it uses are downloaded and synthesized
+            spec["indices"] = sample_combinations(
+                [len(block) for block in spec["blocks"]],
+                target_count,
+                data.get("seed", 0),
+            )
+            spec["combinations"] = len(spec["indices"])
+
+        needed = required_inputs(spec)
+        video_downloads = {
+            name: [url for url in urls if url in needed]
+            for name, urls in video_blocks.items()
+        }
+        audio_downloads = {"audio": [url for url in audio_urls if url in needed]}
+        tts_needed = [
+            i
+            for i, name in enumerate(voiceovers)
+            if name == f"tts:{i}" and name in needed
+        ]
+
+        if settings.MULTI_NODE:
+            RenderScheduler(get_redis(), task_id).join(settings.NODE_ID)
+
+        # A request only starts once the space it needs is free, instead of
+        # running into ENOSPC halfway through
         media_manager = MediaManager(task_id)
-        video_blocks, audio_list = media_manager.prepare_media(
-            video_blocks=data["video_blocks"], audio_blocks=data["audio_blocks"]
+        disk_guard = DiskGuard(get_redis())
+        outputs = min(
+            spec["combinations"],
+            settings.MAX_RENDERS_PER_TASK * settings.RENDER_BATCH_SIZE,
+        ) * (1 + len(renditions))
+        footprint = DiskGuard.footprint(
+            media_manager.download_size(video_downloads, audio_downloads), outputs
         )
-        video_combinations = list(itertools.product(*video_blocks.values()))
+        if not disk_guard.admit(task_id, footprint):
+            raise self.retry(
+                countdown=settings.DISK_RETRY_DELAY,
+                max_retries=settings.DISK_ADMISSION_RETRIES,
+            )
 
-        tts = TTS(task_id)
-        voiceover_list = tts.prepare_voiceovers(data["text_to_speech"])
-
-        job_chains = []
-        for i, comb in enumerate(video_combinations):
-            render_params = {
-                "task_id": task_id,
-                "video_lst": [str(path) for path in comb],
-                "music": str(random.choice(audio_list)),
-                "voiceover": str(random.choice(voiceover_list)),
-                "index": i,
-                "total_videos": len(video_combinations),
-            }
+        scheduler = RenderScheduler(get_redis(), task_id)
+        scheduler.checkpoint(data, spec["combinations"])
+        scheduler.start(
+            math.ceil(spec["combinations"] / settings.RENDER_BATCH_SIZE),
+            task_name=task_name,
+            start_time=start_time,
+            request_key=request_key,
+            spec=json.dumps(spec),
+        )
+        # Every input counts the combinations still to render from it
+        scheduler.set_refs(input_refcounts(spec))
 
-            c = chain(
-                render_task.s(render_params).set(queue="heavy"),
-                upload_task.s(task_name, i).set(queue="light"),
+        # Prefetched normalization reads the clip this node downloaded, so it
+        # runs here, and only if this node has a heavy worker to take it
+        normalize_queue = "heavy"
+        if settings.MULTI_NODE:
+            renders_here = settings.NODE_ID in NodeRegistry(get_redis()).render_nodes()
+            normalize_queue = (
+                NodeRegistry.queue(settings.NODE_ID) if renders_here else None
             )
-            job_chains.append(c)
 
-        workflow = chord(job_chains)(cleanup_task.s(task_id, start_time))
+        probe = MediaProbe()
+        failed = threading.Event()
+        audio_set = set(audio_urls)
+
+        def on_ready(name: str, local_path: Path, kind: str):
+            if failed.is_set():
+                return
+            try:
+                # Every asset is probed before anything using it is queued, a
+                # corrupt upload fails the request instead of a render
+                record = probe.probe(local_path, kind)
+            except Exception:
+                failed.set()
+                raise
+            scheduler.set_ready(name, str(local_path), record)
+
+            if kind == "video" and normalize_queue:
+                # Normalization is prefetched at the lowest priority, a render
+                # does the same work inline when it gets there first
+                normalize_task.s(task_id, str(local_path)).set(
+                    queue=normalize_queue, priority=RenderCostModel.MAX_PRIORITY
+                ).apply_async()
 
+            dispatch_renders(task_id)
+
+        tts = TTS(task_id)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(
+                    media_manager.prepare_media,
+                    video_blocks=video_downloads,
+                    audio_blocks=audio_downloads,
+                    on_ready=lambda url, path: on_ready(
+                        url, path, "audio" if url in audio_set else "video"
+                    ),
+                ),
+                executor.submit(
+                    tts.prepare_voiceovers,
+                    [data["text_to_speech"][i] for i in tts_needed],
+                    on_ready=lambda k, path: on_ready(
+                        voiceovers[tts_needed[k]], path, "audio"
+                    ),
+                ),
+            ]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    failed.set()
+                    raise
+
+        # Downloads are on disk now, the reservation has turned into used space
+        disk_guard.release(task_id)
         return {
             "task_id": task_id,
             "status": "processing",
-            "total_combinations": len(video_combinations),
+            "total_combinations": spec["combinations"],
         }
+    except Retry:
+        raise
     except Exception:
+        RequestRegistry(get_redis()).release(request_key, task_id)
         cleanup_task.delay(None, task_id, start_time)
         raise
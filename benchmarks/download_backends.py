@@ -0,0 +1,87 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+os.environ.setdefault("ELEVENLABS_API_KEY", "benchmark")
+os.environ.setdefault("GCS_BUCKET_NAME", "benchmark")
+os.environ.setdefault("GCS_SERVICE_ACCOUNT_JSON", "{}")
+
+from app.core.config import settings  # noqa: E402
+from app.services.media_manager import MediaManager  # noqa: E402
+
+
+def make_handler(files: dict[str, bytes]):
+    class MediaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_headers(self, body: bytes):
+            content_type = "audio/mpeg" if self.path.endswith(".mp3") else "video/mp4"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", f'"{self.path}"')
+            self.end_headers()
+
+        def do_HEAD(self):
+            self._send_headers(files[self.path])
+
+        def do_GET(self):
+            body = files[self.path]
+            self._send_headers(body)
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return MediaHandler
+
+
+def run(backend: str, base_url: str, videos: list[str], audio: list[str]) -> float:
+    settings.DOWNLOAD_BACKEND = backend
+    settings.MEDIA_CACHE_DIR = settings.TEMP_DIR.joinpath(f"bench_cache_{backend}")
+    shutil.rmtree(settings.MEDIA_CACHE_DIR, ignore_errors=True)
+
+    start_time = time.perf_counter()
+    MediaManager(f"bench_{backend}").prepare_media(
+        video_blocks={"block1": [base_url + path for path in videos]},
+        audio_blocks={"audio": [base_url + path for path in audio]},
+    )
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare download backends")
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--size-mb", type=float, default=8)
+    args = parser.parse_args()
+
+    body = os.urandom(int(args.size_mb * 1024 * 1024))
+    videos = [f"/video_{i}.mp4" for i in range(args.files)]
+    audio = [f"/audio_{i}.mp3" for i in range(max(1, args.files // 10))]
+    files = {path: body for path in videos + audio}
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(files))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    settings.TEMP_DIR = Path(tempfile.mkdtemp(prefix="download_bench_"))
+    try:
+        for backend in ("threads", "async"):
+            elapsed = run(backend, base_url, videos, audio)
+            total_mb = len(files) * len(body) / (1024 * 1024)
+            print(
+                f"{backend:>8}: {len(files)} files, {total_mb:.0f} MB "
+                f"in {elapsed:.2f}s ({total_mb / elapsed:.0f} MB/s)"
+            )
+    finally:
+        server.shutdown()
+        shutil.rmtree(settings.TEMP_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
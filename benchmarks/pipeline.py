@@ -0,0 +1,407 @@
+import argparse
+import contextlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+os.environ.setdefault("ELEVENLABS_API_KEY", "benchmark")
+os.environ.setdefault("GCS_BUCKET_NAME", "benchmark")
+os.environ.setdefault("GCS_SERVICE_ACCOUNT_JSON", "{}")
+
+import fakeredis  # noqa: E402
+import redis  # noqa: E402
+from celery.contrib.testing.worker import start_worker  # noqa: E402
+from celery.signals import task_failure, task_postrun, task_prerun  # noqa: E402
+
+from app.core import redis_client  # noqa: E402
+from app.core.celery_app import celery_app  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app.services.render_scheduler import RenderScheduler  # noqa: E402
+from app.services.storage_service import StorageService  # noqa: E402
+from app.services.tts import TTS  # noqa: E402
+from app.tasks import orchestrator  # noqa: E402
+from benchmarks.download_backends import make_handler  # noqa: E402
+from fakes.gcs import FakeGCS  # noqa: E402
+
+QUEUES = ["heavy", "light", "preview", "celery"]
+VOICE = {"voice_id": "benchmark", "name": "Benchmark"}
+
+
+class Shape:
+    def __init__(self, spec: str):
+        # BLOCKSxOPTIONS@WIDTHxHEIGHT, e.g. 2x3@720x1280
+        grid, _, resolution = spec.partition("@")
+        self.blocks, self.options = (int(n) for n in grid.split("x"))
+        self.width, self.height = (
+            (int(n) for n in resolution.split("x"))
+            if resolution
+            else (settings.VIDEO_WIDTH, settings.VIDEO_HEIGHT)
+        )
+        self.name = f"{self.blocks}x{self.options}@{self.width}x{self.height}"
+
+
+def ffmpeg(*args: str):
+    subprocess.run(
+        ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *args], check=True
+    )
+
+
+def make_clip(path: Path, shape: Shape, k: int, seconds: float):
+    ffmpeg(
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc2=size={shape.width}x{shape.height}:rate=30:duration={seconds}",
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=frequency={220 + 20 * k}:duration={seconds}",
+        "-vf",
+        f"hue=h={37 * k}",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "veryfast",
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "aac",
+        "-shortest",
+        str(path),
+    )
+
+
+def make_track(path: Path, k: int, seconds: float):
+    ffmpeg(
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=frequency={330 + 40 * k}:duration={seconds}",
+        "-c:a",
+        "libmp3lame",
+        "-b:a",
+        "128k",
+        str(path),
+    )
+
+
+def make_tts_handler(speech: bytes):
+    class TTSHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, body: bytes, content_type: str):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._send(json.dumps({"voices": [VOICE]}).encode(), "application/json")
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self._send(speech, "audio/mpeg")
+
+        def log_message(self, *args):
+            pass
+
+    return TTSHandler
+
+
+@contextlib.contextmanager
+def serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class Probe:
+    def __init__(self):
+        self.started = {}
+        self.stages = defaultdict(float)
+        self.failures = []
+        self._lock = threading.Lock()
+        task_prerun.connect(self.on_prerun, weak=False)
+        task_postrun.connect(self.on_postrun, weak=False)
+        task_failure.connect(self.on_failure, weak=False)
+
+    def on_prerun(self, task_id, task, **kwargs):
+        self.started[task_id] = time.perf_counter()
+
+    def on_postrun(self, task_id, task, **kwargs):
+        elapsed = time.perf_counter() - self.started.pop(task_id, time.perf_counter())
+        with self._lock:
+            self.stages[task.name.rsplit(".", 1)[-1]] += elapsed
+
+    def on_failure(self, task_id, exception, sender=None, **kwargs):
+        self.failures.append(f"{sender.name}: {exception!r}")
+
+    def reset(self):
+        self.stages.clear()
+        self.failures.clear()
+
+
+def disk_usage(path: Path) -> int:
+    # Cache entries are hard-linked into task directories, each inode once
+    seen = {}
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            seen[(stat.st_dev, stat.st_ino)] = stat.st_size
+    return sum(seen.values())
+
+
+@contextlib.contextmanager
+def peak_disk(path: Path, interval: float = 0.2):
+    peak = {"bytes": 0}
+    stopped = threading.Event()
+
+    def sample():
+        while True:
+            peak["bytes"] = max(peak["bytes"], disk_usage(path))
+            if stopped.wait(interval):
+                break
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    try:
+        yield peak
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def cpu_seconds() -> float:
+    # ffmpeg runs in child processes, their time is counted once reaped
+    usage = [
+        resource.getrusage(who)
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    ]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def run_shape(args, shape: Shape, media_dir: Path, probe: Probe):
+    files = {}
+    for block in range(shape.blocks):
+        for option in range(shape.options):
+            path = media_dir.joinpath(f"{shape.name}_clip_{block}_{option}.mp4")
+            if not path.exists():
+                make_clip(path, shape, block * shape.options + option, args.seconds)
+            files[f"/{shape.name}/block{block}/{option}.mp4"] = path.read_bytes()
+    for track in range(args.tracks):
+        path = media_dir.joinpath(f"track_{track}_{shape.blocks}.mp3")
+        if not path.exists():
+            make_track(path, track, args.seconds * shape.blocks)
+        files[f"/{shape.name}/audio/{track}.mp3"] = path.read_bytes()
+
+    settings.VIDEO_WIDTH, settings.VIDEO_HEIGHT = shape.width, shape.height
+    settings.TEMP_DIR = Path(tempfile.mkdtemp(prefix="pipeline_bench_"))
+    settings.MEDIA_CACHE_DIR = settings.TEMP_DIR.joinpath("media_cache")
+    # Every shape starts cold, nothing is served from a previous shape's caches
+    redis_client._client = (
+        redis.Redis.from_url(args.redis_url, decode_responses=True)
+        if args.redis_url
+        else fakeredis.FakeRedis(decode_responses=True)
+    )
+    if args.redis_url:
+        redis_client._client.flushdb()
+    TTS.voices, TTS.voices_version = {}, None
+    probe.reset()
+
+    with serve(make_handler(files)) as media_url:
+        data = {
+            "task_name": f"bench_{shape.name.replace('@', '_')}",
+            "video_blocks": {
+                f"block{block}": [
+                    f"{media_url}/{shape.name}/block{block}/{option}.mp4"
+                    for option in range(shape.options)
+                ]
+                for block in range(shape.blocks)
+            },
+            "audio_blocks": {
+                "audio": [
+                    f"{media_url}/{shape.name}/audio/{track}.mp3"
+                    for track in range(args.tracks)
+                ]
+            },
+            "text_to_speech": [
+                {"text": f"Benchmark line {k}", "voice": VOICE["name"]}
+                for k in range(args.voiceovers)
+            ],
+        }
+        combinations = shape.options**shape.blocks
+        if args.target_count and args.target_count < combinations:
+            data["target_count"] = combinations = args.target_count
+
+        try:
+            with peak_disk(settings.TEMP_DIR) as peak:
+                cpu_start = cpu_seconds()
+                start_time = time.perf_counter()
+                result = orchestrator.apply_async(args=(data,))
+                result.get(timeout=args.timeout, propagate=False)
+                scheduler = RenderScheduler(redis_client.get_redis(), result.id)
+                while scheduler.meta and not probe.failures:
+                    if time.perf_counter() - start_time > args.timeout:
+                        raise TimeoutError(f"{shape.name} did not finish")
+                    time.sleep(0.1)
+                wall_time = time.perf_counter() - start_time
+                cpu = cpu_seconds() - cpu_start
+        finally:
+            shutil.rmtree(settings.TEMP_DIR, ignore_errors=True)
+
+    return {
+        "shape": shape.name,
+        "blocks": shape.blocks,
+        "options": shape.options,
+        "width": shape.width,
+        "height": shape.height,
+        "outputs": combinations,
+        "wall_time": round(wall_time, 3),
+        "stages": {name: round(t, 3) for name, t in sorted(probe.stages.items())},
+        "cpu_seconds": round(cpu, 3),
+        "cpu_seconds_per_output": round(cpu / combinations, 3),
+        "peak_disk_bytes": peak["bytes"],
+        "failures": list(probe.failures),
+    }
+
+
+def compare(results: list[dict], baseline_path: Path):
+    baseline = {
+        result["shape"]: result
+        for result in json.loads(baseline_path.read_text())["results"]
+    }
+    print(f"Against {baseline_path}:")
+    for result in results:
+        old = baseline.get(result["shape"])
+        if not old:
+            continue
+        changes = [
+            f"{field} {100 * (result[field] / old[field] - 1):+.1f}%"
+            for field in ("wall_time", "cpu_seconds_per_output", "peak_disk_bytes")
+            if old[field]
+        ]
+        print(f"{result['shape']:>18}: {', '.join(changes)}")
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the render pipeline")
+    parser.add_argument(
+        "--shapes",
+        nargs="+",
+        default=["2x2@360x640", "2x3@720x1280", "3x2@1080x1920"],
+        help="BLOCKSxOPTIONS@WIDTHxHEIGHT per request",
+    )
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--tracks", type=int, default=2)
+    parser.add_argument("--voiceovers", type=int, default=2)
+    parser.add_argument("--target-count", type=int)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=6)
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument(
+        "--redis-url",
+        help="Dedicated Redis database, flushed before every shape (fakeredis "
+        "when omitted)",
+    )
+    parser.add_argument(
+        "--emulator",
+        default=os.environ.get("GCS_EMULATOR_HOST"),
+        help="GCS emulator URL, an in-process fake is started when omitted",
+    )
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path, help="Results JSON to compare with")
+    args = parser.parse_args()
+
+    shapes = [Shape(spec) for spec in args.shapes]
+    commit = git_commit()
+    output = args.output or Path(f"pipeline_{(commit or 'unknown')[:12]}.json")
+    media_dir = Path(tempfile.mkdtemp(prefix="pipeline_media_"))
+
+    settings.RENDER_BATCH_SIZE = args.batch_size
+    # Peak disk is measured, not limited, admission must not wait on the host
+    settings.DISK_FREE_WATERMARK = 0
+    celery_app.conf.update(broker_url="memory://", result_backend="cache+memory://")
+    probe = Probe()
+
+    with contextlib.ExitStack() as stack:
+        settings.GCS_EMULATOR_HOST = args.emulator or stack.enter_context(FakeGCS()).url
+        StorageService._client = None
+        speech = media_dir.joinpath("speech.mp3")
+        make_track(speech, 9, args.seconds)
+        settings.ELEVENLABS_BASE_URL = stack.enter_context(
+            serve(make_tts_handler(speech.read_bytes()))
+        )
+        TTS._client = None
+        stack.enter_context(
+            start_worker(
+                celery_app,
+                concurrency=args.concurrency,
+                pool="threads",
+                perform_ping_check=False,
+                queues=QUEUES,
+                shutdown_timeout=args.timeout,
+            )
+        )
+
+        results = []
+        try:
+            for shape in shapes:
+                result = run_shape(args, shape, media_dir, probe)
+                results.append(result)
+                print(
+                    f"{result['shape']:>18}: {result['outputs']} videos "
+                    f"in {result['wall_time']:.2f}s, "
+                    f"{result['cpu_seconds_per_output']:.2f} CPU-s/video, "
+                    f"peak disk {result['peak_disk_bytes'] / (1024 * 1024):.0f} MB"
+                )
+                for failure in result["failures"]:
+                    print(f"{'':>18}  failed {failure}")
+        finally:
+            shutil.rmtree(media_dir, ignore_errors=True)
+
+    output.write_text(
+        json.dumps(
+            {
+                "commit": commit,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "seconds": args.seconds,
+                "batch_size": args.batch_size,
+                "concurrency": args.concurrency,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"Results saved to {output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
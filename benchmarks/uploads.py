@@ -0,0 +1,78 @@
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("ELEVENLABS_API_KEY", "benchmark")
+os.environ.setdefault("GCS_BUCKET_NAME", "benchmark")
+os.environ.setdefault("GCS_SERVICE_ACCOUNT_JSON", "{}")
+
+from app.core.config import settings  # noqa: E402
+from app.services.storage_service import StorageService  # noqa: E402
+from fakes.gcs import FakeGCS  # noqa: E402
+
+
+def make_files(work_dir: Path, prefix: str, count: int, body: bytes):
+    files = []
+    for i in range(count):
+        local_path = work_dir.joinpath(f"{prefix}_{i}.mp4")
+        local_path.write_bytes(body)
+        files.append((local_path, f"bench/{prefix}_{i}.mp4"))
+    return files
+
+
+def timed(label: str, total_mb: float, func):
+    start_time = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start_time
+    rate = total_mb / elapsed
+    print(f"{label:>22}: {total_mb:.0f} MB in {elapsed:.2f}s ({rate:.0f} MB/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark StorageService uploads")
+    parser.add_argument("--files", type=int, default=16)
+    parser.add_argument("--size-mb", type=float, default=16)
+    parser.add_argument(
+        "--emulator",
+        default=os.environ.get("GCS_EMULATOR_HOST"),
+        help="GCS emulator URL, an in-process fake is started when omitted",
+    )
+    args = parser.parse_args()
+
+    body = os.urandom(int(args.size_mb * 1024 * 1024))
+    total_mb = args.files * len(body) / (1024 * 1024)
+    work_dir = Path(tempfile.mkdtemp(prefix="upload_bench_"))
+
+    with contextlib.ExitStack() as stack:
+        emulator = args.emulator or stack.enter_context(FakeGCS()).url
+        settings.GCS_EMULATOR_HOST = emulator
+        StorageService._client = None
+        service = StorageService()
+
+        try:
+            files = make_files(work_dir, "sequential", args.files, body)
+            threshold = settings.GCS_COMPOSITE_THRESHOLD
+            settings.GCS_COMPOSITE_THRESHOLD = len(body) + 1
+
+            def sequential():
+                for local_path, remote_path in files:
+                    service.upload_file(local_path, remote_path)
+
+            timed("sequential", total_mb, sequential)
+
+            settings.GCS_COMPOSITE_THRESHOLD = min(threshold, len(body))
+            files = make_files(work_dir, "batched", args.files, body)
+            timed("upload_many+composite", total_mb, lambda: service.upload_many(files))
+
+            files = make_files(work_dir, "batched", args.files, body)
+            timed("re-upload (skipped)", total_mb, lambda: service.upload_many(files))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
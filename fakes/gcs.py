@@ -0,0 +1,201 @@
+import base64
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import google_crc32c
+
+
+class FakeGCS:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def metadata(self, bucket: str, name: str) -> dict:
+        data = self.objects[(bucket, name)]
+        crc = google_crc32c.Checksum(data).digest()
+        return {
+            "kind": "storage#object",
+            "bucket": bucket,
+            "name": name,
+            "size": str(len(data)),
+            "md5Hash": base64.b64encode(hashlib.md5(data).digest()).decode(),
+            "crc32c": base64.b64encode(crc).decode(),
+            "generation": "1",
+        }
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _body(self) -> bytes:
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _send(self, status: int, payload=None, headers=None):
+                body = b""
+                if isinstance(payload, (dict, list)):
+                    body = json.dumps(payload).encode()
+                elif isinstance(payload, bytes):
+                    body = payload
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                if isinstance(payload, (dict, list)):
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _route(self, method: str):
+                parsed = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                path = parsed.path
+                with fake._lock:
+                    fake.requests.append((method, path, query))
+
+                match = re.match(r"^/upload/storage/v1/b/([^/]+)/o$", path)
+                if match:
+                    return self._upload(method, unquote(match.group(1)), query)
+
+                match = re.match(
+                    r"^/storage/v1/b/([^/]+)/o/(.+)/(copyTo|rewriteTo)"
+                    r"/b/([^/]+)/o/(.+)$",
+                    path,
+                )
+                if match and method == "POST":
+                    self._body()
+                    src = (unquote(match.group(1)), unquote(match.group(2)))
+                    dst = (unquote(match.group(4)), unquote(match.group(5)))
+                    if src not in fake.objects:
+                        return self._send(404, {"error": {"code": 404}})
+                    fake.objects[dst] = fake.objects[src]
+                    metadata = fake.metadata(*dst)
+                    if match.group(3) == "rewriteTo":
+                        metadata = {
+                            "kind": "storage#rewriteResponse",
+                            "done": True,
+                            "totalBytesRewritten": metadata["size"],
+                            "objectSize": metadata["size"],
+                            "resource": metadata,
+                        }
+                    return self._send(200, metadata)
+
+                match = re.match(r"^/storage/v1/b/([^/]+)/o/(.+)/compose$", path)
+                if match and method == "POST":
+                    bucket = unquote(match.group(1))
+                    request = json.loads(self._body())
+                    data = b"".join(
+                        fake.objects[(bucket, source["name"])]
+                        for source in request["sourceObjects"]
+                    )
+                    fake.objects[(bucket, unquote(match.group(2)))] = data
+                    return self._send(
+                        200, fake.metadata(bucket, unquote(match.group(2)))
+                    )
+
+                match = re.match(r"^(/download)?/storage/v1/b/([^/]+)/o/(.+)$", path)
+                if match:
+                    key = (unquote(match.group(2)), unquote(match.group(3)))
+                    if method == "DELETE":
+                        if fake.objects.pop(key, None) is None:
+                            return self._send(404, {"error": {"code": 404}})
+                        return self._send(204)
+                    if key not in fake.objects:
+                        return self._send(404, {"error": {"code": 404}})
+                    if query.get("alt") == "media":
+                        return self._send(200, fake.objects[key])
+                    return self._send(200, fake.metadata(*key))
+
+                self._send(404, {"error": {"code": 404, "message": path}})
+
+            def _upload(self, method: str, bucket: str, query: dict):
+                upload_type = query.get("uploadType")
+
+                if method == "POST" and upload_type == "multipart":
+                    body = self._body()
+                    boundary = self.headers["Content-Type"].split("boundary=")[1]
+                    boundary = boundary.strip('"').encode()
+                    parts = body.split(b"--" + boundary)
+                    metadata = json.loads(parts[1].split(b"\r\n\r\n", 1)[1])
+                    data = parts[2].split(b"\r\n\r\n", 1)[1][: -len(b"\r\n")]
+                    name = query.get("name") or metadata["name"]
+                    fake.objects[(bucket, name)] = data
+                    return self._send(200, fake.metadata(bucket, name))
+
+                if method == "POST" and upload_type == "resumable":
+                    body = self._body()
+                    metadata = json.loads(body) if body else {}
+                    name = query.get("name") or metadata["name"]
+                    with fake._lock:
+                        upload_id = str(len(fake.uploads) + 1)
+                        fake.uploads[upload_id] = {
+                            "bucket": bucket,
+                            "name": name,
+                            "data": bytearray(),
+                        }
+                    location = (
+                        f"{fake.url}/upload/storage/v1/b/{bucket}/o"
+                        f"?uploadType=resumable&upload_id={upload_id}"
+                    )
+                    return self._send(200, {}, {"Location": location})
+
+                if method == "PUT" and "upload_id" in query:
+                    upload = fake.uploads[query["upload_id"]]
+                    chunk = self._body()
+                    content_range = self.headers.get("Content-Range", "")
+                    match = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", content_range)
+                    if match:
+                        start = int(match.group(1))
+                        del upload["data"][start:]
+                        upload["data"].extend(chunk)
+                    total = content_range.rsplit("/", 1)[-1]
+
+                    if total != "*" and len(upload["data"]) == int(total):
+                        key = (upload["bucket"], upload["name"])
+                        fake.objects[key] = bytes(upload["data"])
+                        return self._send(200, fake.metadata(*key))
+
+                    headers = {}
+                    if upload["data"]:
+                        headers["Range"] = f"bytes=0-{len(upload['data']) - 1}"
+                    return self._send(308, b"", headers)
+
+                self._send(400, {"error": {"code": 400}})
+
+            def do_GET(self):
+                self._route("GET")
+
+            def do_POST(self):
+                self._route("POST")
+
+            def do_PUT(self):
+                self._route("PUT")
+
+            def do_DELETE(self):
+                self._route("DELETE")
+
+        return Handler
@@ -1,7 +1,11 @@
+import fakeredis
 import pytest
 import shutil
 from pathlib import Path
+from app.core import redis_client
 from app.core.config import settings
+from app.services.storage_service import StorageService
+from fakes.gcs import FakeGCS
 
 
 @pytest.fixture(autouse=True)
@@ -10,3 +14,29 @@ def cleanup_tmp():
     test_dir = Path(settings.TEMP_DIR)
     if test_dir.exists():
         shutil.rmtree(test_dir)
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_client, "_client", client)
+    yield client
+
+
+@pytest.fixture(autouse=True)
+def reset_storage_state():
+    StorageService._client = None
+    yield
+    StorageService._client = None
+
+
+@pytest.fixture
+def fake_gcs(mocker):
+    with FakeGCS() as fake:
+        mocker.patch(
+            "app.services.storage_service.settings.GCS_EMULATOR_HOST", fake.url
+        )
+        mocker.patch(
+            "app.services.storage_service.settings.GCS_UPLOAD_CHUNK_SIZE", 256 * 1024
+        )
+        yield fake
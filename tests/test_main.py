@@ -0,0 +1,29 @@
+import pytest
+from kombu.exceptions import OperationalError
+
+from app import main
+from app.schemas import MediaRequest
+from app.services.request_registry import RequestRegistry
+
+
+def test_failed_enqueue_releases_the_request(monkeypatch, fake_redis):
+    request = MediaRequest(
+        task_name="t",
+        video_blocks={"b1": ["http://example.com/v.mp4"]},
+        audio_blocks={"music": ["http://example.com/a.mp3"]},
+        text_to_speech=[{"text": "hi", "voice": "v"}],
+    )
+    key = RequestRegistry.make_key(request.model_dump(mode="json"))
+
+    def unreachable(*args, **kwargs):
+        raise OperationalError("broker is down")
+
+    monkeypatch.setattr(main.orchestrator, "apply_async", unreachable)
+    with pytest.raises(OperationalError):
+        main.process_media(request)
+    assert not fake_redis.exists(key)
+
+    # The retried submission gets a task of its own
+    monkeypatch.setattr(main.orchestrator, "apply_async", lambda **kwargs: None)
+    response = main.process_media(request)
+    assert fake_redis.get(key) == response["task_id"]
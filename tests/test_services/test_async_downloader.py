@@ -0,0 +1,134 @@
+import asyncio
+
+import httpx
+import pytest
+from pydantic import ValidationError
+
+from app.core.config import Settings
+from app.services.async_downloader import AsyncDownloader
+from app.services.media_cache import MediaCache
+from app.services.media_manager import MediaManager
+
+
+def make_transport(requests, content_type="video/mp4", body=b"x" * 100_000):
+    def handler(request):
+        requests.append(request.method)
+        headers = {"Content-Type": content_type, "ETag": '"v1"'}
+        if request.method == "HEAD":
+            return httpx.Response(200, headers=headers)
+        return httpx.Response(200, headers=headers, content=body)
+
+    return httpx.MockTransport(handler)
+
+
+def run_download(downloader, jobs, transport):
+    async def main():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await downloader.download_many(jobs, client)
+
+    return asyncio.run(main())
+
+
+def test_download_many_writes_to_cache(tmp_path):
+    requests = []
+    downloader = AsyncDownloader(MediaCache())
+    jobs = [(f"https://example.com/{i}.mp4", tmp_path, "video/mp4") for i in range(3)]
+
+    results = run_download(downloader, jobs, make_transport(requests))
+
+    assert [url for url, _, _ in results] == [url for url, _, _ in jobs]
+    for _, local_path, size in results:
+        assert local_path.read_bytes() == b"x" * 100_000
+        assert size == 100_000
+    assert requests.count("GET") == 3
+
+
+def test_download_many_uses_known_headers(tmp_path):
+    requests = []
+    downloader = AsyncDownloader(MediaCache())
+    url = "https://example.com/a.mp4"
+
+    async def main():
+        async with httpx.AsyncClient(transport=make_transport(requests)) as client:
+            return await downloader.download_many(
+                [(url, tmp_path, "video/mp4")],
+                client,
+                headers={url: httpx.Headers({"ETag": '"v1"'})},
+            )
+
+    asyncio.run(main())
+
+    assert requests == ["GET"]
+
+
+def test_download_many_reports_each_file(tmp_path):
+    ready = []
+    downloader = AsyncDownloader(MediaCache())
+    jobs = [(f"https://example.com/{i}.mp4", tmp_path, "video/mp4") for i in range(2)]
+
+    async def main():
+        client = httpx.AsyncClient(transport=make_transport([]))
+        async with client:
+            return await downloader.download_many(
+                jobs, client, on_ready=lambda url, path: ready.append((url, path))
+            )
+
+    results = asyncio.run(main())
+
+    assert sorted(ready) == sorted((url, path) for url, path, _ in results)
+
+
+def test_download_many_reuses_cache(tmp_path):
+    requests = []
+    jobs = [("https://example.com/a.mp4", tmp_path / "first", "video/mp4")]
+    jobs[0][1].mkdir()
+    run_download(AsyncDownloader(MediaCache()), jobs, make_transport(requests))
+
+    second = [("https://example.com/a.mp4", tmp_path / "second", "video/mp4")]
+    second[0][1].mkdir()
+    run_download(AsyncDownloader(MediaCache()), second, make_transport(requests))
+
+    assert requests.count("GET") == 1
+
+
+def test_download_many_wrong_mime(tmp_path):
+    downloader = AsyncDownloader(MediaCache())
+    jobs = [("https://example.com/a.mp4", tmp_path, "video/mp4")]
+
+    with pytest.raises(ValueError, match="Expected mime type"):
+        run_download(downloader, jobs, make_transport([], content_type="text/html"))
+
+    assert not list(downloader.cache.cache_dir.glob("*.part"))
+
+
+def test_prepare_media_async_backend(mocker):
+    mocker.patch("app.services.media_manager.settings.DOWNLOAD_BACKEND", "async")
+    download_many = mocker.patch.object(AsyncDownloader, "download_many", autospec=True)
+    mm = MediaManager("test_async_backend")
+    video = mm.video_dir / "v.mp4"
+    audio = mm.audio_dir / "a.mp3"
+
+    async def fake_download_many(self, jobs, client=None, on_ready=None, headers=None):
+        return [
+            ("https://example.com/v.mp4", video, 1),
+            ("https://example.com/a.mp3", audio, 1),
+        ]
+
+    download_many.side_effect = fake_download_many
+
+    local_video, local_audio = mm.prepare_media(
+        {"block1": ["https://example.com/v.mp4"]},
+        {"audio": ["https://example.com/a.mp3"]},
+    )
+
+    assert local_video == {"block1": [video]}
+    assert local_audio == [audio]
+
+
+def test_ranged_settings_are_rejected_by_the_async_backend(monkeypatch):
+    monkeypatch.setenv("DOWNLOAD_BACKEND", "async")
+    assert Settings().DOWNLOAD_BACKEND == "async"
+
+    monkeypatch.setenv("RANGED_DOWNLOAD_SEGMENTS", "8")
+    with pytest.raises(ValidationError, match="RANGED_DOWNLOAD_"):
+        Settings()
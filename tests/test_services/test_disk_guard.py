@@ -0,0 +1,33 @@
+from collections import namedtuple
+
+from app.services.disk_guard import DiskGuard
+
+Usage = namedtuple("Usage", "total used free")
+
+
+def test_admission_counts_space_reserved_by_others(fake_redis, mocker, tmp_path):
+    mocker.patch("app.services.disk_guard.settings.DISK_FREE_WATERMARK", 100)
+    mocker.patch(
+        "app.services.disk_guard.shutil.disk_usage", return_value=Usage(0, 0, 1000)
+    )
+    guard = DiskGuard(fake_redis, tmp_path)
+
+    assert guard.has_room()
+    assert guard.admit("a", 600)
+    # 1000 free - 600 promised to a leaves less than 400 + watermark
+    assert not guard.admit("b", 400)
+    # Re-admitting a request replaces its own reservation
+    assert guard.admit("a", 800)
+
+    guard.release("a")
+    assert guard.admit("b", 400)
+
+
+def test_low_free_space_has_no_room(fake_redis, mocker, tmp_path):
+    mocker.patch("app.services.disk_guard.settings.DISK_FREE_WATERMARK", 100)
+    mocker.patch(
+        "app.services.disk_guard.shutil.disk_usage", return_value=Usage(0, 0, 50)
+    )
+
+    assert not DiskGuard(fake_redis, tmp_path).has_room()
+    assert DiskGuard.footprint(10, 0) == 20
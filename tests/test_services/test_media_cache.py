@@ -0,0 +1,58 @@
+import os
+import pytest
+from app.services.media_cache import MediaCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return MediaCache(cache_dir=tmp_path / "cache", max_bytes=10)
+
+
+def store(cache, key, data, ext=".mp4"):
+    cache.partial_path(key).write_bytes(data)
+    return cache.commit(key, ext)
+
+
+def test_commit_and_get(cache):
+    entry = store(cache, "abc", b"12345")
+
+    assert cache.get("abc", ".mp4") == entry
+    assert entry.read_bytes() == b"12345"
+    assert not cache.partial_path("abc").exists()
+    assert cache.get("missing", ".mp4") is None
+
+
+def test_evicts_least_recently_used(cache):
+    old = store(cache, "old", b"123456")
+    os.utime(old, (1, 1))
+    new = store(cache, "new", b"123456")
+
+    assert not old.exists()
+    assert new.exists()
+
+
+def test_evict_skips_locked_entries(cache):
+    locked = store(cache, "locked", b"123456")
+    os.utime(locked, (1, 1))
+
+    with cache.lock("locked"):
+        store(cache, "other", b"123456")
+
+    assert locked.exists()
+
+
+def test_link_shares_entry(cache, tmp_path):
+    entry = store(cache, "abc", b"12345")
+    dest = cache.link(entry, tmp_path / "task.mp4")
+
+    assert dest.stat().st_ino == entry.stat().st_ino
+
+
+def test_eviction_removes_metadata(cache):
+    old = store(cache, "old", b"123456")
+    cache.write_metadata("old", {"duration": 1.0})
+    os.utime(old, (1, 1))
+    store(cache, "new", b"123456")
+
+    assert not old.exists()
+    assert cache.read_metadata("old") is None
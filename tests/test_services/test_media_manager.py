@@ -1,18 +1,25 @@
+import httpx
 import pytest
 from app.services.media_manager import MediaManager
 
 
-def test_download_file_success(mocker):
-    mm = MediaManager("test_task")
-
+def make_client(mocker, chunks):
     mock_client = mocker.MagicMock()
+    mock_client.head.return_value.headers = {"ETag": '"v1"'}
 
     mock_response = mocker.MagicMock()
     mock_response.status_code = 200
     mock_response.headers = {"Content-Type": "video/mp4"}
-    mock_response.iter_bytes.return_value = [b"video_chunk_1", b"video_chunk_2"]
+    mock_response.iter_bytes.return_value = chunks
 
     mock_client.stream.return_value.__enter__.return_value = mock_response
+    return mock_client
+
+
+def test_download_file_success(mocker):
+    mm = MediaManager("test_task")
+
+    mock_client = make_client(mocker, [b"video_chunk_1", b"video_chunk_2"])
 
     url = "https://example.com/video.mp4"
     _, local_path, size = mm.download_file(url, mm.video_dir, "video/mp4", mock_client)
@@ -21,3 +28,160 @@ def test_download_file_success(mocker):
     assert local_path.suffix == ".mp4"
     assert size > 0
     mock_client.stream.assert_called_once_with("GET", url, follow_redirects=True)
+
+
+def test_download_file_reuses_cache_across_tasks(mocker):
+    url = "https://example.com/video.mp4"
+    first_client = make_client(mocker, [b"video_data"])
+    second_client = make_client(mocker, [b"video_data"])
+
+    first = MediaManager("task_a")
+    _, first_path, _ = first.download_file(
+        url, first.video_dir, "video/mp4", first_client
+    )
+
+    second = MediaManager("task_b")
+    _, second_path, size = second.download_file(
+        url, second.video_dir, "video/mp4", second_client
+    )
+
+    second_client.stream.assert_not_called()
+    assert second_path.read_bytes() == b"video_data"
+    assert second_path.stat().st_ino == first_path.stat().st_ino
+    assert size == len(b"video_data")
+
+
+def test_download_file_wrong_mime(mocker):
+    mm = MediaManager("test_mime")
+    mock_client = make_client(mocker, [b"data"])
+    mock_client.stream.return_value.__enter__.return_value.headers = {
+        "Content-Type": "text/html"
+    }
+
+    with pytest.raises(ValueError, match="Expected mime type"):
+        mm.download_file(
+            "https://example.com/a.mp4", mm.video_dir, "video/mp4", mock_client
+        )
+
+    assert not list(mm.cache.cache_dir.glob("*.mp4"))
+    assert not list(mm.cache.cache_dir.glob("*.part"))
+
+
+def make_ranged_client(body, requests, fail_ranges=(), etag='"v1"'):
+    def handler(request):
+        headers = {"Content-Type": "video/mp4", "Accept-Ranges": "bytes"}
+        if etag:
+            headers["ETag"] = etag
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return httpx.Response(200, headers=headers)
+
+        range_header = request.headers["Range"]
+        requests.append(range_header)
+        if range_header in fail_ranges:
+            return httpx.Response(503, headers=headers)
+
+        start, end = map(int, range_header.removeprefix("bytes=").split("-"))
+        return httpx.Response(206, headers=headers, content=body[start : end + 1])
+
+    return httpx.Client(transport=httpx.MockTransport(handler))
+
+
+def test_download_file_ranged(mocker):
+    mocker.patch("app.services.media_manager.settings.RANGED_DOWNLOAD_MIN_SIZE", 10)
+    mocker.patch("app.services.media_manager.settings.RANGED_DOWNLOAD_SEGMENTS", 4)
+    body = bytes(range(100))
+    requests = []
+    mm = MediaManager("test_ranged")
+
+    _, local_path, size = mm.download_file(
+        "https://example.com/big.mp4",
+        mm.video_dir,
+        "video/mp4",
+        make_ranged_client(body, requests),
+    )
+
+    assert local_path.read_bytes() == body
+    assert size == 100
+    assert sorted(requests) == sorted(
+        ["bytes=0-24", "bytes=25-49", "bytes=50-74", "bytes=75-99"]
+    )
+
+
+def test_download_file_ranged_resumes(mocker):
+    mocker.patch("app.services.media_manager.settings.RANGED_DOWNLOAD_MIN_SIZE", 10)
+    mocker.patch("app.services.media_manager.settings.RANGED_DOWNLOAD_SEGMENTS", 4)
+    body = bytes(range(100))
+    url = "https://example.com/big.mp4"
+    mm = MediaManager("test_resume")
+
+    first_requests = []
+    with pytest.raises(httpx.HTTPStatusError):
+        mm.download_file(
+            url,
+            mm.video_dir,
+            "video/mp4",
+            make_ranged_client(body, first_requests, fail_ranges=("bytes=50-74",)),
+        )
+
+    assert list(mm.cache.cache_dir.glob("*.part.json"))
+
+    second_requests = []
+    _, local_path, _ = mm.download_file(
+        url, mm.video_dir, "video/mp4", make_ranged_client(body, second_requests)
+    )
+
+    assert second_requests == ["bytes=50-74"]
+    assert local_path.read_bytes() == body
+    assert not list(mm.cache.cache_dir.glob("*.part*"))
+
+
+def test_download_file_ranged_restarts_without_validators(mocker):
+    mocker.patch("app.services.media_manager.settings.RANGED_DOWNLOAD_MIN_SIZE", 10)
+    mocker.patch("app.services.media_manager.settings.RANGED_DOWNLOAD_SEGMENTS", 4)
+    url = "https://example.com/big.mp4"
+    mm = MediaManager("test_restart")
+
+    with pytest.raises(httpx.HTTPStatusError):
+        mm.download_file(
+            url,
+            mm.video_dir,
+            "video/mp4",
+            make_ranged_client(
+                bytes(range(100)), [], fail_ranges=("bytes=50-74",), etag=None
+            ),
+        )
+
+    # The origin now serves another file of the same size
+    body = bytes(reversed(range(100)))
+    requests = []
+    _, local_path, _ = mm.download_file(
+        url, mm.video_dir, "video/mp4", make_ranged_client(body, requests, etag=None)
+    )
+
+    assert len(requests) == 4
+    assert local_path.read_bytes() == body
+
+
+def test_admission_and_download_share_one_head(mocker):
+    methods = []
+
+    def handler(request):
+        methods.append(request.method)
+        headers = {"Content-Type": "video/mp4", "ETag": '"v1"'}
+        return httpx.Response(200, headers=headers, content=b"video_data")
+
+    client_class = httpx.Client
+    mocker.patch(
+        "app.services.media_manager.httpx.Client",
+        lambda: client_class(transport=httpx.MockTransport(handler)),
+    )
+    mm = MediaManager("test_one_head")
+    blocks = {"block1": ["https://example.com/a.mp4", "https://example.com/b.mp4"]}
+
+    mm.download_size(blocks, {})
+    local_video, _ = mm.prepare_media(blocks, {})
+
+    assert methods.count("HEAD") == 2
+    assert methods.count("GET") == 2
+    assert local_video["block1"][0].read_bytes() == b"video_data"
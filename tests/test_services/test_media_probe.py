@@ -0,0 +1,65 @@
+import json
+import subprocess
+import pytest
+from pathlib import Path
+from app.services.media_probe import MediaProbe
+
+
+def ffprobe_output(duration="12.5", streams=None):
+    if streams is None:
+        streams = [
+            {
+                "codec_type": "video",
+                "codec_name": "h264",
+                "width": 1080,
+                "height": 1920,
+                "avg_frame_rate": "30000/1001",
+                "pix_fmt": "yuv420p",
+                "sample_aspect_ratio": "1:1",
+            },
+            {"codec_type": "audio", "codec_name": "aac", "sample_rate": "44100"},
+        ]
+    return json.dumps({"format": {"duration": duration}, "streams": streams})
+
+
+def test_probe_records_metadata_once(mocker):
+    mock_run = mocker.patch(
+        "subprocess.run",
+        return_value=mocker.Mock(stdout=ffprobe_output()),
+    )
+    probe = MediaProbe()
+
+    record = probe.probe(Path("clip.mp4"), "video")
+    again = MediaProbe().probe(Path("clip.mp4"), "video")
+
+    assert mock_run.call_count == 1
+    assert record == again
+    assert record["duration"] == 12.5
+    assert record["video"]["width"] == 1080
+    assert round(record["video"]["fps"], 2) == 29.97
+    assert probe.cache.read_metadata("clip") == record
+
+
+def test_probe_rejects_corrupt_files(mocker):
+    mocker.patch(
+        "subprocess.run",
+        side_effect=subprocess.CalledProcessError(
+            1, "ffprobe", stderr="moov atom not found"
+        ),
+    )
+
+    with pytest.raises(ValueError, match="not a valid media file"):
+        MediaProbe().probe(Path("broken.mp4"), "video")
+
+    assert MediaProbe().cache.read_metadata("broken") is None
+
+
+def test_probe_rejects_missing_stream(mocker):
+    audio_only = [{"codec_type": "audio", "codec_name": "mp3", "sample_rate": "44100"}]
+    mocker.patch(
+        "subprocess.run",
+        return_value=mocker.Mock(stdout=ffprobe_output(streams=audio_only)),
+    )
+
+    with pytest.raises(ValueError, match="no video stream"):
+        MediaProbe().probe(Path("song.mp4"), "video")
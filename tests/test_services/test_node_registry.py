@@ -0,0 +1,146 @@
+import socket
+
+from app.core.celery_app import celery_app, on_worker_ready
+from app.services.media_cache import MediaCache
+from app.services.node_registry import NodeRegistry
+from app.services.peer_cache import PeerCache, serve_cache
+from app.services.tts import TTS
+from app.tasks import localize_inputs
+
+ENTRY = "a" * 64 + ".mp4"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+
+def test_best_node_holds_most_inputs(fake_redis):
+    a = NodeRegistry(fake_redis, "a")
+    b = NodeRegistry(fake_redis, "b")
+    a.heartbeat(2)
+    b.heartbeat(2)
+    a.advertise("x.mp4")
+    b.advertise("x.mp4")
+    b.advertise("y.mp4")
+
+    assert b.best_node(["x.mp4", "y.mp4"]) == "b"
+    assert NodeRegistry.queue("a") == "heavy.a"
+
+    # Nodes whose heartbeat expired aren't routed to
+    fake_redis.delete(NodeRegistry.alive_key("b"))
+    assert a.best_node(["x.mp4", "y.mp4"]) == "a"
+
+    # Nor are nodes without a heavy worker, whatever they hold
+    fake_redis.delete(NodeRegistry.slots_key("a"))
+    assert a.best_node(["x.mp4"]) is None
+
+
+def test_best_node_weighs_inputs_against_load(fake_redis):
+    a = NodeRegistry(fake_redis, "a")
+    b = NodeRegistry(fake_redis, "b")
+    c = NodeRegistry(fake_redis, "c")
+    for node in (a, b, c):
+        node.heartbeat(2)
+    b.advertise("x.mp4")
+    fake_redis.rpush("heavy.a", "render")
+
+    # Nothing is held anywhere, the least loaded node gets the render
+    assert a.best_node(["z.mp4"]) in ("b", "c")
+    assert a.best_node(["x.mp4"]) == "b"
+
+    # A node with a full round of renders queued loses its inputs' advantage
+    fake_redis.rpush("heavy.b", "render", "render")
+    # Renders queued at a lower priority wait in a list of their own
+    sep = celery_app.conf.broker_transport_options["sep"]
+    fake_redis.rpush(f"heavy.b{sep}9", "render")
+    assert a.best_node(["x.mp4"]) == "c"
+    assert a.stats()["b"]["backlog"] == 3
+
+    fake_redis.rpush(f"heavy.c{sep}3", *["render"] * 4)
+    fake_redis.rpush("heavy.a", "render")
+    assert a.best_node(["x.mp4"]) == "a"
+
+
+def test_entries_are_fetched_from_peers(fake_redis, mocker, tmp_path):
+    port = free_port()
+    mocker.patch("app.services.peer_cache.settings.MEDIA_CACHE_DIR", tmp_path / "a")
+    mocker.patch(
+        "app.services.node_registry.settings.NODE_URL", f"http://127.0.0.1:{port}"
+    )
+    holder = NodeRegistry(fake_redis, "a")
+    holder.heartbeat()
+    holder.advertise(ENTRY)
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / ENTRY).write_bytes(b"12345")
+    server = serve_cache(port)
+
+    mocker.patch("app.services.node_registry.settings.NODE_URL", None)
+    peer_cache = PeerCache(
+        NodeRegistry(fake_redis, "b"), MediaCache(cache_dir=tmp_path / "b")
+    )
+    try:
+        local_path = peer_cache.ensure(tmp_path / "task" / ENTRY)
+        assert local_path.read_bytes() == b"12345"
+        peer_cache.ensure(tmp_path / "other" / ENTRY)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # The second task directory links the entry the first fetch stored
+    assert holder.stats()["a"]["entries"] == 1
+    assert fake_redis.hgetall(NodeRegistry.stats_key("b")) == {
+        "hits": "1",
+        "misses": "1",
+        "peer_bytes": "5",
+    }
+
+
+def test_voiceover_is_fetched_from_the_node_that_synthesized_it(
+    fake_redis, mocker, tmp_path
+):
+    port = free_port()
+    mocker.patch.multiple(
+        "app.core.config.settings",
+        MULTI_NODE=True,
+        NODE_ID="light-1",
+        NODE_URL=f"http://127.0.0.1:{port}",
+        NODE_PORT=port,
+        MEDIA_CACHE_DIR=tmp_path / "light-1",
+    )
+    servers = []
+    mocker.patch(
+        "app.core.celery_app.serve_cache",
+        side_effect=lambda: servers.append(serve_cache()) or servers[-1],
+    )
+    heartbeat = mocker.spy(NodeRegistry, "start_heartbeat")
+    mocker.patch.object(TTS, "voices", {"v": "voice-id"})
+    mocker.patch.object(
+        TTS, "_synthesize", lambda self, text, voice_id, path: path.write_bytes(b"vo")
+    )
+
+    # The orchestrator's light worker synthesizes the voiceover
+    worker = mocker.MagicMock()
+    worker.app.amqp.queues.consume_from = {"light": None}
+    on_worker_ready(worker)
+    voiceover = TTS("123").generate_voiceover("hello", "v")
+    voiceover.unlink()
+
+    # and a heavy worker of another node renders with it
+    mocker.patch.multiple(
+        "app.core.config.settings",
+        NODE_ID="render-1",
+        NODE_URL=None,
+        MEDIA_CACHE_DIR=tmp_path / "render-1",
+    )
+    try:
+        localize_inputs([{"task_id": "123", "origins": {str(voiceover): None}}])
+    finally:
+        heartbeat.spy_return.set()
+        servers[0].shutdown()
+        servers[0].server_close()
+
+    assert voiceover.read_bytes() == b"vo"
+    assert not fake_redis.exists(NodeRegistry.slots_key("light-1"))
+    assert fake_redis.hget(NodeRegistry.stats_key("render-1"), "peer_bytes") == "2"
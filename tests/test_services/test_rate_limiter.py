@@ -0,0 +1,41 @@
+from app.services.rate_limiter import TokenBucket
+
+
+def test_acquire_within_burst(mocker, fake_redis):
+    mock_sleep = mocker.patch("app.services.rate_limiter.time.sleep")
+    bucket = TokenBucket(fake_redis, "test", rate=1.0, capacity=3)
+
+    for _ in range(3):
+        bucket.acquire()
+
+    mock_sleep.assert_not_called()
+
+
+def test_acquire_waits_when_empty(mocker, fake_redis):
+    now = [1000.0]
+    mocker.patch("app.services.rate_limiter.time.time", side_effect=lambda: now[0])
+
+    def fake_sleep(seconds):
+        now[0] += seconds
+
+    mock_sleep = mocker.patch(
+        "app.services.rate_limiter.time.sleep", side_effect=fake_sleep
+    )
+    bucket = TokenBucket(fake_redis, "test", rate=2.0, capacity=1)
+
+    bucket.acquire()
+    bucket.acquire()
+
+    mock_sleep.assert_called_once_with(0.5)
+
+
+def test_pause_blocks_other_workers(mocker, fake_redis):
+    mock_sleep = mocker.patch("app.services.rate_limiter.time.sleep")
+    first = TokenBucket(fake_redis, "shared", rate=1.0, capacity=5)
+    second = TokenBucket(fake_redis, "shared", rate=1.0, capacity=5)
+
+    first.pause(2)
+    mocker.patch.object(fake_redis, "pttl", side_effect=[2000, -2])
+    second.acquire()
+
+    mock_sleep.assert_called_once_with(2.0)
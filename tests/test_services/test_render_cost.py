@@ -0,0 +1,53 @@
+import pytest
+from app.services.render_cost import RenderCostModel
+
+
+def clip(duration, width=1080, height=1920):
+    return {"duration": duration, "video": {"width": width, "height": height}}
+
+
+def test_units_scale_with_duration_and_pixels():
+    metadata = {
+        "short.mp4": clip(5),
+        "long.mp4": clip(10),
+        "small.mp4": clip(10, 540, 960),
+    }
+
+    short = RenderCostModel.units(["short.mp4"], metadata)
+    long = RenderCostModel.units(["long.mp4"], metadata)
+    small = RenderCostModel.units(["small.mp4"], metadata)
+
+    assert long == pytest.approx(2 * short)
+    assert short < small < long
+    assert RenderCostModel.units(["short.mp4", "long.mp4"], metadata) == (
+        pytest.approx(short + long)
+    )
+    assert (
+        RenderCostModel.units(
+            ["short.mp4"], metadata, [{"name": "s", "width": 540, "height": 960}]
+        )
+        > short
+    )
+
+
+def test_record_calibrates_seconds_per_unit(fake_redis):
+    model = RenderCostModel(fake_redis)
+    model.alpha = 0.5
+
+    model.record(10.0, 20.0)
+    assert model.seconds_per_unit == pytest.approx(2.0)
+
+    model.record(10.0, 40.0)
+    assert model.seconds_per_unit == pytest.approx(3.0)
+    assert model.estimate(4.0) == pytest.approx(12.0)
+    assert fake_redis.hget(RenderCostModel.KEY, "samples") == "2"
+
+
+def test_longer_renders_get_higher_priority(fake_redis):
+    model = RenderCostModel(fake_redis)
+
+    priorities = [model.priority(seconds) for seconds in (0, 5, 60, 600, 10**6)]
+
+    assert priorities == sorted(priorities, reverse=True)
+    assert priorities[0] == RenderCostModel.MAX_PRIORITY
+    assert priorities[-1] == 0
@@ -0,0 +1,77 @@
+import itertools
+
+from app.services.render_planner import (
+    audio_pair,
+    combination_at,
+    count_combinations,
+    input_refcounts,
+    required_inputs,
+    sample_combinations,
+)
+
+
+def test_audio_pairs_reuse_mixes():
+    pairs = {audio_pair(["m1", "m2"], ["vo1", "vo2", "vo3"], i) for i in range(7)}
+
+    assert pairs == {("m1", "vo1"), ("m2", "vo2"), ("m1", "vo3")}
+
+
+def test_combinations_are_decoded_in_product_order():
+    blocks = [
+        [f"b{b}_{o}.mp4" for o in range(size)] for b, size in enumerate([2, 3, 1, 2])
+    ]
+    combinations = list(itertools.product(*blocks))
+
+    assert count_combinations(blocks) == len(combinations)
+    assert [combination_at(blocks, i) for i in range(len(combinations))] == combinations
+
+
+def test_sample_covers_every_clip_evenly():
+    sizes = [5, 7, 3]
+    blocks = [[f"b{b}_{o}.mp4" for o in range(size)] for b, size in enumerate(sizes)]
+
+    sample = sample_combinations(sizes, 14, seed=7)
+
+    assert sample == sample_combinations(sizes, 14, seed=7)
+    assert len(set(sample)) == 14
+    for b, block in enumerate(blocks):
+        usage = [
+            sum(combination_at(blocks, i)[b] == clip for i in sample) for clip in block
+        ]
+        assert min(usage) >= 1
+        assert max(usage) - min(usage) <= 1
+
+
+def test_sample_larger_than_product_returns_everything():
+    assert sample_combinations([2, 2], 10, seed=1) == [0, 1, 2, 3]
+
+
+def test_required_inputs_of_a_sample():
+    spec = {
+        "blocks": [["a1", "a2", "a3"], ["b1", "b2", "b3"]],
+        "audio": ["m1", "m2"],
+        "voiceovers": ["tts:0", "tts:1", "tts:2"],
+        "indices": [0, 4],
+        "combinations": 2,
+    }
+
+    assert required_inputs(spec) == {
+        *["a1", "b1", "a2", "b2"],
+        *["m1", "m2", "tts:0", "tts:1"],
+    }
+
+
+def test_refcounts_cover_every_combination():
+    spec = {
+        "blocks": [["a1", "a2"], ["b1", "b2"], ["c1", "c2"]],
+        "audio": ["m1"],
+        "voiceovers": ["tts:0", "tts:1"],
+        "combinations": 8,
+    }
+
+    refs = input_refcounts(spec)
+
+    assert all(refs[clip] == 4 for block in spec["blocks"] for clip in block)
+    assert refs["m1"] == 8
+    assert refs["tts:0"] == refs["tts:1"] == 4
+    assert len(refs) == 6 + 3
@@ -0,0 +1,128 @@
+import pytest
+from app.services.render_scheduler import (
+    RenderScheduler,
+    heavy_slots,
+    register_heavy_worker,
+    unregister_heavy_worker,
+)
+
+
+@pytest.fixture
+def slots(mocker):
+    mocker.patch("app.services.render_scheduler.settings.HEAVY_WORKER_SLOTS", 4)
+    mocker.patch("app.services.render_scheduler.settings.MAX_RENDERS_PER_TASK", 3)
+
+
+def test_frontier_stays_bounded(fake_redis):
+    scheduler = RenderScheduler(fake_redis, "big")
+    scheduler.start(10_000, task_name="big", start_time=0)
+
+    assert scheduler.frontier(4) == [0, 1, 2, 3]
+    assert scheduler.claim(2)
+    assert scheduler.frontier(4) == [0, 1, 3, 4]
+    assert fake_redis.scard(scheduler.frontier_key) == 4
+
+
+def test_claim_respects_window(fake_redis, slots):
+    scheduler = RenderScheduler(fake_redis, "big")
+    scheduler.start(5, task_name="big", start_time=0)
+
+    frontier = scheduler.frontier(5)
+    claimed = [index for index in frontier if scheduler.claim(index)]
+
+    assert claimed == [0, 1, 2]
+    assert not scheduler.claim(0)
+
+    scheduler.release()
+    assert scheduler.frontier(5) == [3, 4]
+    assert scheduler.claim(4)
+
+
+def test_window_is_shared_between_requests(fake_redis, slots):
+    big = RenderScheduler(fake_redis, "big")
+    big.start(10, task_name="big", start_time=0)
+    assert big.window() == 3
+
+    # A request that is still downloading doesn't take a share yet
+    small = RenderScheduler(fake_redis, "small")
+    small.start(1, task_name="small", start_time=0)
+    assert big.window() == 3
+
+    big.frontier(3)
+    small.frontier(1)
+    assert big.claim(0)
+    assert small.window() == 2
+    assert small.claim(0)
+    assert big.window() == small.window() == 2
+
+    small.close()
+    assert big.window() == 3
+
+
+def test_slots_come_from_live_heavy_workers(fake_redis, slots, mocker):
+    time = mocker.patch("app.services.render_scheduler.time.time", return_value=0)
+    assert heavy_slots(fake_redis) == 4
+
+    register_heavy_worker(fake_redis, "heavy@a", 2)
+    register_heavy_worker(fake_redis, "heavy@b", 4)
+    assert heavy_slots(fake_redis) == 6
+
+    unregister_heavy_worker(fake_redis, "heavy@a")
+    assert heavy_slots(fake_redis) == 4
+    # A worker that stopped sending heartbeats no longer counts
+    time.return_value = 3600
+    register_heavy_worker(fake_redis, "heavy@a", 1)
+    assert heavy_slots(fake_redis) == 1
+
+
+def test_finish_and_report(fake_redis, mocker):
+    mocker.patch("app.services.render_scheduler.time.time", return_value=110.0)
+    scheduler = RenderScheduler(fake_redis, "task")
+    scheduler.start(2, task_name="task", start_time=0)
+
+    scheduler.record_wait(100.0)
+    scheduler.record_wait(108.0)
+
+    assert not scheduler.finish()
+    assert scheduler.finish()
+    assert scheduler.close() == {
+        "renders": 2,
+        "mean_wait": 6.0,
+        "max_wait": 10.0,
+        "missing": 0,
+    }
+    assert not fake_redis.exists(*scheduler.keys)
+
+
+def test_rejections_and_previews_are_tracked(fake_redis):
+    scheduler = RenderScheduler(fake_redis, "big")
+    scheduler.start(5, task_name="big", start_time=0)
+
+    assert scheduler.mark_previewed(1)
+    assert not scheduler.mark_previewed(1)
+
+    assert scheduler.rejected([0, 1]) == set()
+    scheduler.reject([1, 3])
+    assert scheduler.rejected([0, 1, 2, 3]) == {1, 3}
+
+    scheduler.close()
+    assert scheduler.rejected([1]) == set()
+
+
+def test_checkpoint_survives_until_every_combination_is_done(fake_redis):
+    scheduler = RenderScheduler(fake_redis, "task")
+    scheduler.checkpoint({"task_name": "task"}, 3)
+    scheduler.start(3, task_name="task", start_time=0)
+    scheduler.complete([0, 2])
+
+    assert scheduler.close()["missing"] == 1
+    assert scheduler.checkpoint_data == {"task_name": "task"}
+    assert scheduler.completed([0, 1, 2]) == {0, 2}
+    assert scheduler.claim_resume()
+    assert not scheduler.claim_resume()
+
+    scheduler.start(3, task_name="task", start_time=0)
+    scheduler.complete([1])
+    assert scheduler.close()["missing"] == 0
+    assert scheduler.checkpoint_data is None
+    assert not fake_redis.exists(scheduler.done_key)
@@ -0,0 +1,25 @@
+from app.services.request_registry import RequestRegistry
+
+
+def test_key_ignores_field_order():
+    first = {"task_name": "a", "seed": 1, "video_blocks": {"b1": ["x"], "b2": ["y"]}}
+    second = {"video_blocks": {"b2": ["y"], "b1": ["x"]}, "seed": 1, "task_name": "a"}
+
+    assert RequestRegistry.make_key(first) == RequestRegistry.make_key(second)
+    assert RequestRegistry.make_key(first) != RequestRegistry.make_key(
+        {**first, "seed": 2}
+    )
+
+
+def test_duplicates_get_the_running_task_id(fake_redis):
+    registry = RequestRegistry(fake_redis)
+
+    assert registry.register("request:k", "first") == "first"
+    assert registry.register("request:k", "second") == "first"
+    assert fake_redis.ttl("request:k") > 0
+
+    # Only the owner clears the record
+    registry.release("request:k", "second")
+    assert registry.register("request:k", "third") == "first"
+    registry.release("request:k", "first")
+    assert registry.register("request:k", "third") == "third"
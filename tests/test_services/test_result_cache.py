@@ -0,0 +1,38 @@
+from app.services.result_cache import ResultCache
+
+
+def params(**overrides):
+    return {
+        "video_lst": ["/tmp/v/a.mp4", "/tmp/v/b.mp4"],
+        "music": "/tmp/a/m.mp3",
+        "voiceover": "/tmp/tts/vo.mp3",
+        "audio_duration": 20.0,
+        **overrides,
+    }
+
+
+def test_key_depends_on_inputs_and_settings():
+    key = ResultCache.make_key(params(), "profile")
+
+    # Same files in another task's folders are the same inputs
+    assert key == ResultCache.make_key(
+        params(video_lst=["/other/a.mp4", "/other/b.mp4"]), "profile"
+    )
+    assert key != ResultCache.make_key(params(video_lst=["/tmp/v/c.mp4"]), "profile")
+    assert key != ResultCache.make_key(params(audio_duration=25.0), "profile")
+    assert key != ResultCache.make_key(params(), "crf=23")
+
+
+def test_lookup_and_stats(fake_redis):
+    cache = ResultCache(fake_redis)
+    cache.store("a", "result_cache/a.mp4")
+
+    assert cache.lookup(["a", "b"]) == ["result_cache/a.mp4", None]
+    assert fake_redis.ttl(ResultCache.entry_key("a")) == 30 * 24 * 3600
+
+    cache.count(hits=3)
+    cache.count(misses=1)
+    assert cache.stats() == {"hits": 3, "misses": 1, "hit_rate": 0.75}
+
+    cache.forget("a")
+    assert cache.lookup(["a"]) == [None]
@@ -1,14 +1,13 @@
+import io
+import os
+import threading
+
 import pytest
 from pathlib import Path
+from google.cloud import storage
 from app.services.storage_service import StorageService
 
 
-@pytest.fixture(autouse=True)
-def reset_storage_state():
-    StorageService._client = None
-    yield
-
-
 def test_upload_file_success(mocker, tmp_path):
     local_file = tmp_path / "video.mp4"
     local_file.write_text("fake video data")
@@ -45,3 +44,122 @@ def test_upload_file_error(mocker, tmp_path):
         service.upload_file(local_file, "remote.mp4")
 
     assert local_file.exists()
+
+
+def test_client_session_uses_scoped_credentials(mocker):
+    mocker.patch("app.services.storage_service.settings.GCS_EMULATOR_HOST", None)
+    from_info = mocker.patch(
+        "app.services.storage_service.service_account.Credentials"
+        ".from_service_account_info"
+    )
+    session = mocker.patch("app.services.storage_service.AuthorizedSession")
+    client = mocker.patch("app.services.storage_service.storage.Client")
+
+    StorageService().client
+
+    assert from_info.call_args.kwargs["scopes"] == client.SCOPE
+    session.assert_called_once_with(from_info.return_value)
+
+
+def test_upload_stream_in_chunks(fake_gcs):
+    data = bytes(range(256)) * 4096
+    read_fd, write_fd = os.pipe()
+
+    def produce():
+        with os.fdopen(write_fd, "wb") as pipe:
+            pipe.write(data)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    with os.fdopen(read_fd, "rb") as stream:
+        result = StorageService().upload_stream(stream, "task/video_0.mp4")
+    producer.join()
+
+    assert result == "task/video_0.mp4"
+    assert fake_gcs.objects[("fake_bucket", "task/video_0.mp4")] == data
+    chunk_puts = [r for r in fake_gcs.requests if r[0] == "PUT"]
+    assert len(chunk_puts) >= len(data) // (256 * 1024)
+
+
+def test_move_and_delete(fake_gcs):
+    service = StorageService()
+    service.upload_stream(io.BytesIO(b"video"), "task/video_0.mp4.partial")
+
+    service.move("task/video_0.mp4.partial", "task/video_0.mp4")
+    service.delete("task/missing.mp4")
+
+    assert list(fake_gcs.objects) == [("fake_bucket", "task/video_0.mp4")]
+    assert service.exists("task/video_0.mp4")
+    assert not service.exists("task/video_0.mp4.partial")
+
+
+def test_upload_file_skips_identical_object(fake_gcs, tmp_path):
+    service = StorageService()
+    first = tmp_path / "first.mp4"
+    first.write_bytes(b"same video")
+    service.upload_file(first, "task/video_0.mp4")
+
+    second = tmp_path / "second.mp4"
+    second.write_bytes(b"same video")
+    fake_gcs.requests.clear()
+    service.upload_file(second, "task/video_0.mp4")
+
+    assert not [r for r in fake_gcs.requests if r[1].startswith("/upload")]
+    assert not second.exists()
+
+
+def test_upload_file_never_trusts_an_object_without_its_file(fake_gcs, tmp_path):
+    service = StorageService()
+    local_file = tmp_path / "video.mp4"
+    local_file.write_bytes(b"video")
+    service.upload_file(local_file, "task/video_0.mp4")
+
+    # A lost output must not pass for an object left by an earlier run
+    with pytest.raises(FileNotFoundError):
+        service.upload_file(local_file, "task/video_0.mp4")
+
+
+def test_upload_file_composite(mocker, fake_gcs, tmp_path):
+    mocker.patch("app.services.storage_service.settings.GCS_COMPOSITE_THRESHOLD", 100)
+    mocker.patch("app.services.storage_service.settings.GCS_COMPOSITE_PARTS", 4)
+    data = os.urandom(1000)
+    local_file = tmp_path / "big.mp4"
+    local_file.write_bytes(data)
+
+    StorageService().upload_file(local_file, "task/video_0.mp4")
+
+    assert fake_gcs.objects == {("fake_bucket", "task/video_0.mp4"): data}
+    assert any(r[1].endswith("/compose") for r in fake_gcs.requests)
+
+
+def test_failed_composite_upload_deletes_its_parts(mocker, fake_gcs, tmp_path):
+    mocker.patch("app.services.storage_service.settings.GCS_COMPOSITE_THRESHOLD", 100)
+    mocker.patch("app.services.storage_service.settings.GCS_COMPOSITE_PARTS", 4)
+    local_file = tmp_path / "big.mp4"
+    local_file.write_bytes(os.urandom(1000))
+    upload_from_file = storage.Blob.upload_from_file
+
+    def flaky_upload(blob, f, **kwargs):
+        if blob.name.endswith(".parts/2"):
+            raise ConnectionError("connection reset")
+        return upload_from_file(blob, f, **kwargs)
+
+    mocker.patch.object(storage.Blob, "upload_from_file", flaky_upload)
+    with pytest.raises(ConnectionError):
+        StorageService().upload_file(local_file, "task/video_0.mp4")
+
+    assert fake_gcs.objects == {}
+    assert local_file.exists()
+
+
+def test_upload_many(fake_gcs, tmp_path):
+    files = []
+    for i in range(5):
+        local_file = tmp_path / f"video_{i}.mp4"
+        local_file.write_bytes(f"video {i}".encode())
+        files.append((local_file, f"task/video_{i}.mp4"))
+
+    result = StorageService().upload_many(files)
+
+    assert result == [remote for _, remote in files]
+    assert len(fake_gcs.objects) == 5
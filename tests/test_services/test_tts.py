@@ -1,15 +1,35 @@
 import pytest
-import hashlib
+from pathlib import Path
+from elevenlabs.core.api_error import ApiError
+from app.services.media_cache import MediaCache
 from app.services.tts import TTS
+from app.core.config import settings
 
 
 @pytest.fixture(autouse=True)
 def reset_tts_state():
     TTS.voices = {}
+    TTS.voices_version = None
     TTS._client = None
     yield
 
 
+def mock_voices(mocker, *names):
+    mock_el = mocker.patch("app.services.tts.ElevenLabs")
+    voices = []
+    for name in names:
+        voice = mocker.MagicMock()
+        voice.name = name
+        voice.voice_id = f"{name.lower()}_id"
+        voices.append(voice)
+    mock_el.return_value.voices.get_all.return_value.voices = voices
+    return mock_el.return_value.voices.get_all
+
+
+def fake_save(audio, path):
+    Path(path).write_bytes(b"audio_data")
+
+
 def test_refresh_voice_map(mocker):
     mock_el = mocker.patch("app.services.tts.ElevenLabs")
 
@@ -30,15 +50,18 @@ def test_generate_voiceover_cache(mocker):
     TTS.voices = {"rachel": "rachel_id"}
     tts = TTS("test_cache")
 
-    v_hash = hashlib.md5(b"Hello|rachel_id").hexdigest()
-    fake_file = tts.tts_dir / f"{v_hash}.mp3"
+    key = MediaCache.make_key(
+        "tts", "Hello", "rachel_id", settings.TTS_MODEL_ID, settings.TTS_OUTPUT_FORMAT
+    )
+    fake_file = tts.cache.entry_path(key, ".mp3")
     fake_file.write_text("audio content")
 
     mock_convert = mocker.patch.object(tts.client.text_to_speech, "convert")
 
     path = tts.generate_voiceover("Hello", "rachel")
 
-    assert path == fake_file
+    assert path == tts.tts_dir / f"{key}.mp3"
+    assert path.read_text() == "audio content"
     mock_convert.assert_not_called()
 
 
@@ -49,10 +72,109 @@ def test_generate_voiceover_success(mocker):
     mock_convert = mocker.patch.object(
         tts.client.text_to_speech, "convert", return_value=b"audio_data"
     )
-    mock_save = mocker.patch("app.services.tts.save")
+    mock_save = mocker.patch("app.services.tts.save", side_effect=fake_save)
 
     path = tts.generate_voiceover("Hi", "adam")
 
     assert path.suffix == ".mp3"
     mock_convert.assert_called_once()
     mock_save.assert_called_once()
+
+
+def test_generate_voiceover_shared_between_tasks(mocker):
+    TTS.voices = {"adam": "adam_id"}
+    first = TTS("task_a")
+    second = TTS("task_b")
+
+    mock_convert = mocker.patch.object(
+        first.client.text_to_speech, "convert", return_value=b"audio_data"
+    )
+    mocker.patch("app.services.tts.save", side_effect=fake_save)
+
+    first_path = first.generate_voiceover("Hi", "adam")
+    second_path = second.generate_voiceover("Hi", "adam")
+
+    assert first_path != second_path
+    assert second_path.read_bytes() == b"audio_data"
+    mock_convert.assert_called_once()
+
+
+def test_generate_voiceover_retries_after_rate_limit(mocker):
+    TTS.voices = {"adam": "adam_id"}
+    tts = TTS("test_429")
+
+    mock_convert = mocker.patch.object(
+        tts.client.text_to_speech,
+        "convert",
+        side_effect=[
+            ApiError(status_code=429, headers={"Retry-After": "3"}),
+            b"audio_data",
+        ],
+    )
+    mocker.patch("app.services.tts.save", side_effect=fake_save)
+    mock_pause = mocker.patch.object(tts.bucket, "pause")
+    mocker.patch.object(tts.bucket, "acquire")
+
+    path = tts.generate_voiceover("Hi", "adam")
+
+    assert path.exists()
+    assert mock_convert.call_count == 2
+    mock_pause.assert_called_once_with(3.0)
+
+
+def test_voice_map_shared_through_redis(mocker):
+    get_all = mock_voices(mocker, "Adam")
+    TTS("worker_a")._refresh_voice_map()
+
+    # A fresh worker process starts with an empty local copy
+    TTS.voices = {}
+    TTS.voices_version = None
+    TTS("worker_b")._refresh_voice_map()
+
+    assert TTS.voices == {"adam": "adam_id"}
+    get_all.assert_called_once()
+
+
+def test_voice_map_reloaded_when_version_changes(mocker, fake_redis):
+    mock_voices(mocker, "Adam")
+    tts = TTS("test_version")
+    tts._refresh_voice_map()
+
+    fake_redis.hset("tts:voices", "bella", "bella_id")
+    fake_redis.set("tts:voices:version", "1", ex=3600)
+    tts._refresh_voice_map()
+
+    assert TTS.voices["bella"] == "bella_id"
+    assert TTS.voices_version == "1"
+
+
+def test_voice_map_refreshed_in_background_before_expiry(mocker, fake_redis):
+    get_all = mock_voices(mocker, "Adam")
+    tts = TTS("test_background")
+    tts._refresh_voice_map()
+    fake_redis.expire("tts:voices:version", 10)
+
+    mock_thread = mocker.patch("app.services.tts.threading.Thread")
+    mock_thread.return_value.start.side_effect = lambda: tts._refresh_in_background(
+        *mock_thread.call_args.kwargs["args"]
+    )
+    tts._refresh_voice_map()
+
+    assert get_all.call_count == 2
+    assert fake_redis.ttl("tts:voices:version") > 10
+
+
+def test_unknown_voice_forces_refresh(mocker, fake_redis):
+    get_all = mock_voices(mocker, "Adam")
+    tts = TTS("test_force")
+    tts._refresh_voice_map()
+    fake_redis.set("tts:voices:version", "1", ex=3600)
+
+    mocker.patch.object(tts, "generate_voiceover", return_value=Path("vo.mp3"))
+    get_all.return_value.voices[0].name = "Bella"
+    get_all.return_value.voices[0].voice_id = "bella_id"
+
+    tts.prepare_voiceovers([{"text": "Hi", "voice": "bella"}])
+
+    assert TTS.voices["bella"] == "bella_id"
+    assert get_all.call_count == 2
@@ -1,3 +1,4 @@
+import os
 import pytest
 import subprocess
 from pathlib import Path
@@ -7,35 +8,39 @@ from app.services.video_processor import VideoProcessor
 def test_render_command_construction(mocker):
     vp = VideoProcessor("test_render")
 
-    mock_run = mocker.patch("subprocess.run")
+    concat_lists = []
+
+    def fake_run(command, **kwargs):
+        concat_path = Path(command[command.index("concat") + 4])
+        concat_lists.append(concat_path.read_text())
+
+    mock_run = mocker.patch("subprocess.run", side_effect=fake_run)
 
     video_list = [Path("v1.mp4"), Path("v2.mp4")]
-    music = Path("music.mp3")
-    voiceover = Path("vo.mp3")
+    audio = Path("mix.m4a")
     index = 0
     total_videos = 10
 
-    vp.render(video_list, music, voiceover, index, total_videos)
+    vp.render(video_list, audio, index, total_videos)
 
     args, kwargs = mock_run.call_args
     command = args[0]
 
     assert command[0] == "ffmpeg"
-    assert "-filter_complex" in command
     assert "-shortest" in command
+    assert command[command.index("-c") + 1] == "copy"
     assert str(vp.output_dir.joinpath("result_1.mp4")) in command
 
     for video in video_list:
-        assert str(video) in command
-    assert str(music) in command
-    assert str(voiceover) in command
+        assert str(video.resolve()) in concat_lists[0]
+    assert str(audio) in command
 
 
 def test_render_success_return_path(mocker):
     vp = VideoProcessor("test_path")
     mocker.patch("subprocess.run")
 
-    result_path = vp.render([Path("v.mp4")], Path("m.mp3"), Path("vo.mp3"), 5, 10)
+    result_path = vp.render([Path("v.mp4")], Path("mix.m4a"), 5, 10)
 
     assert result_path.name == "result_6.mp4"
     assert isinstance(result_path, Path)
@@ -50,4 +55,215 @@ def test_render_error_handling(mocker):
     )
 
     with pytest.raises(subprocess.CalledProcessError):
-        vp.render([Path("v.mp4")], Path("m.mp3"), Path("vo.mp3"), 0, 10)
+        vp.render([Path("v.mp4")], Path("mix.m4a"), 0, 10)
+
+
+def test_normalize_transcodes_each_clip_once(mocker):
+    def fake_run(command, **kwargs):
+        Path(command[-1]).write_bytes(b"normalized")
+
+    mock_run = mocker.patch("subprocess.run", side_effect=fake_run)
+
+    first = VideoProcessor("task_a").normalize(Path("clip.mp4"))
+    second = VideoProcessor("task_b").normalize(Path("clip.mp4"))
+
+    assert mock_run.call_count == 1
+    assert first.read_bytes() == second.read_bytes() == b"normalized"
+    command = mock_run.call_args[0][0]
+    assert "-an" in command
+    assert command[command.index("-g") + 1] == str(VideoProcessor.GOP_SIZE)
+
+
+def test_normalize_skips_filters_for_matching_input(mocker):
+    vp = VideoProcessor("test_normalize_match")
+    vp.cache.write_metadata(
+        "ready",
+        {
+            "duration": 5.0,
+            "video": {
+                "width": vp.video_width,
+                "height": vp.video_height,
+                "fps": 30.0,
+                "pix_fmt": "yuv420p",
+                "sar": "1:1",
+            },
+        },
+    )
+    vp.cache.write_metadata(
+        "slow",
+        {
+            "duration": 5.0,
+            "video": {
+                "width": vp.video_width,
+                "height": vp.video_height,
+                "fps": 24.0,
+                "pix_fmt": "yuv420p",
+                "sar": "1:1",
+            },
+        },
+    )
+
+    assert vp.normalize_filter_args(Path("ready.mp4")) == []
+    assert vp.normalize_filter_args(Path("slow.mp4")) == ["-vf", "fps=30"]
+    assert "scale=" in vp.normalize_filter_args(Path("unknown.mp4"))[1]
+
+
+def test_normalize_error_leaves_no_cache_entry(mocker):
+    vp = VideoProcessor("test_normalize_fail")
+    mocker.patch(
+        "subprocess.run",
+        side_effect=subprocess.CalledProcessError(
+            returncode=1, cmd="ffmpeg", stderr="corrupt"
+        ),
+    )
+
+    with pytest.raises(subprocess.CalledProcessError):
+        vp.normalize(Path("broken.mp4"))
+
+    assert not list(vp.cache.cache_dir.glob("*.mp4"))
+
+
+def test_render_batch_opens_shared_mix_once(mocker):
+    vp = VideoProcessor("test_batch")
+    mock_run = mocker.patch("subprocess.run")
+
+    items = [
+        {"video_lst": [Path("v1.mp4")], "audio": Path("mix.m4a"), "index": i}
+        for i in range(3)
+    ]
+
+    result = vp.render_batch(items, 3)
+
+    command = mock_run.call_args[0][0]
+
+    assert [path.name for path in result] == [
+        "result_1.mp4",
+        "result_2.mp4",
+        "result_3.mp4",
+    ]
+    assert command.count(str(Path("mix.m4a"))) == 1
+    assert command.count("3:a") == 3
+    assert "-filter_complex" not in command
+    assert command.count("-shortest") == 3
+
+
+def test_render_batch_encodes_renditions_from_one_decode(mocker):
+    vp = VideoProcessor("test_renditions")
+    mock_run = mocker.patch("subprocess.run")
+
+    items = [
+        {"video_lst": [Path("v1.mp4")], "audio": Path("mix.m4a"), "index": i}
+        for i in range(2)
+    ]
+    renditions = [
+        {"name": "720p", "width": 720, "height": 1280},
+        {"name": "square", "width": 540, "height": 540},
+    ]
+
+    result = vp.render_batch(items, 2, renditions=renditions)
+
+    assert [path.name for path in result] == [
+        "result_1.mp4",
+        "result_1_720p.mp4",
+        "result_1_square.mp4",
+        "result_2.mp4",
+        "result_2_720p.mp4",
+        "result_2_square.mp4",
+    ]
+    command = mock_run.call_args[0][0]
+    graph = command[command.index("-filter_complex") + 1]
+    # Every concat is decoded once and split between its renditions
+    assert graph.count("split=2") == 2
+    assert "[s1_1]scale=540:540" in graph
+    assert command.count("libx264") == 4
+    assert command.count("-shortest") == 6
+
+
+def test_render_preview_scales_sources_before_encoding(mocker):
+    vp = VideoProcessor("test_preview")
+    mock_run = mocker.patch("subprocess.run")
+
+    result = vp.render_preview([Path("a.mov"), Path("b.mp4")], Path("mix.m4a"), 2)
+
+    assert result.name == "preview_3.mp4"
+    command = mock_run.call_args[0][0]
+    graph = command[command.index("-filter_complex") + 1]
+    assert graph.count("scale=360:640") == 2
+    assert "[v0][v1]concat=n=2:v=1:a=0[v]" in graph
+    assert command[command.index("-preset") + 1] == "ultrafast"
+    assert command[command.index("[v]") + 2] == "2:a"
+
+
+def test_mix_audio_once_per_pair(mocker):
+    def fake_run(command, **kwargs):
+        Path(command[-1]).write_bytes(b"mix")
+
+    mock_run = mocker.patch("subprocess.run", side_effect=fake_run)
+    vp = VideoProcessor("test_mix")
+
+    first = vp.mix_audio(Path("music.mp3"), Path("vo.mp3"), 30.0)
+    second = vp.mix_audio(Path("music.mp3"), Path("vo.mp3"), 30.0)
+    other = vp.mix_audio(Path("music.mp3"), Path("vo2.mp3"), 30.0)
+
+    assert first == second != other
+    assert mock_run.call_count == 2
+    command = mock_run.call_args[0][0]
+    assert command[command.index("-t") + 1] == "30.000"
+    assert (
+        "amix=inputs=2:duration=first" in command[command.index("-filter_complex") + 1]
+    )
+
+
+class FakeStreamingFFmpeg:
+    returncode = 0
+
+    def __init__(self, command, pass_fds, **kwargs):
+        self.command = command
+        for k, fd in enumerate(pass_fds):
+            os.write(fd, f"fragment_{k}".encode())
+
+    def communicate(self):
+        return "", ""
+
+
+def test_stream_batch_pipes_each_output(mocker):
+    vp = VideoProcessor("test_stream")
+    mock_popen = mocker.patch("subprocess.Popen", side_effect=FakeStreamingFFmpeg)
+
+    items = [
+        {"video_lst": [Path("v1.mp4")], "audio": Path("mix.m4a"), "index": i}
+        for i in range(2)
+    ]
+
+    result = vp.stream_batch(items, 2, lambda k, stream: stream.read())
+
+    assert result == [b"fragment_0", b"fragment_1"]
+    command = mock_popen.call_args[0][0]
+    assert command.count("frag_keyframe+empty_moov+default_base_moof") == 2
+    assert all(target.startswith("pipe:") for target in command if "pipe" in target)
+    assert not list(vp.output_dir.glob("*.mp4"))
+
+
+def test_stream_batch_error_handling(mocker):
+    vp = VideoProcessor("test_stream_fail")
+
+    class FailingFFmpeg(FakeStreamingFFmpeg):
+        returncode = 1
+
+    mocker.patch("subprocess.Popen", side_effect=FailingFFmpeg)
+    items = [{"video_lst": [Path("v1.mp4")], "audio": Path("mix.m4a"), "index": 0}]
+
+    with pytest.raises(subprocess.CalledProcessError):
+        vp.stream_batch(items, 1, lambda k, stream: stream.read())
+
+
+def test_stream_batch_without_ffmpeg_starts_no_sink(mocker):
+    vp = VideoProcessor("test_stream_missing")
+    mocker.patch("subprocess.Popen", side_effect=FileNotFoundError("ffmpeg"))
+    sink = mocker.Mock()
+    items = [{"video_lst": [Path("v1.mp4")], "audio": Path("mix.m4a"), "index": 0}]
+
+    with pytest.raises(FileNotFoundError):
+        vp.stream_batch(items, 1, sink)
+
+    sink.assert_not_called()
@@ -1,6 +1,38 @@
+import json
 import pytest
+import redis
 from pathlib import Path
-from app.tasks import render_task, upload_task, cleanup_task
+from app.tasks import (
+    render_task,
+    render_batch_task,
+    render_stream_task,
+    resolve_videos,
+    upload_task,
+    cleanup_task,
+    dispatch_renders,
+    orchestrator,
+    render_done,
+    render_slot,
+)
+from app import tasks
+from app.services.media_manager import MediaManager
+from app.services.node_registry import NodeRegistry
+from app.services.render_scheduler import RenderScheduler
+from app.services.request_registry import RequestRegistry
+from app.services.result_cache import ResultCache
+from app.services.storage_service import StorageService
+
+
+def render_params(index: int, total_videos: int) -> dict:
+    return {
+        "task_id": "123",
+        "video_lst": ["v1.mp4"],
+        "music": "m.mp3",
+        "voiceover": "vo.mp3",
+        "audio_duration": 30.0,
+        "index": index,
+        "total_videos": total_videos,
+    }
 
 
 def test_render_task_logic(mocker):
@@ -9,14 +41,7 @@ def test_render_task_logic(mocker):
     expected_path = Path("/tmp/result.mp4")
     mock_instance.render.return_value = expected_path
 
-    params = {
-        "task_id": "123",
-        "video_lst": ["v1.mp4"],
-        "music": "m.mp3",
-        "voiceover": "vo.mp3",
-        "index": 0,
-        "total_videos": 10,
-    }
+    params = render_params(0, 10)
 
     result = render_task(params)
     assert Path(result).as_posix() == expected_path.as_posix()
@@ -45,3 +70,561 @@ def test_cleanup_task(mocker, tmp_path):
 
     cleanup_task(None, "123", 0)
     assert not task_dir.exists()
+
+
+def test_render_batch_task_logic(mocker):
+    mock_vp = mocker.patch("app.tasks.VideoProcessor")
+    mock_instance = mock_vp.return_value
+    mock_instance.render_batch.return_value = [Path("/tmp/r1.mp4"), Path("/tmp/r2.mp4")]
+
+    batch = [render_params(i, 2) for i in range(2)]
+
+    result = render_batch_task(batch)
+
+    items, total_videos = mock_instance.render_batch.call_args[0]
+    assert [item["index"] for item in items] == [0, 1]
+    assert mock_instance.mix_audio.call_count == 2
+    assert total_videos == 2
+    assert [Path(path).name for path in result] == ["r1.mp4", "r2.mp4"]
+
+
+def test_resolve_videos_normalizes_every_clip(mocker):
+    mock_instance = mocker.MagicMock()
+    mock_instance.normalize.side_effect = lambda path: Path(f"n_{path.name}")
+
+    result = resolve_videos(mock_instance, {"video_lst": ["a.mp4", "b.mp4", "c.mp4"]})
+
+    assert result == [Path("n_a.mp4"), Path("n_b.mp4"), Path("n_c.mp4")]
+
+
+def test_render_stream_task_moves_staged_uploads(mocker):
+    mocker.patch("app.tasks.VideoProcessor")
+    mock_storage = mocker.patch("app.tasks.StorageService").return_value
+    mock_storage.move.side_effect = lambda source, target: target
+
+    batch = [render_params(3, 4)]
+
+    result = render_stream_task(batch, "test_task")
+
+    assert result == ["test_task/video_3.mp4"]
+    mock_storage.move.assert_called_once_with(
+        "test_task/video_3.mp4.partial", "test_task/video_3.mp4"
+    )
+
+
+def test_render_stream_task_discards_failed_uploads(mocker):
+    mock_vp = mocker.patch("app.tasks.VideoProcessor")
+    mock_vp.return_value.stream_batch.side_effect = RuntimeError("ffmpeg failed")
+    mock_storage = mocker.patch("app.tasks.StorageService").return_value
+
+    batch = [render_params(0, 1)]
+
+    with pytest.raises(RuntimeError):
+        render_stream_task(batch, "test_task")
+
+    mock_storage.delete.assert_called_once_with("test_task/video_0.mp4.partial")
+    mock_storage.move.assert_not_called()
+
+
+def mock_inputs(mocker, durations, corrupt=()):
+    mock_manager_cls = mocker.patch("app.tasks.MediaManager")
+    mock_manager_cls.order_blocks.side_effect = MediaManager.order_blocks
+
+    def prepare_media(video_blocks, audio_blocks, on_ready):
+        blocks = [*video_blocks.values(), *audio_blocks.values()]
+        for url in [url for block in blocks for url in block]:
+            on_ready(url, Path(url))
+
+    def prepare_voiceovers(items, on_ready):
+        for i in range(len(items)):
+            on_ready(i, Path(f"vo{i}.mp3"))
+
+    def probe(path, kind):
+        if path.name in corrupt:
+            raise ValueError(f"{path.name} is not a valid media file")
+        return {
+            "duration": durations.get(path.name, 30.0),
+            "video": {"width": 1080, "height": 1920},
+        }
+
+    mock_manager_cls.return_value.prepare_media.side_effect = prepare_media
+    mock_manager_cls.return_value.download_size.return_value = 0
+    mocker.patch("app.tasks.TTS").return_value.prepare_voiceovers.side_effect = (
+        prepare_voiceovers
+    )
+    mocker.patch("app.tasks.MediaProbe").return_value.probe.side_effect = probe
+    mocker.patch("app.tasks.normalize_task")
+    mocker.patch("app.tasks.upload_task")
+    mocker.patch("app.tasks.chain")
+    return mocker.patch("app.tasks.render_task")
+
+
+def request_data(video_blocks):
+    return {
+        "task_name": "test_task",
+        "video_blocks": video_blocks,
+        "audio_blocks": {"audio_1": ["m.mp3"]},
+        "text_to_speech": [{"text": "hi", "voice": "anna"}],
+    }
+
+
+def test_orchestrator_rejects_corrupt_media_before_dispatch(mocker, fake_redis):
+    mock_render = mock_inputs(mocker, {}, corrupt={"v1.mp4"})
+    mock_cleanup = mocker.patch("app.tasks.cleanup_task")
+    data = request_data({"block_1": ["v1.mp4"]})
+    RequestRegistry(fake_redis).register(RequestRegistry.make_key(data), "123")
+
+    result = orchestrator.apply(args=[data], task_id="123")
+
+    assert isinstance(result.result, ValueError)
+    mock_render.s.assert_not_called()
+    mock_cleanup.delay.assert_called_once()
+    # A resubmission after the failure starts a new orchestration
+    assert not fake_redis.exists(RequestRegistry.make_key(data))
+
+
+def test_orchestrator_dispatches_longest_renders_first(mocker):
+    mocker.patch("app.tasks.settings.RENDER_BATCH_SIZE", 1)
+    mock_render = mock_inputs(
+        mocker, {"short.mp4": 2.0, "long.mp4": 60.0, "end.mp4": 1.0}
+    )
+
+    data = request_data({"block_2": ["end.mp4"], "block_1": ["short.mp4", "long.mp4"]})
+    orchestrator.apply(args=[data], task_id="123").get()
+
+    dispatched = [call.args[0]["video_lst"] for call in mock_render.s.call_args_list]
+    assert dispatched == [["long.mp4", "end.mp4"], ["short.mp4", "end.mp4"]]
+    priorities = [
+        call.kwargs["priority"]
+        for call in mock_render.s.return_value.set.call_args_list
+    ]
+    assert priorities[0] <= priorities[1]
+    assert mock_render.s.call_args_list[0].args[0]["audio_duration"] == 65.0
+
+
+def test_normalization_is_prefetched_on_the_downloading_node(mocker, fake_redis):
+    mocker.patch.multiple("app.tasks.settings", MULTI_NODE=True, NODE_ID="n1")
+    mock_inputs(mocker, {})
+    NodeRegistry(fake_redis, "n1").heartbeat(2)
+
+    orchestrator.apply(args=[request_data({"block_1": ["v1.mp4"]})], task_id="123")
+    prefetch = tasks.normalize_task.s.return_value.set
+    assert prefetch.call_args.kwargs["queue"] == "heavy.n1"
+
+    # A node without a heavy worker leaves normalization to the render
+    fake_redis.delete(NodeRegistry.slots_key("n1"))
+    prefetch.reset_mock()
+    orchestrator.apply(args=[request_data({"block_1": ["v2.mp4"]})], task_id="456")
+    prefetch.assert_not_called()
+
+
+def test_identical_voiceovers_share_one_refcount(mocker, fake_redis):
+    mocker.patch("app.tasks.settings.RENDER_BATCH_SIZE", 1)
+    mock_render = mock_inputs(mocker, {})
+    line = {"text": "hi", "voice": "anna"}
+    data = request_data({"block_1": ["a.mp4", "b.mp4", "c.mp4"]})
+    data["text_to_speech"] = [line, {"text": "bye", "voice": "anna"}, line]
+
+    orchestrator.apply(args=[data], task_id="123").get()
+
+    # The repeated line is synthesized once and counts every render using it
+    prepare_voiceovers = tasks.TTS.return_value.prepare_voiceovers
+    assert prepare_voiceovers.call_args.args[0] == data["text_to_speech"][:2]
+    refs = fake_redis.hgetall(RenderScheduler(fake_redis, "123").refs_key)
+    assert (refs["tts:0"], refs["tts:1"]) == ("2", "1")
+    voiceovers = [call.args[0]["voiceover"] for call in mock_render.s.call_args_list]
+    assert voiceovers.count("vo0.mp3") == 2
+
+
+def test_orchestrator_renders_only_the_sampled_subset(mocker):
+    mocker.patch("app.tasks.settings.RENDER_BATCH_SIZE", 1)
+    mock_render = mock_inputs(mocker, {})
+    prepare_media = tasks.MediaManager.return_value.prepare_media
+
+    data = request_data(
+        {"block_1": ["a1.mp4", "a2.mp4"], "block_2": [f"b{i}.mp4" for i in range(4)]}
+    )
+    data.update(target_count=2, seed=3)
+    result = orchestrator.apply(args=[data], task_id="123").get()
+
+    assert result["total_combinations"] == 2
+    assert mock_render.s.call_count == 2
+    downloads = prepare_media.call_args.kwargs["video_blocks"]
+    assert len(downloads["block_1"]) == 2
+    assert len(downloads["block_2"]) == 2
+
+
+def start_request(fake_redis, blocks, ready, batch_size=1, **options):
+    scheduler = RenderScheduler(fake_redis, "123")
+    combinations = 1
+    for block in blocks:
+        combinations *= len(block)
+    spec = {
+        "blocks": blocks,
+        "audio": ["m.mp3"],
+        "voiceovers": ["tts:0"],
+        "batch_size": batch_size,
+        "combinations": combinations,
+        "profile": "profile",
+        **options,
+    }
+    scheduler.start(
+        -(-combinations // batch_size),
+        task_name="test_task",
+        start_time=5.0,
+        spec=json.dumps(spec),
+    )
+    for name in ready:
+        scheduler.set_ready(
+            name, name, {"duration": 10.0, "video": {"width": 1080, "height": 1920}}
+        )
+    return scheduler
+
+
+def test_finished_renders_refill_window_and_clean_up(mocker, fake_redis):
+    mocker.patch("app.tasks.settings.HEAVY_WORKER_SLOTS", 1)
+    mocker.patch("app.tasks.VideoProcessor")
+    mocker.patch("app.tasks.chain")
+    mock_render = mocker.patch("app.tasks.render_task")
+    mock_cleanup = mocker.patch("app.tasks.cleanup_task")
+
+    scheduler = start_request(
+        fake_redis, [["a.mp4", "b.mp4"]], ["a.mp4", "m.mp3", "tts:0"]
+    )
+
+    dispatch_renders("123")
+    assert mock_render.s.call_count == 1
+    assert mock_render.s.call_args[0][0]["video_lst"] == ["a.mp4"]
+
+    # The slot is free again but b.mp4 is still downloading
+    with render_slot([{"task_id": "123", "index": 0, "cost": 1.0}]):
+        pass
+    assert mock_render.s.call_count == 1
+
+    scheduler.set_ready(
+        "b.mp4", "b.mp4", {"duration": 1.0, "video": {"width": 1, "height": 1}}
+    )
+    dispatch_renders("123")
+    assert mock_render.s.call_count == 2
+
+    render_done(["a"], "123")
+    mock_cleanup.assert_not_called()
+    render_done(["b"], "123")
+    mock_cleanup.assert_called_once_with(None, "123", 5.0)
+
+
+def test_large_requests_dispatch_from_a_bounded_frontier(mocker, fake_redis):
+    mocker.patch("app.tasks.settings.HEAVY_WORKER_SLOTS", 4)
+    mocker.patch("app.tasks.chain")
+    mock_render = mocker.patch("app.tasks.render_batch_task")
+    blocks = [[f"b{b}_{o}.mp4" for o in range(10)] for b in range(4)]
+
+    scheduler = start_request(
+        fake_redis,
+        blocks,
+        [clip for block in blocks for clip in block] + ["m.mp3", "tts:0"],
+        batch_size=4,
+    )
+    dispatch_renders("123")
+
+    batches = [call.args[0] for call in mock_render.s.call_args_list]
+    assert len(batches) == 4
+    assert all(len(batch) == 4 for batch in batches)
+    assert fake_redis.scard(scheduler.frontier_key) <= 32
+    assert int(fake_redis.get(scheduler.cursor_key)) == 32
+
+
+def test_rendered_batches_are_served_from_the_result_cache(mocker, fake_redis):
+    mocker.patch("app.tasks.settings.HEAVY_WORKER_SLOTS", 1)
+    mocker.patch("app.tasks.chain")
+    mocker.patch("app.tasks.StorageService").return_value.exists.return_value = True
+    mock_render = mocker.patch("app.tasks.render_task")
+    mock_copy = mocker.patch("app.tasks.copy_results_task")
+
+    inputs = ["a.mp4", "b.mp4", "m.mp3", "tts:0"]
+    start_request(fake_redis, [["a.mp4", "b.mp4"]], inputs)
+    dispatch_renders("123")
+    rendered = mock_render.s.call_args[0][0]
+
+    result_cache = ResultCache(fake_redis)
+    result_cache.store(rendered["result_key"], "result_cache/x.mp4")
+    start_request(fake_redis, [["a.mp4", "b.mp4"]], inputs)
+    mock_render.reset_mock()
+    dispatch_renders("123")
+
+    batch, task_name, objects = mock_copy.s.call_args[0]
+    assert [params["index"] for params in batch] == [rendered["index"]]
+    assert objects == ["result_cache/x.mp4"]
+    assert mock_render.s.call_count == 1
+    assert result_cache.stats()["hits"] == 1
+
+
+def test_cache_entries_without_objects_are_rendered_again(mocker, fake_redis):
+    mocker.patch("app.tasks.settings.HEAVY_WORKER_SLOTS", 1)
+    mocker.patch("app.tasks.chain")
+    mocker.patch("app.tasks.StorageService").return_value.exists.return_value = False
+    mock_render = mocker.patch("app.tasks.render_task")
+    mock_copy = mocker.patch("app.tasks.copy_results_task")
+
+    inputs = ["a.mp4", "m.mp3", "tts:0"]
+    start_request(fake_redis, [["a.mp4"]], inputs)
+    dispatch_renders("123")
+    key = mock_render.s.call_args[0][0]["result_key"]
+
+    result_cache = ResultCache(fake_redis)
+    result_cache.store(key, ResultCache.object_path(key))
+    start_request(fake_redis, [["a.mp4"]], inputs)
+    mock_render.reset_mock()
+    dispatch_renders("123")
+
+    mock_copy.s.assert_not_called()
+    assert mock_render.s.call_count == 1
+    assert result_cache.lookup([key]) == [None]
+    assert result_cache.stats() == {"hits": 0, "misses": 2, "hit_rate": 0.0}
+
+
+def test_upload_task_stores_result_in_cache(mocker, fake_redis):
+    mock_storage = mocker.patch("app.tasks.StorageService").return_value
+    mock_storage.upload_file.return_value = "test_task/video_1.mp4"
+    mock_storage.copy.side_effect = lambda source, target: target
+
+    upload_task("missing.mp4", "test_task", 1, "key")
+
+    mock_storage.copy.assert_called_once_with(
+        "test_task/video_1.mp4", ResultCache.object_path("key")
+    )
+    assert ResultCache(fake_redis).lookup(["key"]) == [ResultCache.object_path("key")]
+
+
+def test_renditions_are_uploaded_and_served_under_their_suffix(mocker, fake_redis):
+    mock_storage = mocker.patch("app.tasks.StorageService").return_value
+    mock_storage.upload_many.side_effect = lambda files: [name for _, name in files]
+    mock_storage.copy.side_effect = lambda source, target: target
+    renditions = [{"name": "small", "width": 540, "height": 960}]
+
+    result = tasks.upload_batch_task(
+        ["r1.mp4", "r1_small.mp4", "r2.mp4", "r2_small.mp4"],
+        "test_task",
+        [0, 1],
+        ["k0", "k1"],
+        renditions,
+    )
+
+    assert result == [
+        "test_task/video_0.mp4",
+        "test_task/video_0_small.mp4",
+        "test_task/video_1.mp4",
+        "test_task/video_1_small.mp4",
+    ]
+    mock_storage.copy.assert_any_call(
+        "test_task/video_1_small.mp4", ResultCache.object_path("k1", "small")
+    )
+
+    mock_storage.copy.reset_mock()
+    batch = [{"index": 4, "result_key": "k1", "renditions": renditions}]
+    tasks.copy_results_task(batch, "other", [ResultCache.object_path("k1")])
+    assert [call.args for call in mock_storage.copy.call_args_list] == [
+        (ResultCache.object_path("k1"), "other/video_4.mp4"),
+        (ResultCache.object_path("k1", "small"), "other/video_4_small.mp4"),
+    ]
+
+
+def test_previews_go_first_and_rejected_renders_are_dropped(mocker, fake_redis):
+    mocker.patch("app.tasks.settings.HEAVY_WORKER_SLOTS", 1)
+    mocker.patch("app.tasks.chain")
+    mock_render = mocker.patch("app.tasks.render_task")
+    mock_preview = mocker.patch("app.tasks.preview_task")
+    mock_cleanup = mocker.patch("app.tasks.cleanup_task")
+
+    scheduler = start_request(
+        fake_redis,
+        [["a.mp4", "b.mp4", "c.mp4"]],
+        ["a.mp4", "b.mp4", "m.mp3", "tts:0"],
+        preview=True,
+    )
+    dispatch_renders("123")
+
+    # Every ready combination is previewed, only one holds the heavy slot
+    previewed = [call.args[0][0]["index"] for call in mock_preview.s.call_args_list]
+    assert sorted(previewed) == [0, 1]
+    assert mock_render.s.call_count == 1
+    assert mock_render.s.return_value.set.call_args.kwargs["priority"] == 9
+    rendering = mock_render.s.call_args[0][0]["index"]
+
+    waiting = 1 - rendering
+    scheduler.reject([waiting, 2])
+    with render_slot([{"task_id": "123", "index": rendering}]):
+        pass
+    assert mock_render.s.call_count == 1
+
+    scheduler.set_ready(
+        "c.mp4", "c.mp4", {"duration": 1.0, "video": {"width": 1, "height": 1}}
+    )
+    dispatch_renders("123")
+    assert mock_preview.s.call_count == 2
+    assert mock_render.s.call_count == 1
+
+    render_done(["a"], "123")
+    mock_cleanup.assert_called_once_with(None, "123", 5.0)
+
+
+def test_renders_and_their_uploads_go_to_one_node(mocker, fake_redis):
+    mocker.patch.multiple("app.tasks.settings", MULTI_NODE=True, HEAVY_WORKER_SLOTS=1)
+    mocker.patch("app.tasks.chain")
+    mock_render = mocker.patch("app.tasks.render_task")
+    mock_upload = mocker.patch("app.tasks.upload_task")
+    mock_preview = mocker.patch("app.tasks.preview_task")
+    for node in ("n1", "n2"):
+        NodeRegistry(fake_redis, node).heartbeat(1)
+    NodeRegistry(fake_redis, "n2").advertise("a.mp4")
+
+    start_request(fake_redis, [["a.mp4"]], ["a.mp4", "m.mp3", "tts:0"], preview=True)
+    dispatch_renders("123")
+
+    assert mock_preview.s.return_value.set.call_args.kwargs["queue"] == "preview.n2"
+    assert mock_render.s.return_value.set.call_args.kwargs["queue"] == "heavy.n2"
+    assert mock_upload.s.return_value.set.call_args.kwargs["queue"] == "light.n2"
+
+
+def test_cleanup_runs_on_every_node_of_the_task(mocker, fake_redis, tmp_path):
+    mocker.patch.multiple("app.tasks.settings", NODE_ID="n1", TEMP_DIR=tmp_path)
+    mock_remove = mocker.patch.object(tasks.remove_task_dir, "s")
+    scheduler = RenderScheduler(fake_redis, "123")
+    for node in ("n1", "n2", "n3"):
+        scheduler.join(node)
+    tmp_path.joinpath("task_123").mkdir()
+
+    cleanup_task(None, "123", 0)
+
+    assert not tmp_path.joinpath("task_123").exists()
+    queues = [
+        call.kwargs["queue"] for call in mock_remove.return_value.set.call_args_list
+    ]
+    assert sorted(queues) == ["light.n2", "light.n3"]
+    assert not scheduler.nodes
+
+
+def test_rejected_renders_are_skipped_when_picked_up(mocker, fake_redis):
+    mock_vp = mocker.patch("app.tasks.VideoProcessor").return_value
+    mock_vp.render_batch.return_value = [Path("/tmp/r2.mp4")]
+    mock_storage = mocker.patch("app.tasks.StorageService").return_value
+    mock_storage.upload_many.side_effect = lambda files: [name for _, name in files]
+    RenderScheduler(fake_redis, "123").reject([0])
+
+    batch = [render_params(i, 2) for i in range(2)]
+    result = render_batch_task(batch)
+
+    items = mock_vp.render_batch.call_args[0][0]
+    assert [item["index"] for item in items] == [1]
+    assert result == [None, str(Path("/tmp/r2.mp4"))]
+    assert tasks.upload_batch_task(result, "test_task", [0, 1]) == [
+        "test_task/video_1.mp4"
+    ]
+
+
+def test_resumed_request_renders_only_missing_combinations(mocker, fake_redis):
+    mocker.patch("app.tasks.settings.HEAVY_WORKER_SLOTS", 4)
+    mocker.patch("app.tasks.chain")
+    mock_render = mocker.patch("app.tasks.render_task")
+    inputs = ["a.mp4", "b.mp4", "c.mp4", "m.mp3", "tts:0"]
+
+    scheduler = start_request(fake_redis, [["a.mp4", "b.mp4", "c.mp4"]], inputs)
+    scheduler.checkpoint({"task_name": "test_task"}, 3)
+    dispatch_renders("123")
+    assert mock_render.s.call_count == 3
+
+    render_done(["a"], "123", [0])
+    tasks.render_failed(None, RuntimeError("upload failed"), None, "123", [1])
+    render_done(["c"], "123", [2])
+    assert scheduler.checkpoint_data == {"task_name": "test_task"}
+
+    mock_render.reset_mock()
+    start_request(fake_redis, [["a.mp4", "b.mp4", "c.mp4"]], inputs)
+    dispatch_renders("123")
+
+    assert [call.args[0]["index"] for call in mock_render.s.call_args_list] == [1]
+    render_done(["b"], "123", [1])
+    assert scheduler.checkpoint_data is None
+
+
+def test_batch_upload_is_retried_after_failing_partway(mocker, fake_gcs, tmp_path):
+    paths = [tmp_path / f"r{i}.mp4" for i in range(3)]
+    for path in paths:
+        path.write_bytes(path.name.encode())
+    upload_file = StorageService.upload_file
+    failures = [paths[1]]
+
+    def flaky_upload(self, local_path, *args):
+        if local_path in failures:
+            failures.remove(local_path)
+            raise ConnectionError("connection reset")
+        return upload_file(self, local_path, *args)
+
+    mocker.patch.object(StorageService, "upload_file", flaky_upload)
+    result = tasks.upload_batch_task.apply(
+        args=([str(path) for path in paths], "test_task", [0, 1, 2])
+    )
+
+    assert result.get() == [f"test_task/video_{i}.mp4" for i in range(3)]
+    assert not failures
+    # The retry found the files stored by the first attempt and skipped them
+    uploads = [r for r in fake_gcs.requests if r[1].startswith("/upload")]
+    assert len(uploads) == 3
+    assert fake_gcs.objects == {
+        ("fake_bucket", f"test_task/video_{i}.mp4"): path.name.encode()
+        for i, path in enumerate(paths)
+    }
+    assert not any(path.exists() for path in paths)
+
+
+def test_unreferenced_inputs_are_deleted(mocker, fake_redis, tmp_path):
+    mocker.patch("app.tasks.settings.HEAVY_WORKER_SLOTS", 4)
+    mocker.patch("app.tasks.chain")
+    mock_render = mocker.patch("app.tasks.render_task")
+    files = {name: tmp_path / name for name in ["a.mp4", "b.mp4", "m.mp3", "vo.mp3"]}
+    for path in files.values():
+        path.touch()
+
+    scheduler = start_request(fake_redis, [["a.mp4", "b.mp4"]], [])
+    for name, path in [*files.items(), ("tts:0", files["vo.mp3"])]:
+        scheduler.set_ready(
+            name, str(path), {"duration": 1.0, "video": {"width": 1, "height": 1}}
+        )
+    scheduler.set_refs({"a.mp4": 1, "b.mp4": 1, "m.mp3": 2, "tts:0": 2})
+    dispatch_renders("123")
+    first, second = [call.args[0] for call in mock_render.s.call_args_list]
+
+    with render_slot([first]):
+        pass
+    assert not files["a.mp4"].exists()
+    assert files["b.mp4"].exists() and files["m.mp3"].exists()
+
+    with render_slot([second]):
+        pass
+    assert not any(path.exists() for path in files.values())
+
+
+def test_failed_dispatch_does_not_fail_the_render(mocker, fake_redis):
+    mocker.patch(
+        "app.tasks.dispatch_renders", side_effect=redis.ConnectionError("gone")
+    )
+    mock_dispatch = mocker.patch("app.tasks.dispatch_task")
+
+    with render_slot([{"task_id": "123", "index": 0}]) as kept:
+        assert kept
+
+    mock_dispatch.s.assert_called_once_with("123")
+
+
+def test_dispatch_waits_for_free_disk_space(mocker, fake_redis):
+    mocker.patch("app.tasks.DiskGuard").return_value.has_room.return_value = False
+    mocker.patch("app.tasks.chain")
+    mock_render = mocker.patch("app.tasks.render_task")
+    mock_dispatch = mocker.patch("app.tasks.dispatch_task")
+
+    start_request(fake_redis, [["a.mp4"]], ["a.mp4", "m.mp3", "tts:0"])
+    dispatch_renders("123")
+    dispatch_renders("123")
+
+    mock_render.s.assert_not_called()
+    mock_dispatch.s.assert_called_once_with("123")